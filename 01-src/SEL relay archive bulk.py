@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+File Description: Process a waveform archive (.cev, his+ser_*.txt) on all CPU cores.
+Author          : CHEN, JIA-LONG
+Create Date     : 2026-10-19 18:30
+FilePath        : \\SEL relay archive bulk.py
+Copyright © 2026 CHEN JIA-LONG.
+'''
+import argparse
+import fnmatch
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+
+import pandas as pd
+from tqdm import tqdm
+
+import module as mod
+
+# Seconds between two saves of the progress state while the pool is running.
+CHECKPOINT_SECONDS: float = 30
+
+# Suffix of the 4 samples/cyles CEV files written by the derive4 task.
+DERIVED_SUFFIX: str = " derived"
+
+# A SER record line of a his+ser report, e.g. "12 05/03/2024 10:11:12.345 OUT101 Asserted".
+SER_RECORD_PATTERN: re.Pattern = re.compile(r"^\s*\d+\s+\d{1,2}/\d{1,2}/\d{4}\s", re.M)
+
+
+def index_file(path: str, text: str) -> dict[str, Any]:
+    """
+    Extract the metadata of one archive file.
+
+    Args:
+        path (str): The file path.
+        text (str): The file content.
+
+    Returns:
+        dict[str, Any]: "type" plus module.cev_metadata() for CEV files, or "lines" and
+                        "ser_records" for his+ser reports.
+    """
+    if path.lower().endswith(".cev"):
+        return {"type": "cev", **mod.cev_metadata(text)}
+    return {
+        "type": "his+ser",
+        "lines": text.count("\n"),
+        "ser_records": len(SER_RECORD_PATTERN.findall(text)),
+    }
+
+
+def verify_file(path: str, text: str) -> dict[str, Any]:
+    """
+    Check the line checksums of one CEV file.
+
+    Args:
+        path (str): The file path.
+        text (str): The file content.
+
+    Returns:
+        dict[str, Any]: "rows", "checksum_errors" and "ok".
+    """
+    metadata: dict[str, Any] = mod.cev_metadata(text)
+    return {
+        "rows": metadata["rows"],
+        "checksum_errors": metadata["checksum_errors"],
+        "ok": metadata["checksum_errors"] == 0,
+    }
+
+
+def derive_file(path: str, text: str) -> dict[str, Any]:
+    """
+    Write the 4 samples/cyles CEV of a raw-sample CEV file next to it.
+
+    The derived file is named like the raw one, with the 4 samples/cyles command and
+    DERIVED_SUFFIX, so a 4 samples/cyles file downloaded from the relay is never
+    overwritten.
+
+    Args:
+        path (str): The raw-sample CEV file path.
+        text (str): The file content.
+
+    Returns:
+        dict[str, Any]: "output" (the derived file) or "skipped" (the reason).
+    """
+    metadata: dict[str, Any] = mod.cev_metadata(text)
+    if metadata["samples_per_cycle"] == mod.CEV_DERIVED_SAMPLES:
+        return {"skipped": "already 4 samples/cyles"}
+    command: str | None = metadata["command"]
+    derived_command: str | None = mod.derived_cev_command(metadata["fid"], command)
+    if derived_command is None:
+        return {"skipped": f"unknown raw-sample command {command!r}"}
+    stem: str = os.path.splitext(path)[0]
+    if stem.endswith(command):
+        stem = stem[: -len(command)] + derived_command
+    output: str = f"{stem}{DERIVED_SUFFIX}.cev"
+    derived: str = mod.derive_4_sample_cev(text, derived_command)
+    with open(output, "w", encoding="ascii", errors="replace", newline="") as file:
+        file.write(derived)
+    return {"output": output}
+
+
+# Bulk tasks: the per-file function and the file name patterns it processes.
+TASKS: dict[str, tuple[Callable[[str, str], dict[str, Any]], tuple[str, ...]]] = {
+    "index": (index_file, ("*.cev", "his+ser_*.txt")),
+    "verify": (verify_file, ("*.cev",)),
+    "derive4": (derive_file, ("*.cev",)),
+}
+
+
+def process_file(work: tuple[str, str, str | None]) -> dict[str, Any]:
+    """
+    Run a task on one file in a worker process, unless its content is unchanged.
+
+    Args:
+        work (tuple[str, str, str | None]): The file path, the task name and the SHA-256
+                                            of the file at the last run (or None).
+
+    Returns:
+        dict[str, Any]: "path", "hash", "size", "mtime" and either "unchanged", "result"
+                        or "error".
+    """
+    path, task, known_hash = work
+    record: dict[str, Any] = {"path": path}
+    try:
+        with open(path, "rb") as file:
+            data: bytes = file.read()
+        record.update(
+            hash=hashlib.sha256(data).hexdigest(), size=len(data), mtime=os.path.getmtime(path)
+        )
+        if record["hash"] == known_hash:
+            record["unchanged"] = True
+            return record
+        record["result"] = TASKS[task][0](path, data.decode("ascii", errors="replace"))
+    except (OSError, ValueError) as e:
+        record["error"] = str(e)
+    except Exception as e:  # A malformed file must not stop the batch
+        record["error"] = f"{type(e).__name__}: {e}"
+    return record
+
+
+def find_files(root: str, task: str) -> list[str]:
+    """
+    List the archive files a task processes, in a stable order.
+
+    Args:
+        root (str): The archive folder.
+        task (str): The task name.
+
+    Returns:
+        list[str]: The file paths.
+    """
+    patterns: tuple[str, ...] = TASKS[task][1]
+    paths: list[str] = []
+    for folder, _, names in os.walk(root):
+        for name in names:
+            if task == "derive4" and name.endswith(f"{DERIVED_SUFFIX}.cev"):
+                continue
+            if any(fnmatch.fnmatch(name.lower(), pattern) for pattern in patterns):
+                paths.append(os.path.join(folder, name))
+    return sorted(paths)
+
+
+def state_file_name(root: str, task: str) -> str:
+    """
+    Name the progress state file of a task over an archive.
+
+    Args:
+        root (str): The absolute archive folder.
+        task (str): The task name.
+
+    Returns:
+        str: The state file name, kept in the SEL download log folder.
+    """
+    return f"archive_{task}_{hashlib.sha1(root.lower().encode('utf-8')).hexdigest()[:10]}.json"
+
+
+def plan_work(
+    root: str, task: str, files: dict[str, dict[str, Any]], force: bool
+) -> tuple[list[tuple[str, str, str | None]], int]:
+    """
+    Select the files to hand to the pool.
+
+    A file whose size and modification time match the state is skipped without reading
+    it; a file that only has a new modification time is read and hashed by the worker,
+    which skips the task when the content is unchanged. Files that failed are retried
+    and files removed from the archive are dropped from the state.
+
+    Args:
+        root (str): The archive folder.
+        task (str): The task name.
+        files (dict[str, dict[str, Any]]): The state of the last runs, by relative path.
+        force (bool): Process every file again.
+
+    Returns:
+        tuple[list[tuple[str, str, str | None]], int]: The work items of process_file
+                                                       and the number of skipped files.
+    """
+    paths: list[str] = find_files(root, task)
+    for relative in set(files) - {os.path.relpath(path, root) for path in paths}:
+        del files[relative]
+    work: list[tuple[str, str, str | None]] = []
+    skipped: int = 0
+    for path in paths:
+        entry: dict[str, Any] | None = None if force else files.get(os.path.relpath(path, root))
+        if entry is not None and "error" not in entry:
+            stat: os.stat_result = os.stat(path)
+            if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                skipped += 1
+                continue
+        work.append((path, task, entry["hash"] if entry and "error" not in entry else None))
+    return work, skipped
+
+
+def save_report(task: str, files: dict[str, dict[str, Any]], output: str) -> None:
+    """
+    Write the results of every processed file of the archive to a CSV file.
+
+    Args:
+        task (str): The task name.
+        files (dict[str, dict[str, Any]]): The state, by relative path.
+        output (str): The CSV file path.
+    """
+    rows: list[dict[str, Any]] = [
+        {
+            "path": path,
+            "sha256": entry.get("hash"),
+            **entry.get("result", {}),
+            "error": entry.get("error"),
+        }
+        for path, entry in sorted(files.items())
+    ]
+    pd.DataFrame(rows).convert_dtypes().to_csv(output, index=False, encoding="utf-8-sig")
+    mod.print_log(f"{task} report of {len(rows)} files saved: {output}", logging.INFO)
+
+
+def run_bulk(args: argparse.Namespace) -> dict[str, int]:
+    """
+    Run a task over the archive on a process pool, saving the progress as it goes.
+
+    The work is handed to the pool in chunks of args.chunksize files, so the per-task
+    overhead of the pool stays small next to the file work. The state is saved every
+    CHECKPOINT_SECONDS and when stopped, so an interrupted run resumes where it stopped.
+
+    Args:
+        args (argparse.Namespace): The bulk arguments.
+
+    Returns:
+        dict[str, int]: The number of "processed", "unchanged", "skipped" and "failed"
+                        files.
+    """
+    state_name: str = state_file_name(args.dir, args.task)
+    state: dict[str, Any] = mod.load_state_file(state_name)
+    files: dict[str, dict[str, Any]] = state.setdefault("files", {})
+    state["root"] = args.dir
+
+    work, skipped = plan_work(args.dir, args.task, files, args.force)
+    counts: dict[str, int] = {"processed": 0, "unchanged": 0, "skipped": skipped, "failed": 0}
+    jobs: int = max(1, args.jobs or os.cpu_count() or 1)
+    chunksize: int = args.chunksize or max(1, min(64, len(work) // (jobs * 8)))
+    mod.print_log(
+        f"{args.task}: {len(work)} files to process, {skipped} unchanged since the last run, "
+        f"{jobs} processes, chunks of {chunksize}.",
+        logging.INFO,
+    )
+
+    saved: float = time.monotonic()
+    # The workers need the relay_models.json models too (e.g. derive4 commands).
+    executor = ProcessPoolExecutor(max_workers=jobs, initializer=mod.load_relay_models)
+    try:
+        with tqdm(total=len(work), unit="file") as bar:
+            for record in executor.map(process_file, work, chunksize=chunksize):
+                relative: str = os.path.relpath(record.pop("path"), args.dir)
+                if "error" in record:
+                    counts["failed"] += 1
+                    logging.error(f"{args.task} {relative} failed: {record['error']}")
+                    files[relative] = {**files.get(relative, {}), **record}
+                elif record.pop("unchanged", False):
+                    counts["unchanged"] += 1
+                    files[relative].update(record)
+                else:
+                    counts["processed"] += 1
+                    files[relative] = record
+                bar.update()
+                if time.monotonic() - saved >= CHECKPOINT_SECONDS:
+                    mod.save_state_file(state_name, state)
+                    saved = time.monotonic()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        mod.save_state_file(state_name, state)
+
+    save_report(args.task, files, args.output)
+    return counts
+
+
+def main() -> None:
+    """
+    Parse the arguments and run the bulk task.
+    """
+    parser = argparse.ArgumentParser(
+        description="Run a task over every waveform file of an archive on all CPU cores. "
+        "Files unchanged since the last run are skipped."
+    )
+    parser.add_argument('-d', '--dir', type=str, required=True, help='Archive folder')
+    parser.add_argument(
+        '-t',
+        '--task',
+        type=str,
+        default='index',
+        choices=list(TASKS),
+        help='index: metadata of .cev and his+ser files; verify: .cev line checksums; '
+        'derive4: write the 4 samples/cyles CEV of raw-sample .cev files. Default is index',
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int, help='Number of worker processes, default is the CPU count'
+    )
+    parser.add_argument(
+        '--chunksize',
+        type=int,
+        help='Files handed to a worker at a time, default is sized to the archive',
+    )
+    parser.add_argument(
+        '-o', '--output', type=str, help='CSV report, default is archive_<task>.csv in --dir'
+    )
+    parser.add_argument(
+        '--force', action='store_true', help='Process every file again, ignoring the state'
+    )
+    parser.add_argument(
+        '-log',
+        '--log',
+        type=str.upper,
+        default='INFO',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+        help='Log level, default is INFO',
+    )
+    args: argparse.Namespace = parser.parse_args()
+
+    log_folder: str = mod.get_or_create_sel_download_log_folder()
+    mod.rotate_log_folder(log_folder)
+    mod.logger_init(
+        out_path=log_folder, log_name="SEL archive.log", log_level=getattr(logging, args.log)
+    )
+    args.dir = os.path.realpath(args.dir)
+    if not os.path.isdir(args.dir):
+        mod.print_log(f"Archive folder not found: {args.dir}", logging.ERROR)
+        return
+    args.output = args.output or os.path.join(args.dir, f"archive_{args.task}.csv")
+
+    started: float = time.monotonic()
+    counts: dict[str, int] = run_bulk(args)
+    mod.print_log(
+        f"{args.task} done in {time.monotonic() - started:.1f}s: "
+        + ", ".join(f"{count} {name}" for name, count in counts.items()),
+        logging.INFO,
+    )
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Worker processes of the PyInstaller executable
+    try:
+        main()
+    except KeyboardInterrupt:
+        mod.print_log("Bulk run stopped, the next run resumes from the saved state.", logging.INFO)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        logging.error(f"An error occurred: {e}")
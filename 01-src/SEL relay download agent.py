@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+File Description: Local download agent that keeps logged-in SEL relay sessions open.
+Author          : CHEN, JIA-LONG
+Create Date     : 2026-10-19 11:00
+FilePath        : \\SEL relay download agent.py
+Copyright © 2026 CHEN JIA-LONG.
+'''
+import argparse
+import asyncio
+import json
+import logging
+from typing import Any
+
+import module as mod
+
+pool: mod.SessionPool | None = None
+
+
+def on_exit(event: str) -> bool:
+    """
+    Log termination signals; the server is cancelled and the pool closes its sessions.
+
+    Args:
+        event (str): The name of the signal, e.g. "SIGTERM".
+
+    Returns:
+        bool: True, the event was handled.
+    """
+    mod.print_log(f"Console event {event} occurred. Stop agent...", logging.INFO)
+    return True
+
+
+async def run_download(request: dict[str, Any]) -> dict[str, Any]:
+    """
+    Run one download job on the pooled session of the relay.
+
+    A job that fails on a reused session (e.g. the relay dropped it) is retried once on
+    a new session.
+
+    Args:
+        request (dict[str, Any]): "ip", "dir" and optionally "port", "samples", "cyles",
+                                  "event_id", "auto_cyles", "priority", "time_budget",
+                                  "progressive", "derive_4", "validate_derived" and the
+                                  event query "since", "until", "latest" and "match".
+
+    Returns:
+        dict[str, Any]: The result of module.download_session plus "ok".
+    """
+    ip: str = request.get("ip", "")
+    if not mod.is_valid_ip(ip):
+        raise ValueError(f"Invalid SEL Relay IP: {ip}")
+    save_path: str = mod.select_folder(path_arg=request.get("dir"), headless=True)
+    port: int = int(request.get("port", 23))
+    event_ids: list[str] = mod.expand_event_ids(request.get("event_id") or "")
+    select_events = mod.request_event_query(request, event_ids)
+
+    for attempt in (1, 2):
+        try:
+            async with pool.session(ip, port) as client:
+                result: dict[str, Any] = await mod.download_session(
+                    client=client,
+                    save_path=save_path,
+                    samples=request.get("samples"),
+                    cyles=request.get("cyles"),
+                    event_ids=event_ids,
+                    select_events=select_events,
+                    auto_cyles=bool(request.get("auto_cyles")),
+                    interactive=False,
+                    login=False,
+                    priority=request.get("priority", mod.DEFAULT_PRIORITY),
+                    time_budget=request.get("time_budget"),
+                    progressive=request.get("progressive"),
+                    derive_4=bool(request.get("derive_4")),
+                    validate_derived=bool(request.get("validate_derived")),
+                )
+            return {"ok": True, **result}
+        except ConnectionError as e:
+            if attempt == 2:
+                raise
+            mod.print_log(
+                f"Session to {ip}:{port} failed ({e}), retry on a new one.", logging.WARN
+            )
+
+
+async def handle_request(request: dict[str, Any]) -> dict[str, Any]:
+    """
+    Dispatch one agent request.
+
+    Args:
+        request (dict[str, Any]): The request; "cmd" is "download" (default), "status"
+                                  or "close" (with optional "ip" / "port").
+
+    Returns:
+        dict[str, Any]: The reply.
+    """
+    command: str = request.get("cmd", "download")
+    if command == "download":
+        return await run_download(request)
+    if command == "status":
+        return {"ok": True, "sessions": pool.status()}
+    if command == "close":
+        key: str | None = None
+        if request.get("ip"):
+            key = f"{request['ip']}:{int(request.get('port', 23))}"
+        await pool.close(key)
+        return {"ok": True}
+    raise ValueError(f"Unknown command: {command}")
+
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """
+    Serve the JSON-line requests of one local connection, one reply line per request.
+
+    Args:
+        reader (asyncio.StreamReader): The connection reader.
+        writer (asyncio.StreamWriter): The connection writer.
+    """
+    try:
+        while line := await reader.readline():
+            try:
+                request: dict[str, Any] = json.loads(line)
+                logging.info(f"Agent request: {request}")
+                reply: dict[str, Any] = await handle_request(request)
+            except Exception as e:
+                logging.error(f"Agent request failed: {e}")
+                reply = {"ok": False, "error": str(e)}
+            writer.write(json.dumps(reply, default=str).encode("utf-8") + b"\n")
+            await writer.drain()
+    except ConnectionError as e:
+        logging.debug(f"Agent client disconnected: {e}")
+    finally:
+        writer.close()
+
+
+async def main() -> None:
+    """
+    Parse the arguments and serve download jobs on localhost until stopped.
+    """
+    global pool
+    parser = argparse.ArgumentParser(
+        description="Keep SEL Relay sessions logged in and run download jobs sent over "
+        "a localhost socket."
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=mod.AGENT_PORT,
+        help=f'Local port of the agent, default is {mod.AGENT_PORT}',
+    )
+    parser.add_argument(
+        '--idle_timeout',
+        type=float,
+        default=mod.SESSION_IDLE_TIMEOUT,
+        help='Seconds an unused relay session stays open, default is '
+        f'{mod.SESSION_IDLE_TIMEOUT:g}',
+    )
+    parser.add_argument(
+        '-log',
+        '--log',
+        type=str.upper,
+        default='INFO',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+        help='Log level, default is INFO',
+    )
+    args: argparse.Namespace = parser.parse_args()
+
+    log_folder: str = mod.get_or_create_sel_download_log_folder()
+    mod.rotate_log_folder(log_folder)
+    mod.logger_init(
+        out_path=log_folder, log_name="SEL agent.log", log_level=getattr(logging, args.log)
+    )
+    mod.load_relay_models()
+
+    pool = mod.SessionPool(idle_timeout=args.idle_timeout)
+    server: asyncio.AbstractServer = await asyncio.start_server(
+        handle_connection, host=mod.AGENT_HOST, port=args.port
+    )
+    reaper: asyncio.Task = asyncio.ensure_future(pool.run_reaper())
+    mod.print_log(f"Download agent listening on {mod.AGENT_HOST}:{args.port}.", logging.INFO)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        reaper.cancel()
+        await pool.close()
+
+
+if __name__ == "__main__":
+    try:
+        if not mod.IS_WINDOWS:
+            mod.install_exit_handler(on_exit)
+        mod.run_async(main(), use_uvloop=not mod.IS_WINDOWS)
+    except KeyboardInterrupt:
+        mod.print_log("Download agent stopped.", logging.INFO)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        logging.error(f"An error occurred: {e}")
@@ -11,11 +11,7 @@ import argparse
 import asyncio
 import logging
 import os
-from datetime import datetime
-from typing import List, Tuple
-
-import win32api
-import win32con
+import sys
 
 import module as mod
 
@@ -41,45 +37,34 @@ async def async_close_client() -> None:
         mod.print_log("Force Closed SEL Relay connection.", logging.INFO)
 
 
-def on_exit(event) -> bool:
+def on_exit(event: str) -> bool:
     """
-    Handles various console events by performing necessary cleanup operations and logging the event.
+    Handles console close and termination events by performing necessary cleanup
+    operations and logging the event.
 
     Args:
-        event: The event that triggered this handler.
+        event (str): The name of the event that triggered this handler, e.g. "CTRL_C_EVENT"
+                     on Windows or "SIGTERM" on POSIX.
 
     Returns:
-        bool: True if the event was handled, False otherwise.
+        bool: True if the event was handled.
     """
-    if event in [
-        win32con.CTRL_C_EVENT,
-        win32con.CTRL_BREAK_EVENT,
-        win32con.CTRL_CLOSE_EVENT,
-        win32con.CTRL_LOGOFF_EVENT,
-        win32con.CTRL_SHUTDOWN_EVENT,
-    ]:
-        event_map: dict[int, str] = {
-            win32con.CTRL_C_EVENT: "CTRL_C_EVENT",
-            win32con.CTRL_BREAK_EVENT: "CTRL_BREAK_EVENT",
-            win32con.CTRL_CLOSE_EVENT: "CTRL_CLOSE_EVENT",
-            win32con.CTRL_LOGOFF_EVENT: "CTRL_LOGOFF_EVENT",
-            win32con.CTRL_SHUTDOWN_EVENT: "CTRL_SHUTDOWN_EVENT",
-        }
-        mod.print_log(
-            f"Console event {event_map[event]} occurred. Performing cleanup...", logging.INFO
-        )
-        if client is not None:
-            try:
-                loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(async_close_client())
-                loop.close()
-            except Exception as e:
-                mod.print_log(f"Force close sel relay have error: {e}", logging.ERROR)
-        else:
-            logging.error("Client is None. No Sel relay connect.")
-        return True  # 返回True告訴系統我們已經處理了這個事件
-    return False
+    mod.print_log(f"Console event {event} occurred. Performing cleanup...", logging.INFO)
+    if not mod.IS_WINDOWS:
+        # POSIX signals arrive on the event loop thread; main() is cancelled and the
+        # TelnetClient context closes the connection.
+        return True
+    if client is not None:
+        try:
+            loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(async_close_client())
+            loop.close()
+        except Exception as e:
+            mod.print_log(f"Force close sel relay have error: {e}", logging.ERROR)
+    else:
+        logging.error("Client is None. No Sel relay connect.")
+    return True
 
 
 async def main() -> None:
@@ -87,6 +72,7 @@ async def main() -> None:
     Main function to create a Telnet client, send a command, and print the response.
     """
     global client  # 宣告全域變數
+    profiler: mod.RunProfiler | None = None
     try:
         # Define valid log levels
         LOG_LEVELS: dict[str, int] = {
@@ -98,6 +84,13 @@ async def main() -> None:
         }
         parser = argparse.ArgumentParser(description="Download event data from SEL Relay.")
         parser.add_argument('-c', '--cyles', type=int, help='Event Length (Cyles) to download')
+        parser.add_argument(
+            '-a',
+            '--auto_cyles',
+            action='store_true',
+            help='Find the largest valid Event Length (Cyles) for each event automatically, '
+            'never prompt. -c is used as the upper bound when given.',
+        )
         parser.add_argument(
             '-s',
             '--samples',
@@ -117,6 +110,137 @@ async def main() -> None:
             help="Comma-separated Event IDs to download. Use ',' to separate events "
             "and '-' to specify a range (e.g., '1,2,5-8,10').",
         )  # Allow multiple event IDs
+        parser.add_argument(
+            '--log_payload',
+            choices=mod.LOG_PAYLOAD_MODES,
+            default='full',
+            help='How responses and CEV contents are logged: full (default) or compact '
+            '(hash, size and excerpt).',
+        )
+        parser.add_argument(
+            '--headless',
+            action='store_true',
+            help='Run without any dialog, prompt or progress bar (e.g. Linux collection '
+            'servers). Needs -i and -d; uses uvloop when it is installed.',
+        )
+        parser.add_argument(
+            '--agent',
+            type=int,
+            nargs='?',
+            const=mod.AGENT_PORT,
+            metavar='PORT',
+            help='Send the job to the local download agent, which reuses its logged-in '
+            f'session to the relay (default port {mod.AGENT_PORT}). Runs directly when no '
+            'agent is running.',
+        )
+        parser.add_argument(
+            '--no_pipeline',
+            action='store_true',
+            help='Send HIS / CHI / SER queries one at a time instead of back-to-back '
+            '(for gateways that drop type-ahead input).',
+        )
+        parser.add_argument(
+            '--gateway',
+            type=str,
+            metavar='PROFILE',
+            help='-i / -p is a communications processor (profile name, e.g. sel2030); '
+            'download every relay of --gateway_ports over one session.',
+        )
+        parser.add_argument(
+            '--gateway_ports',
+            type=str,
+            help="Relay ports behind the gateway, e.g. '1-4,7'.",
+        )
+        parser.add_argument(
+            '--capture',
+            type=str,
+            metavar='FILE',
+            help='Record the session byte stream with timestamps into a capture file.',
+        )
+        parser.add_argument(
+            '--replay',
+            type=str,
+            metavar='FILE',
+            help='Play a capture file back instead of connecting to the relay.',
+        )
+        parser.add_argument(
+            '--replay_speed',
+            type=float,
+            default=1.0,
+            help='Replay speed factor, 0 replays as fast as possible. Default is 1.',
+        )
+        parser.add_argument(
+            '--since',
+            type=str,
+            help="Select events at or after a time: relative ('24h', '7d') or a date / "
+            "date time ('2024-05-03 10:00'), relay clock.",
+        )
+        parser.add_argument(
+            '--until', type=str, help='Select events at or before a time, like --since.'
+        )
+        parser.add_argument(
+            '--latest', type=int, metavar='N', help='Select only the newest N matching events.'
+        )
+        parser.add_argument(
+            '--match',
+            type=str,
+            metavar='REGEX',
+            help="Select events whose CHI EVENT text matches a regular expression, or 'trip'.",
+        )
+        parser.add_argument(
+            '--priority',
+            type=str,
+            default=",".join(mod.DEFAULT_PRIORITY),
+            help='Download order rules, first rule decides: '
+            f'{", ".join(mod.PRIORITY_RULES)} or none (CHI order). '
+            f'Default is {",".join(mod.DEFAULT_PRIORITY)}',
+        )
+        parser.add_argument(
+            '--progressive',
+            type=str,
+            nargs='?',
+            const='all',
+            metavar='EVENTS',
+            help='Download 4 samples/cyles of every event first, then raw samples of all '
+            "events (default), 'trip' events or the given event IDs, e.g. '1,3'. "
+            'Replaces -s.',
+        )
+        parser.add_argument(
+            '--derive_4',
+            action='store_true',
+            help='Download raw samples only and derive the 4 samples/cyles CEV locally '
+            '(cosine filter and decimation). Replaces -s.',
+        )
+        parser.add_argument(
+            '--validate_derived',
+            action='store_true',
+            help='With --derive_4, also download the relay 4 samples/cyles CEV and compare '
+            'it with the derived one.',
+        )
+        parser.add_argument(
+            '--time_budget',
+            type=float,
+            metavar='SECONDS',
+            help='Stop starting CEV downloads once the session has used this many seconds; '
+            'the skipped events are listed in a journal file.',
+        )
+        parser.add_argument(
+            '--dry_run',
+            action='store_true',
+            help='Read ID, HIS and CHI only and print the SER / CEV commands that would be '
+            'sent with their estimated size and duration.',
+        )
+        parser.add_argument(
+            '--profile',
+            action='store_true',
+            help='Record a CPU profile, asyncio slow callbacks and event loop lag into '
+            'the SEL download log folder.',
+        )
+        parser.add_argument(
+            '--no_progress',
+            action='store_true',
+            help='Do not show the transfer progress bar (headless or fleet runs).',
+        )
 
         args: argparse.Namespace
         unknown: list[str]
@@ -129,6 +253,8 @@ async def main() -> None:
             print(f"SEL Relay IP port: {args.port}")
         if args.cyles is not None:
             print(f"Download Event Length (Cyles): {args.cyles}")
+        if args.auto_cyles:
+            print("Download Event Length (Cyles): auto")
         if args.samples is not None:
             print(f"Download Samples/Cyles (4 or all): {args.samples}")
         if args.event_id is not None:
@@ -145,179 +271,167 @@ async def main() -> None:
                     log_level: int = LOG_LEVELS[log_level_str]
                     break
         log_folder: str = mod.get_or_create_sel_download_log_folder()
+        mod.rotate_log_folder(log_folder)
+        mod.set_log_payload_mode(args.log_payload)
+        mod.load_relay_models()
+        mod.load_gateway_profiles()
+        if args.gateway and args.gateway not in mod.GATEWAY_PROFILES:
+            raise ValueError(f"Unknown gateway profile: {args.gateway}")
+        if args.gateway and not args.gateway_ports:
+            raise ValueError("--gateway needs --gateway_ports.")
+        gateway_ports: list = [None]
+        if args.gateway:
+            gateway_ports = [int(port) for port in mod.expand_event_ids(args.gateway_ports)]
+            if not gateway_ports:
+                raise ValueError(f"Invalid --gateway_ports: {args.gateway_ports!r}")
+        if args.validate_derived and not args.derive_4:
+            raise ValueError("--validate_derived needs --derive_4.")
+        if args.derive_4 and args.progressive:
+            raise ValueError("--derive_4 and --progressive cannot be combined.")
+        priority: list[str] = [
+            rule.strip().lower() for rule in args.priority.split(",") if rule.strip()
+        ]
+        if priority == ["none"]:
+            priority = []
+        mod.order_events([], priority)  # Reject unknown rules before connecting
+        event_ids: list[str] = mod.expand_event_ids(args.event_id if args.event_id else "")
+        select_events = None
+        if args.since or args.until or args.latest or args.match:
+            select_events = mod.event_query(
+                since=args.since,
+                until=args.until,
+                latest=args.latest,
+                match=args.match,
+                event_ids=event_ids or None,
+            )
         if log_level is not None:
             mod.logger_init(out_path=log_folder, log_level=log_level)
             logging.info("Log file created, start record main process.")
             print(f"Log enable: {log_level_str}")
         else:
             mod.error_logger_init(out_path=log_folder)
+        if args.profile:
+            profiler = mod.RunProfiler(out_path=log_folder)
+            profiler.start()
 
         # Validate the IP address
+        if args.replay:
+            capture_header: dict = mod.read_capture(args.replay)[0]
+            args.ip = capture_header.get("ip", args.ip)
+            args.port = capture_header.get("port", args.port)
+        if args.headless and not (args.ip and mod.is_valid_ip(args.ip)):
+            raise ValueError("Headless mode needs a valid SEL Relay IP (-i).")
         ip: str = args.ip if args.ip and mod.is_valid_ip(args.ip) else mod.get_ip()
 
         encoding = "utf-8"  # Replace with the character encoding used by PuTTY
 
         select_folder: str = "Please select the folder where you want to store the waveform file."
-        save_path: str = mod.select_folder(windows_title=f"{select_folder}", path_arg=args.dir)
-
-        async with mod.TelnetClient(ip=ip, port=args.port, encoding=encoding) as client:
-            his_ser_responses: list = []
-            fid: str = None
-            fid: str | None = await client.get_fid(retries=5)
-            mod.print_log(message=f"FID= {fid}", log_level=logging.INFO)
+        save_path: str = (
+            args.dir or ""  # Nothing is saved in a dry run
+            if args.dry_run
+            else mod.select_folder(
+                windows_title=f"{select_folder}", path_arg=args.dir, headless=args.headless
+            )
+        )
 
-            model: str = "other"
-            if "311L" in fid or "351" in fid or "311C" in fid:
-                model = "311L_351"
-            elif "487E" in fid:
-                model = "487E"
-            elif "487B" in fid:
-                model = "487B"
+        # The agent cannot prompt, so a job without samples or events is downloaded directly.
+        agent_job_complete: bool = bool(
+            (args.samples or args.progressive or args.derive_4) and (event_ids or select_events)
+        )
+        if args.agent and not args.dry_run and not agent_job_complete:
+            mod.print_log(
+                "Download agent needs --samples and --event_id (or an event query), "
+                "download directly.",
+                logging.INFO,
+            )
+        elif args.agent and not args.dry_run:
+            job: dict = {
+                "cmd": "download",
+                "ip": ip,
+                "port": args.port,
+                "dir": save_path,
+                "samples": args.samples,
+                "cyles": args.cyles,
+                "event_id": args.event_id,
+                "auto_cyles": args.auto_cyles,
+                "priority": priority,
+                "time_budget": args.time_budget,
+                "progressive": args.progressive,
+                "derive_4": args.derive_4,
+                "validate_derived": args.validate_derived,
+                "since": args.since,
+                "until": args.until,
+                "latest": args.latest,
+                "match": args.match,
+            }
+            try:
+                reply: dict = await mod.submit_agent_job(job, port=args.agent)
+            except OSError as e:
+                mod.print_log(f"Download agent unavailable ({e}), download directly.", logging.INFO)
             else:
-                model = "other"
-            logging.debug(f"Model variable = {model}")
-
-            his_ser_responses.append(f"Connect IP: {ip}")
-            # Get current time save in his+ser data.
-            now: datetime = datetime.now()
-            formatted_time: str = now.strftime("%Y/%m/%d %A %H:%M:%S.%f")
+                if not reply.get("ok"):
+                    raise RuntimeError(f"Download agent: {reply.get('error')}")
+                for path in reply.get("files", []):
+                    print(f"Saved: {path}")
+                for filename in reply.get("failed", []):
+                    print(f"Failed to download waveform file: {filename}")
+                return
 
-            his_ser_responses.append(f"Current computer time: {formatted_time}")
-            his_ser_responses.append("==================================================\n")
-            # Collect responses for HIS commands
-            for command in ["ACC", "PASS", "HIS"]:
+        progress = mod.ProgressReporter(enabled=not (args.no_progress or args.headless))
+        async with mod.TelnetClient(
+            ip=ip,
+            port=args.port,
+            encoding=encoding,
+            progress=progress,
+            pipeline=not args.no_pipeline,
+            capture_path=args.capture,
+            replay_path=args.replay,
+            replay_speed=args.replay_speed,
+            gateway=args.gateway,
+        ) as client:
+            for gateway_port in gateway_ports:
+                port_path: str = save_path
                 try:
-                    if not client.writer.is_closing():
-                        response: str = await client.send_command(command)
-                        print(f"Response from SEL Relay: {response}")
-                        his_ser_responses.append(response)
-                    else:
-                        mod.print_log(
-                            f"Writer is already closing. Command: {command}", logging.WARN
+                    if gateway_port is not None:
+                        # Relays behind one gateway often share a device ID, keep them apart
+                        port_path = os.path.join(save_path, f"port_{gateway_port}")
+                        os.makedirs(port_path, exist_ok=True)
+                        await client.switch_port(gateway_port)
+                    if args.dry_run:
+                        plan: dict = await mod.plan_session(
+                            client=client,
+                            samples=args.samples,
+                            cyles=args.cyles,
+                            event_ids=event_ids,
+                            select_events=select_events,
+                            auto_cyles=args.auto_cyles,
+                            interactive=not args.headless,
+                            priority=priority,
+                            progressive=args.progressive,
+                            derive_4=args.derive_4,
+                            validate_derived=args.validate_derived,
                         )
-                except ConnectionError as e:
-                    mod.print_log(f"Writer is already closing. Command: {command}", logging.WARN)
-                except Exception as e:
-                    logging.error(f"Error during {command} command: {e}")
-                    continue  # Skip to the next command if an error occurs
-
-            # Convert event_id argument to a list if provided
-            event_ids: list[int] = mod.expand_event_ids(args.event_id if args.event_id else "")
-            chi_response: str = await client.send_command("CHI")
-            try:
-                valid_events: List[Tuple[str]] = mod.parse_chi_response(
-                    chi_in=chi_response, event_ids_arg=event_ids
-                )
-            except mod.CancelSignal as e:
-                mod.print_log(e, logging.INFO)
-                mod.create_cancel_file(save_path, his_ser_responses)
-                return
-            # Validate samples argument
-            samples: str = args.samples.lower() if args.samples in ['4', 'all', 'ALL'] else '0'
-            while samples != "4" and samples.lower() != "all":
-                samples = input("Please enter Samples/Cyles (4 or all) to download: ")
-                if samples != "4" and samples.lower() != "all":
-                    print("Samples/Cyles can only enter 4 or all, please enter again.")
-            logging.debug(f"samples：{samples}")
-
-            # Validate cyles argument
-            download_cyles: str = (
-                str(args.cyles)
-                if hasattr(args, 'cyles')
-                and args.cyles is not None
-                and mod.is_positive_integer(str(args.cyles))
-                else ''
-            )
-            logging.debug(f"download cyles：{download_cyles}")
-            if not download_cyles:
-                while True:
-                    try:
-                        download_cyles = input(
-                            "Please enter Event Length (Cyles) to download (or 'exit' to exit): "
-                        ).strip()
-                        if download_cyles.lower() == "exit":
-                            print("!!!User cancel download.!!!")
-                            mod.create_cancel_file(save_path, his_ser_responses)
-                            return
-                        elif mod.is_positive_integer(download_cyles):
-                            print(f"Valid Event Length (Cyles) entered: {download_cyles}")
-                            break
-                        else:
-                            download_cyles = ''
-                            print("Invalid input. Please enter a positive integer.")
-                    except Exception as e:
-                        # 捕捉其他例外，避免無限迴圈
-                        mod.print_log(f"An error occurred: {e}. Exiting.", logging.ERROR)
-                        return
-
-            # Get SEL Relay Name
-            device_id: str | None = await client.get_relay_name()
-
-            # Download SER data.
-            downloaded_date: list = []
-            ser_records: list = []
-            logging.debug(f"vaild_events variable: \n{valid_events}\n")
-            for event_id, date, event_date_time, trip_event in valid_events:
-                if date not in downloaded_date:
-                    ser_response: str = await client.send_command(
-                        f"SER {mod.get_previous_day(date_str=date)} {date}"
+                        mod.print_log(mod.format_plan(plan), logging.INFO)
+                        continue
+                    await mod.download_session(
+                        client=client,
+                        save_path=port_path,
+                        samples=args.samples,
+                        cyles=args.cyles,
+                        event_ids=event_ids,
+                        select_events=select_events,
+                        auto_cyles=args.auto_cyles,
+                        interactive=not args.headless,
+                        priority=priority,
+                        time_budget=args.time_budget,
+                        progressive=args.progressive,
+                        derive_4=args.derive_4,
+                        validate_derived=args.validate_derived,
                     )
-                    print(f"Response from SEL Relay: {ser_response}")
-                    his_ser_responses.append(ser_response)
-                    ser_records.append(ser_response)
-                    downloaded_date.append(date)
-
-            # Check for None, case-insensitive "invalid", or "No SER Data"
-            if any(
-                response is None
-                or any(substring in response.lower() for substring in ["invalid", "no ser data"])
-                for response in ser_records
-            ):
-                ser_response: str = await client.send_command("SER 50")
-                print(f"Response from SEL Relay: {ser_response}")
-                his_ser_responses.append(ser_response)
-
-            # Set and create his+ser filename
-            if device_id:
-                his_ser_filename: str = f"his+ser_{device_id}_{event_date_time}"
-            else:
-                his_ser_filename: str = f"his+ser_{event_date_time}"
-            his_ser_filename = mod.clean_filename(his_ser_filename)  # Clean the filename
-
-            his_ser_path_file: str = os.path.join(save_path, f"{his_ser_filename}.txt")
-            logging.debug(f"Save his+ser path+filename:{his_ser_path_file}")
-            logging.debug(f"his+ser file content:\n{his_ser_responses}")
-            with open(his_ser_path_file, "w", encoding="utf-8") as file:
-                file.write("\n".join(his_ser_responses))
-
-            logging.debug(f"vaild_events variable: \n{valid_events}\n")
-            for event_id, date, event_date_time, trip_event in valid_events:
-                cev_response: str = None
-                cev_command: str = None
-
-                # Download waveform
-                logging.debug(f"In for round, event_id variable: {event_id}")
-                cev_response, download_cyles, cev_command = await client.download_waveform(
-                    event_id=event_id, cyles=download_cyles, samples=samples, model=model
-                )
-
-                # Set cev filename
-                if device_id:
-                    cev_filename = f"{device_id}_{event_date_time}_{trip_event}_{cev_command}"
-                else:
-                    cev_filename: str = f"{cev_command}_{trip_event}_{event_date_time}"
-                cev_filename = mod.clean_filename(cev_filename)  # Clean the filename
-
-                # Save cev file
-                if cev_response is None:
-                    with open(his_ser_path_file, "a", encoding="utf-8") as file:
-                        file.write(f"\nFailed to download waveform file: {cev_filename}.cev")
-                else:
-                    cev_path_filename: str = os.path.join(save_path, f"{cev_filename}.cev")
-                    logging.debug(f"CEV filename & path: {cev_path_filename}")
-                    logging.debug(f"CEV content:\n{cev_response}")
-                    with open(cev_path_filename, "w", encoding="utf-8") as file:
-                        file.write(cev_response)
+                except ConnectionError as e:
+                    if gateway_port is None:
+                        raise
+                    mod.print_log(f"Gateway port {gateway_port} failed: {e}", logging.WARN)
 
     except ConnectionError as e:
         mod.print_log(f"An connect error occurred: {e}", logging.WARN)
@@ -325,14 +439,21 @@ async def main() -> None:
     except Exception as e:
         print(f"An error occurred: {e}")
         logging.error(f"An error occurred: {e}")
+    finally:
+        if profiler is not None:
+            profiler.stop()
 
 
 if __name__ == "__main__":
+    headless: bool = "--headless" in sys.argv[1:]
     try:
-        win32api.SetConsoleCtrlHandler(on_exit, True)
-        asyncio.run(main())
+        mod.install_exit_handler(on_exit)
+        mod.run_async(main(), use_uvloop=headless)
+    except KeyboardInterrupt:
+        mod.print_log("Download interrupted.", logging.WARN)
     except Exception as e:
         print(f"An error occurred: {e}")
         logging.error(f"An error occurred: {e}")
     print("Wishing you all the best in your work.")
-    input("All programs have been completed, please enter any key to end.")
+    if not headless and sys.stdin.isatty():
+        input("All programs have been completed, please enter any key to end.")
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+File Description: Poll a list of SEL relays and download new events as they appear.
+Author          : CHEN, JIA-LONG
+Create Date     : 2026-10-19 09:30
+FilePath        : \\SEL relay download daemon.py
+Copyright © 2026 CHEN JIA-LONG.
+'''
+import argparse
+import asyncio
+import logging
+import random
+from datetime import datetime
+
+import module as mod
+
+DAEMON_STATE_FILE: str = "daemon_state.json"
+
+# A relay whose download keeps failing is moved past the new event after this many polls.
+MAX_DOWNLOAD_ATTEMPTS: int = 3
+
+
+def jittered(interval: float, jitter: float) -> float:
+    """
+    Spread a poll interval randomly by ±jitter, so relays are not polled in lockstep.
+
+    Args:
+        interval (float): The nominal poll interval in seconds.
+        jitter (float): The relative spread, e.g. 0.2 for ±20%.
+
+    Returns:
+        float: The interval to sleep, in seconds.
+    """
+    return interval * random.uniform(1 - jitter, 1 + jitter)
+
+
+def on_exit(event: str) -> bool:
+    """
+    Log termination signals; the poll tasks are cancelled and close their sessions.
+
+    Args:
+        event (str): The name of the signal, e.g. "SIGTERM".
+
+    Returns:
+        bool: True, the event was handled.
+    """
+    mod.print_log(f"Console event {event} occurred. Stop polling...", logging.INFO)
+    return True
+
+
+async def poll_relay(
+    ip: str,
+    port: int,
+    args: argparse.Namespace,
+    state: dict,
+    download_limit: asyncio.Semaphore,
+) -> None:
+    """
+    Poll one relay forever and download the events newer than the last known one.
+
+    The session is kept open and logged in between polls, so each poll costs one short
+    probe command. The full SER / CEV download only runs when the newest event changed.
+    A relay seen for the first time only records its newest event as the baseline.
+    A failed poll (lost link or a malformed reply) drops the session and the relay is
+    polled again at the next interval.
+
+    Args:
+        ip (str): The relay IP address.
+        port (int): The relay Telnet port.
+        args (argparse.Namespace): The daemon arguments.
+        state (dict): The shared daemon state, saved to DAEMON_STATE_FILE.
+        download_limit (asyncio.Semaphore): Limits the number of concurrent downloads.
+    """
+    relay_key: str = f"{ip}:{port}"
+    client: mod.TelnetClient | None = None
+    await asyncio.sleep(random.uniform(0, args.interval))  # Spread the first polls
+    try:
+        while True:
+            try:
+                if client is None:
+                    client = mod.TelnetClient(
+                        ip=ip, port=port, progress=mod.ProgressReporter(enabled=False)
+                    )
+                    await client.connect()
+                    await client.get_identity(retries=3)
+                    await client.login()
+
+                newest: tuple | None = await client.probe_newest_event()
+                relay_state: dict = state.setdefault(relay_key, {})
+                known: list | None = relay_state.get("newest")
+                logging.debug(f"{relay_key} newest event {newest}, known {known}.")
+
+                if newest is None:
+                    pass
+                elif known is None:
+                    relay_state["newest"] = list(newest)
+                    mod.print_log(f"{relay_key} baseline event: {newest}", logging.INFO)
+                elif list(newest) != known:
+                    since: str = known[0]
+                    mod.print_log(f"{relay_key} new event since {since}: {newest}", logging.INFO)
+
+                    async with download_limit:
+                        result: dict = await mod.download_session(
+                            client=client,
+                            save_path=args.dir,
+                            samples=args.samples,
+                            cyles=args.cyles,
+                            auto_cyles=True,
+                            interactive=False,
+                            login=False,
+                            select_events=mod.event_query(after=since, match=args.match),
+                        )
+                    attempts: int = relay_state.get("attempts", 0) + 1
+                    if not result["failed"] or attempts >= MAX_DOWNLOAD_ATTEMPTS:
+                        relay_state["newest"] = list(newest)
+                        relay_state["attempts"] = 0
+                    else:
+                        relay_state["attempts"] = attempts
+                        logging.error(
+                            f"{relay_key} failed to download {result['failed']}, "
+                            f"attempt {attempts}/{MAX_DOWNLOAD_ATTEMPTS}."
+                        )
+                    relay_state["last_download"] = datetime.now().isoformat(timespec="seconds")
+
+                relay_state["last_poll"] = datetime.now().isoformat(timespec="seconds")
+                mod.save_state_file(DAEMON_STATE_FILE, state)
+
+            except Exception as e:  # One bad reply must not end the polling of this relay
+                if isinstance(e, (ConnectionError, OSError, asyncio.TimeoutError)):
+                    mod.print_log(f"{relay_key} poll failed: {e}", logging.WARN)
+                else:
+                    logging.exception(f"{relay_key} poll failed: {e}")
+                if client is not None:
+                    try:
+                        await client.close()
+                    except Exception as close_error:
+                        logging.debug(f"{relay_key} close after failure: {close_error}")
+                    client = None
+
+            await asyncio.sleep(jittered(args.interval, args.jitter))
+    finally:
+        if client is not None and client.writer and not client.writer.is_closing():
+            await client.close()
+
+
+async def main() -> None:
+    """
+    Parse the arguments and poll every relay of the relay list concurrently.
+    """
+    parser = argparse.ArgumentParser(
+        description="Poll SEL Relays and download new events as soon as they appear."
+    )
+    parser.add_argument(
+        '-l', '--relays', type=str, required=True, help='Relay list file, one IP[:port] per line'
+    )
+    parser.add_argument(
+        '-d', '--dir', type=str, required=True, help='Directory to save waveform files'
+    )
+    parser.add_argument(
+        '-s',
+        '--samples',
+        type=str,
+        default='4',
+        choices=['4', 'all', 'ALL'],
+        help='Samples/Cyles to download (4 or all), default is 4',
+    )
+    parser.add_argument(
+        '-c', '--cyles', type=int, help='Longest Event Length (Cyles) to try, default is auto'
+    )
+    parser.add_argument(
+        '--match',
+        type=str,
+        metavar='REGEX',
+        help="Only download new events whose CHI EVENT text matches, e.g. 'trip'",
+    )
+    parser.add_argument(
+        '--interval', type=float, default=300, help='Seconds between two polls, default is 300'
+    )
+    parser.add_argument(
+        '--jitter',
+        type=float,
+        default=0.2,
+        help='Random spread of the poll interval (0.2 = ±20%%), default is 0.2',
+    )
+    parser.add_argument(
+        '--max_downloads',
+        type=int,
+        default=2,
+        help='Maximum number of relays downloading at the same time, default is 2',
+    )
+    parser.add_argument(
+        '-log',
+        '--log',
+        type=str.upper,
+        default='INFO',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+        help='Log level, default is INFO',
+    )
+    args: argparse.Namespace = parser.parse_args()
+
+    log_folder: str = mod.get_or_create_sel_download_log_folder()
+    mod.rotate_log_folder(log_folder)
+    mod.logger_init(
+        out_path=log_folder, log_name="SEL daemon.log", log_level=getattr(logging, args.log)
+    )
+    mod.load_relay_models()
+    save_path: str = mod.select_folder(path_arg=args.dir, headless=True)
+    args.dir = save_path
+
+    relays: list = mod.load_relay_list(args.relays)
+    if not relays:
+        mod.print_log(f"No valid relay in {args.relays}.", logging.ERROR)
+        return
+    mod.print_log(
+        f"Polling {len(relays)} relays every {args.interval}s (±{args.jitter:.0%}).", logging.INFO
+    )
+
+    state: dict = mod.load_state_file(DAEMON_STATE_FILE)
+    download_limit = asyncio.Semaphore(args.max_downloads)
+    # A relay task that still ends with an error must not stop the polling of the others.
+    results: list = await asyncio.gather(
+        *(poll_relay(ip, port, args, state, download_limit) for ip, port in relays),
+        return_exceptions=True,
+    )
+    for (ip, port), result in zip(relays, results):
+        if isinstance(result, BaseException):
+            logging.error(f"{ip}:{port} polling stopped: {result!r}")
+
+
+if __name__ == "__main__":
+    try:
+        if not mod.IS_WINDOWS:
+            mod.install_exit_handler(on_exit)
+        mod.run_async(main(), use_uvloop=True)
+    except KeyboardInterrupt:
+        mod.print_log("Daemon stopped.", logging.INFO)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        logging.error(f"An error occurred: {e}")
@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+File Description: Local HTTP/JSON service that queues SEL relay download jobs.
+Author          : CHEN, JIA-LONG
+Create Date     : 2026-10-19 17:30
+FilePath        : \\SEL relay download service.py
+Copyright © 2026 CHEN JIA-LONG.
+'''
+import argparse
+import hmac
+import json
+import logging
+import os
+import re
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import parse_qs, urlsplit
+
+import module as mod
+
+SERVICE_HOST: str = "127.0.0.1"
+SERVICE_PORT: int = 50232
+
+# Largest accepted request body; a job request is a few hundred bytes.
+MAX_BODY_BYTES: int = 64 * 1024
+
+runner: mod.AsyncJobRunner | None = None
+service_args: argparse.Namespace | None = None
+started: float = time.monotonic()
+
+
+class RequestError(Exception):
+    def __init__(self, status: HTTPStatus, message: str) -> None:
+        self.status: HTTPStatus = status
+        self.message: str = message
+        super().__init__(self.message)
+
+    def __str__(self) -> str:
+        return f"{self.status.value} - {self.message}"
+
+
+def on_exit(event: str) -> bool:
+    """
+    Log termination signals; the runner cancels its jobs and closes the sessions.
+
+    Args:
+        event (str): The name of the signal, e.g. "SIGTERM".
+
+    Returns:
+        bool: True, the event was handled.
+    """
+    mod.print_log(f"Console event {event} occurred. Stop service...", logging.INFO)
+    return True
+
+
+def destination(root: str, folder: str | None) -> str:
+    """
+    Resolve the destination folder of a job inside the service root folder.
+
+    Args:
+        root (str): The absolute root folder of the service.
+        folder (str | None): The folder relative to the root; default is the root.
+
+    Raises:
+        RequestError: If the folder leaves the root.
+
+    Returns:
+        str: The absolute destination folder, created if needed.
+    """
+    path: str = os.path.realpath(os.path.join(root, folder or ""))
+    if os.path.commonpath([root, path]) != root:
+        raise RequestError(HTTPStatus.BAD_REQUEST, f"Destination outside the root: {folder}")
+    return mod.select_folder(path_arg=path, headless=True)
+
+
+def parse_job(request: dict[str, Any], root: str) -> dict[str, Any]:
+    """
+    Validate a job request and convert it into an AsyncJobRunner job.
+
+    Args:
+        request (dict[str, Any]): "ip" and either "event_id" or a query ("since", "until",
+                                  "latest", "match"), optionally "port", "samples",
+                                  "cyles", "dir" (relative to the root), "priority",
+                                  "time_budget", "progressive", "derive_4" and
+                                  "validate_derived".
+        root (str): The absolute root folder of the service.
+
+    Raises:
+        RequestError: If the request is invalid.
+
+    Returns:
+        dict[str, Any]: The job.
+    """
+    ip: str = str(request.get("ip", "")).strip()
+    if not mod.is_valid_ip(ip):
+        raise RequestError(HTTPStatus.BAD_REQUEST, f"Invalid SEL Relay IP: {ip}")
+    try:
+        port: int = int(request.get("port") or 23)
+        cyles: int | None = int(request["cyles"]) if request.get("cyles") else None
+        time_budget: float | None = (
+            float(request["time_budget"]) if request.get("time_budget") else None
+        )
+    except (TypeError, ValueError) as e:
+        raise RequestError(HTTPStatus.BAD_REQUEST, f"Invalid number: {e}")
+    if not 0 < port < 65536:
+        raise RequestError(HTTPStatus.BAD_REQUEST, f"Invalid port: {port}")
+    samples: str = str(request.get("samples") or "4").lower()
+    if samples not in ("4", "all"):
+        raise RequestError(HTTPStatus.BAD_REQUEST, "Samples/Cyles can only be 4 or all")
+
+    event_id: str = str(request.get("event_id") or "")
+    event_ids: list[str] = mod.expand_event_ids(event_id)
+    if event_id and not event_ids:
+        raise RequestError(HTTPStatus.BAD_REQUEST, f"Invalid event IDs: {event_id}")
+    try:
+        if mod.request_event_query(request, event_ids) is None and not event_ids:
+            raise RequestError(HTTPStatus.BAD_REQUEST, "Give event_id or an event query.")
+        priority: Any = request.get("priority", list(mod.DEFAULT_PRIORITY))
+        if isinstance(priority, str):
+            priority = [rule.strip().lower() for rule in priority.split(",") if rule.strip()]
+        if priority == ["none"]:
+            priority = []
+        mod.order_events([], priority)  # Reject unknown rules before queueing
+    except (TypeError, ValueError, re.error) as e:
+        raise RequestError(HTTPStatus.BAD_REQUEST, str(e))
+    progressive: Any = request.get("progressive") or None
+    if progressive is not None and (
+        not isinstance(progressive, str)
+        or (progressive.lower() not in ("all", "trip") and not mod.expand_event_ids(progressive))
+    ):
+        raise RequestError(
+            HTTPStatus.BAD_REQUEST, f"Invalid progressive: {progressive!r} (all, trip or event IDs)"
+        )
+    if request.get("derive_4") and progressive:
+        raise RequestError(HTTPStatus.BAD_REQUEST, "derive_4 and progressive cannot be combined.")
+
+    job: dict[str, Any] = {
+        key: request[key] for key in mod.EVENT_QUERY_FIELDS if request.get(key)
+    }
+    job.update(
+        {
+            "ip": ip,
+            "port": port,
+            "samples": samples,
+            "cyles": cyles,
+            "event_id": event_id,
+            "dir": destination(root, request.get("dir")),
+            "priority": priority,
+            "time_budget": time_budget,
+            "progressive": progressive,
+            "derive_4": bool(request.get("derive_4")),
+            "validate_derived": bool(request.get("validate_derived")),
+        }
+    )
+    return job
+
+
+def job_files(job: dict[str, Any]) -> list[dict[str, Any]]:
+    """
+    List the files a job wrote, with their size.
+
+    Args:
+        job (dict[str, Any]): The job state of AsyncJobRunner.
+
+    Returns:
+        list[dict[str, Any]]: One dict per file with "name", "path" and "bytes" (None if
+                              the file was removed since).
+    """
+    return [
+        {
+            "name": os.path.basename(path),
+            "path": path,
+            "bytes": os.path.getsize(path) if os.path.isfile(path) else None,
+        }
+        for path in job["files"]
+    ]
+
+
+def metrics() -> dict[str, Any]:
+    """
+    Summarize the jobs and relay sessions of the service.
+
+    Returns:
+        dict[str, Any]: "uptime" (seconds), "max_jobs", "jobs" (count per state), "bytes"
+                        (received by all jobs) and "sessions" (SessionPool.status()).
+    """
+    jobs: list[dict[str, Any]] = list(runner.snapshot().values())
+    counts: dict[str, int] = {}
+    for job in jobs:
+        counts[job["state"]] = counts.get(job["state"], 0) + 1
+    return {
+        "uptime": round(time.monotonic() - started),
+        "max_jobs": runner.max_jobs,
+        "jobs": counts,
+        "bytes": sum(job["bytes"] for job in jobs),
+        "sessions": runner.pool.status() if runner.pool else [],
+    }
+
+
+class JobServiceHandler(BaseHTTPRequestHandler):
+    """
+    Serve the job API:
+
+        POST   /jobs              Queue a job, see parse_job(); replies 202 with the job.
+        GET    /jobs[?state=...]  List the jobs.
+        GET    /jobs/<id>         The state of one job.
+        DELETE /jobs/<id>         Cancel a queued or running job.
+        GET    /jobs/<id>/files   The files the job wrote.
+        GET    /metrics           See metrics().
+    """
+
+    server_version = "SELDownloadService/1.0"
+
+    def do_GET(self) -> None:
+        self.dispatch("GET")
+
+    def do_POST(self) -> None:
+        self.dispatch("POST")
+
+    def do_DELETE(self) -> None:
+        self.dispatch("DELETE")
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logging.info(f"{self.address_string()} {format % args}")
+
+    def dispatch(self, method: str) -> None:
+        """Route one request and reply with JSON."""
+        try:
+            if service_args.token and not hmac.compare_digest(
+                self.headers.get("Authorization", "").encode("utf-8", errors="replace"),
+                f"Bearer {service_args.token}".encode("utf-8"),
+            ):  # Constant time, the token is not guessed byte by byte
+                raise RequestError(HTTPStatus.UNAUTHORIZED, "Missing or wrong token.")
+            status, reply = self.route(method)
+        except RequestError as e:
+            status, reply = e.status, {"ok": False, "error": e.message}
+        except Exception as e:
+            logging.error(f"Service request {method} {self.path} failed: {e}")
+            status, reply = HTTPStatus.INTERNAL_SERVER_ERROR, {"ok": False, "error": str(e)}
+        body: bytes = json.dumps(reply, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self, method: str) -> tuple[HTTPStatus, Any]:
+        """
+        Run the handler of a request path.
+
+        Args:
+            method (str): The HTTP method.
+
+        Raises:
+            RequestError: If the path, method or request is invalid.
+
+        Returns:
+            tuple[HTTPStatus, Any]: The status and the JSON reply.
+        """
+        url = urlsplit(self.path)
+        path: str = url.path.rstrip("/")
+        if path == "/metrics" and method == "GET":
+            return HTTPStatus.OK, metrics()
+        if path == "/jobs" and method == "GET":
+            states: list[str] = parse_qs(url.query).get("state", [])
+            jobs: list[dict[str, Any]] = [
+                job for job in runner.snapshot().values() if not states or job["state"] in states
+            ]
+            return HTTPStatus.OK, jobs
+        if path == "/jobs" and method == "POST":
+            job_id: int = runner.submit(parse_job(self.read_json(), service_args.root))
+            self.log_message("queued job %d", job_id)
+            return HTTPStatus.ACCEPTED, runner.snapshot()[job_id]
+
+        matched: re.Match | None = re.fullmatch(r"/jobs/(\d+)(/files)?", path)
+        if matched is None:
+            raise RequestError(HTTPStatus.NOT_FOUND, f"Unknown path: {path}")
+        job: dict[str, Any] | None = runner.snapshot().get(int(matched.group(1)))
+        if job is None:
+            raise RequestError(HTTPStatus.NOT_FOUND, f"Unknown job: {matched.group(1)}")
+        if matched.group(2) and method == "GET":
+            return HTTPStatus.OK, job_files(job)
+        if not matched.group(2) and method == "GET":
+            return HTTPStatus.OK, job
+        if not matched.group(2) and method == "DELETE":
+            runner.cancel(job["id"])
+            return HTTPStatus.ACCEPTED, job
+        raise RequestError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} not allowed on {path}")
+
+    def read_json(self) -> dict[str, Any]:
+        """
+        Read the JSON object of the request body.
+
+        Raises:
+            RequestError: If the Content-Length is invalid, the body is too large or not
+                          a JSON object.
+
+        Returns:
+            dict[str, Any]: The request.
+        """
+        try:
+            length: int = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            raise RequestError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length.")
+        if length > MAX_BODY_BYTES:
+            raise RequestError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body too large.")
+        try:
+            request: Any = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"Invalid JSON: {e}")
+        if not isinstance(request, dict):
+            raise RequestError(HTTPStatus.BAD_REQUEST, "The request must be a JSON object.")
+        return request
+
+
+def main() -> None:
+    """
+    Parse the arguments and serve the job API until stopped.
+    """
+    global runner, service_args
+    parser = argparse.ArgumentParser(
+        description="Queue SEL Relay download jobs over a local HTTP/JSON API."
+    )
+    parser.add_argument(
+        '-d', '--root', type=str, required=True, help='Root folder of the job destinations'
+    )
+    parser.add_argument(
+        '--host',
+        type=str,
+        default=SERVICE_HOST,
+        help=f'Address to listen on, default is {SERVICE_HOST}',
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=SERVICE_PORT,
+        help=f'Port to listen on, default is {SERVICE_PORT}',
+    )
+    parser.add_argument(
+        '--token',
+        type=str,
+        help='Require "Authorization: Bearer TOKEN" on every request',
+    )
+    parser.add_argument(
+        '--max_jobs',
+        type=int,
+        default=2,
+        help='Maximum number of jobs running at the same time, default is 2',
+    )
+    parser.add_argument(
+        '--idle_timeout',
+        type=float,
+        default=mod.SESSION_IDLE_TIMEOUT,
+        help='Seconds an unused relay session stays open, default is '
+        f'{mod.SESSION_IDLE_TIMEOUT:g}',
+    )
+    parser.add_argument(
+        '-log',
+        '--log',
+        type=str.upper,
+        default='INFO',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+        help='Log level, default is INFO',
+    )
+    service_args = parser.parse_args()
+
+    log_folder: str = mod.get_or_create_sel_download_log_folder()
+    mod.rotate_log_folder(log_folder)
+    mod.logger_init(
+        out_path=log_folder,
+        log_name="SEL service.log",
+        log_level=getattr(logging, service_args.log),
+    )
+    mod.load_relay_models()
+    service_args.root = os.path.realpath(
+        mod.select_folder(path_arg=os.path.abspath(service_args.root), headless=True)
+    )
+    if service_args.host not in ("127.0.0.1", "localhost") and not service_args.token:
+        mod.print_log("Listening beyond localhost without --token.", logging.WARN)
+
+    runner = mod.AsyncJobRunner(
+        max_jobs=service_args.max_jobs, idle_timeout=service_args.idle_timeout
+    )
+    runner.start()
+    server = ThreadingHTTPServer((service_args.host, service_args.port), JobServiceHandler)
+    mod.print_log(
+        f"Download service listening on http://{service_args.host}:{service_args.port}, "
+        f"files under {service_args.root}.",
+        logging.INFO,
+    )
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        runner.stop()
+
+
+if __name__ == "__main__":
+    try:
+        if not mod.IS_WINDOWS:
+            mod.install_exit_handler(on_exit)
+        main()
+    except KeyboardInterrupt:
+        mod.print_log("Download service stopped.", logging.INFO)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        logging.error(f"An error occurred: {e}")
@@ -31,6 +31,29 @@ _ = gettext.gettext
 # only shows the extension(s) you want it to.
 wildcard = "SEL Download exe (*.exe)|*.exe"
 
+# 下載工作清單的欄位與狀態顯示文字
+JOB_COLUMNS: list = [
+    ("ID", 40),
+    ("IP", 120),
+    ("狀態", 70),
+    ("階段", 160),
+    ("已接收", 80),
+    ("速率", 80),
+    ("訊息", 200),
+]
+# 事件清單的欄位 (REC_NUM 1 為最新事件)
+EVENT_COLUMNS: list = [("ID", 50), ("時間", 190), ("事件", 160)]
+# 輸入 IP / Port 後等待多久 (ms) 才於背景讀取 CHI
+EVENT_FETCH_DELAY: int = 600
+JOB_STATES: dict = {
+    "queued": "排隊中",
+    "running": "下載中",
+    "done": "完成",
+    "partial": "部分完成",
+    "failed": "失敗",
+    "cancelled": "已取消",
+}
+
 # ---------------------------------------------------------------------------
 
 
@@ -38,6 +61,8 @@ class GUIFrame(Sel_GUI.SEL_Download):
     def __init__(self, parent) -> None:
         Sel_GUI.SEL_Download.__init__(self, parent)
 
+        mod.load_relay_models()
+
         # Icon set
         icon_path = resource_path("download_ui_icon.ico")
         self.SetIcon(wx.Icon(icon_path, wx.BITMAP_TYPE_ICO))
@@ -60,6 +85,51 @@ class GUIFrame(Sel_GUI.SEL_Download):
         # 綁定快捷鍵事件
         self.Bind(wx.EVT_MENU, self.on_debug_shortcut, id=wx.ID_HIGHEST + 1)
 
+        # 事件清單，放在事故編號欄位下方；輸入 IP 後於背景讀取 CHI，選取的事件填入事故編號
+        self.event_key: str | None = None
+        self.event_timer = wx.CallLater(EVENT_FETCH_DELAY, self.fetch_events)
+        self.event_timer.Stop()
+        self.m_staticEvents = wx.StaticText(self.m_scrolledWindow5, wx.ID_ANY, "輸入 IP 後自動讀取事件")
+        self.m_buttonEvents = wx.Button(self.m_scrolledWindow5, wx.ID_ANY, "重新讀取事件")
+        self.m_listEvents = EventListCtrl(self.m_scrolledWindow5)
+        events_header = wx.BoxSizer(wx.HORIZONTAL)
+        events_header.Add(self.m_staticEvents, 1, wx.ALL | wx.ALIGN_CENTER_VERTICAL, 5)
+        events_header.Add(self.m_buttonEvents, 0, wx.ALL | wx.ALIGN_CENTER_VERTICAL, 5)
+        events_sizer = wx.BoxSizer(wx.VERTICAL)
+        events_sizer.Add(events_header, 0, wx.EXPAND)
+        events_sizer.Add(self.m_listEvents, 1, wx.EXPAND | wx.ALL, 5)
+        sizer: wx.Sizer = self.m_scrolledWindow5.GetSizer()
+        eid_sizer: wx.Sizer = self.m_textCtrlEid.GetContainingSizer()
+        eid_index: int = next(
+            index
+            for index, item in enumerate(sizer.GetChildren())
+            if item.GetSizer() is eid_sizer
+        )
+        sizer.Insert(eid_index + 1, events_sizer, 0, wx.EXPAND)
+        self.m_textCtrlDownIP.Bind(wx.EVT_TEXT, self.on_relay_changed)
+        self.m_textCtrlPort.Bind(wx.EVT_TEXT, self.on_relay_changed)
+        self.m_buttonEvents.Bind(wx.EVT_BUTTON, lambda event: self.fetch_events(force=True))
+        self.m_listEvents.Bind(wx.EVT_LIST_ITEM_SELECTED, self.on_event_selection)
+        self.m_listEvents.Bind(wx.EVT_LIST_ITEM_DESELECTED, self.on_event_selection)
+        self.event_sync_pending: bool = False
+
+        # 下載工作清單，放在按鈕列上方；雙擊工作可取消
+        self.job_rows: dict[int, int] = {}
+        self.m_listJobs = wx.ListCtrl(
+            self.m_scrolledWindow5, wx.ID_ANY, size=wx.Size(-1, 120), style=wx.LC_REPORT
+        )
+        for column, (title, width) in enumerate(JOB_COLUMNS):
+            self.m_listJobs.InsertColumn(column, title, width=width)
+        sizer.Insert(sizer.GetItemCount() - 1, self.m_listJobs, 0, wx.EXPAND | wx.ALL, 5)
+        self.m_listJobs.Bind(wx.EVT_LIST_ITEM_ACTIVATED, self.on_job_activated)
+        self.m_scrolledWindow5.Layout()
+
+        # 在背景執行緒的 asyncio 迴圈中下載，不再每次啟動 core.exe
+        self.runner = mod.AsyncJobRunner(
+            max_jobs=2, on_update=lambda job: wx.CallAfter(self.on_job_update, job)
+        )
+        self.runner.start()
+
     def on_debug_shortcut(self, event):
         """快捷鍵事件處理，啟用或停用 Debug 模式"""
         # 顯示密碼輸入對話框
@@ -79,6 +149,101 @@ class GUIFrame(Sel_GUI.SEL_Download):
 
         event.Skip()
 
+    def on_relay_changed(self, event) -> None:
+        """IP / Port 變更後延遲讀取事件，避免每輸入一個字就連線"""
+        self.event_timer.Start(EVENT_FETCH_DELAY)
+        event.Skip()
+
+    def fetch_events(self, force: bool = False) -> None:
+        """於背景讀取電驛的 CHI 事件清單，結果由 on_events_fetched 顯示"""
+        ip: str = self.m_textCtrlDownIP.GetValue().strip()
+        port: str = self.m_textCtrlPort.GetValue().strip() or "23"
+        if not mod.is_valid_ip(ip) or not port.isdigit():
+            return
+        key: str = f"{ip}:{port}"
+        if key == self.event_key and not force:
+            return
+        self.event_key = key
+        self.m_listEvents.set_records(None)
+        self.m_staticEvents.SetLabelText(f"正在讀取 {key} 的事件...")
+        future = self.runner.fetch_events(ip, int(port), max_age=0 if force else mod.CHI_CACHE_TTL)
+        future.add_done_callback(lambda done: wx.CallAfter(self.on_events_fetched, key, done))
+
+    def on_events_fetched(self, key: str, future) -> None:
+        """顯示背景讀取的事件清單 (在 GUI 執行緒中執行)，忽略已過時的結果"""
+        if not self or key != self.event_key:
+            return
+        if future.cancelled():
+            self.m_staticEvents.SetLabelText(f"{key} 事件讀取已取消")
+            return
+        error = future.exception()
+        if error is not None:
+            self.m_staticEvents.SetLabelText(f"{key} 事件讀取失敗: {error}")
+            self.event_key = None  # 下次變更或重新讀取時再試
+            return
+        data = future.result()
+        self.m_listEvents.set_records(data)
+        count: int = self.m_listEvents.GetItemCount()
+        self.m_staticEvents.SetLabelText(f"{key} 共 {count} 筆事件，可多選後下載")
+
+    def on_event_selection(self, event) -> None:
+        """事件選取變更時，合併同一批選取事件後再更新事故編號"""
+        if not self.event_sync_pending:
+            self.event_sync_pending = True
+            wx.CallAfter(self.sync_event_ids)
+        event.Skip()
+
+    def sync_event_ids(self) -> None:
+        """將事件清單中選取的事件寫入事故編號欄位"""
+        self.event_sync_pending = False
+        if not self:
+            return
+        event_ids: list = self.m_listEvents.selected_event_ids()
+        if event_ids:
+            self.m_textCtrlEid.SetValue(mod.compress_event_ids(event_ids))
+
+    def on_job_update(self, job: dict) -> None:
+        """更新下載工作清單中該工作的一列 (在 GUI 執行緒中執行)"""
+        if not self:  # 視窗已關閉
+            return
+        row: int | None = self.job_rows.get(job["id"])
+        if row is None:
+            row = self.m_listJobs.InsertItem(self.m_listJobs.GetItemCount(), str(job["id"]))
+            self.m_listJobs.SetItemData(row, job["id"])
+            self.job_rows[job["id"]] = row
+        if job["error"]:
+            message: str = job["error"]
+        elif job["state"] == "partial":
+            message = f"{len(job['files'])} 個檔案，失敗: {', '.join(job['failed'])}"
+        elif job["failed"]:
+            message = f"失敗: {', '.join(job['failed'])}"
+        elif job["state"] == "done":
+            message = f"{len(job['files'])} 個檔案"
+        else:
+            message = ""
+        values: list = [
+            str(job["id"]),
+            f"{job['ip']}:{job['port']}",
+            JOB_STATES.get(job["state"], job["state"]),
+            job["phase"] or "",
+            f"{job['bytes'] / 1024:.1f} KB",
+            f"{job['rate'] / 1024:.1f} KB/s" if job["phase"] else "",
+            message,
+        ]
+        for column, value in enumerate(values):
+            self.m_listJobs.SetItem(row, column, value)
+
+    def on_job_activated(self, event) -> None:
+        """雙擊下載工作時詢問是否取消"""
+        job_id: int = self.m_listJobs.GetItemData(event.GetIndex())
+        if job_id in self.runner.active():
+            confirm = wx.MessageBox(
+                f"確定要取消下載工作 {job_id} 嗎？", "取消確認", wx.YES_NO | wx.ICON_QUESTION
+            )
+            if confirm == wx.YES:
+                self.runner.cancel(job_id)
+        event.Skip()
+
     def on_resize(self, event) -> None:
         self.m_staticEXEFile.SetLabelText(self.exefile)
         self.m_staticEXEFile.Wrap(self.GetSize()[0] - 30)
@@ -174,6 +339,11 @@ class GUIFrame(Sel_GUI.SEL_Download):
         sample: str = self.m_choiceSample.GetStringSelection()
         cyles: str = self.m_textCtrlCyles.GetValue()
         eid: str = self.m_textCtrlEid.GetValue()
+        # 按住 Shift 點擊時沿用舊方式，另開 core.exe 主控台下載
+        if not wx.GetKeyState(wx.WXK_SHIFT):
+            self.submit_download(ip, port, sample, cyles, eid)
+            event.Skip()
+            return
         args: list = [
             format_var("-i", ip),
             format_var("-p", port),
@@ -210,10 +380,48 @@ class GUIFrame(Sel_GUI.SEL_Download):
         wx.CallLater(500, lambda: self.SetWindowStyle(self.GetWindowStyle() & ~wx.STAY_ON_TOP))
         event.Skip()
 
+    def submit_download(self, ip: str, port: str, sample: str, cyles: str, eid: str) -> None:
+        """檢查輸入後，將下載工作送到背景下載迴圈"""
+        ip, port, cyles, eid = ip.strip(), port.strip(), cyles.strip(), eid.strip()
+        if not mod.is_valid_ip(ip):
+            wx.MessageBox(f"IP 格式錯誤 ({ip})，請重新輸入。", "警告", wx.OK | wx.ICON_WARNING)
+            return
+        if port and not port.isdigit():
+            wx.MessageBox(f"Port 格式錯誤 ({port})，請重新輸入。", "警告", wx.OK | wx.ICON_WARNING)
+            return
+        if cyles and not cyles.isdigit():
+            wx.MessageBox(
+                f"Cyles 格式錯誤 ({cyles})，請重新輸入。", "警告", wx.OK | wx.ICON_WARNING
+            )
+            return
+        if not eid:
+            wx.MessageBox("請輸入事故編號。", "警告", wx.OK | wx.ICON_WARNING)
+            return
+        if not self.savepath or not os.path.isdir(self.savepath):
+            wx.MessageBox("請先選擇存檔路徑。", "警告", wx.OK | wx.ICON_WARNING)
+            return
+
+        job: dict = {
+            "ip": ip,
+            "port": int(port) if port else 23,
+            "samples": sample or "4",
+            "cyles": int(cyles) if cyles else None,
+            "auto_cyles": not cyles,  # 留空時逐一事件自動搜尋長度
+            "event_id": eid,
+            "dir": self.savepath,
+        }
+        job_id: int = self.runner.submit(job)
+        logging.info(f"Download job {job_id} submitted: {job}")
+
     def OnCancelClick(self, event):
         """處理取消按鈕的點擊事件，結束整個應用程序"""
-        confirm = wx.MessageBox("確定要結束軟體嗎？", "結束確認", wx.YES_NO | wx.ICON_QUESTION)
+        message: str = "確定要結束軟體嗎？"
+        if self.runner.active():
+            message = f"尚有 {len(self.runner.active())} 個下載工作未完成，確定要取消並結束軟體嗎？"
+        confirm = wx.MessageBox(message, "結束確認", wx.YES_NO | wx.ICON_QUESTION)
         if confirm == wx.YES:
+            self.runner.stop()
+            mod.stop_log_listener()  # 寫完佇列中的記錄，包含非除錯模式的錯誤記錄
             if self.debug_mode:
                 logging.shutdown()
             self.Destroy()
@@ -291,6 +499,45 @@ def resource_path(relative_path):
     return os.path.join(os.path.abspath("."), relative_path)
 
 
+class EventListCtrl(wx.ListCtrl):
+    """虛擬模式的事件清單，只繪製可見列，上千筆事件也不會卡住介面"""
+
+    def __init__(self, parent):
+        super().__init__(
+            parent, wx.ID_ANY, size=wx.Size(-1, 160), style=wx.LC_REPORT | wx.LC_VIRTUAL
+        )
+        for column, (title, width) in enumerate(EVENT_COLUMNS):
+            self.InsertColumn(column, title, width=width)
+        self.records: list = []
+
+    def set_records(self, data) -> None:
+        """以 module.parse_chi_records 的結果更新清單，None 則清空"""
+        self.records = []
+        if data is not None:
+            self.records = [
+                (str(rec_num).strip(), formatted_time, str(event).strip().strip('"'))
+                for rec_num, formatted_time, event in data[
+                    ['REC_NUM', 'Formatted_Time', 'EVENT']
+                ].itertuples(index=False)
+            ]
+        self.DeleteAllItems()
+        self.SetItemCount(len(self.records))
+        self.Refresh()
+
+    def OnGetItemText(self, item, column):
+        """虛擬清單回呼，回傳指定列與欄位的文字"""
+        return self.records[item][column]
+
+    def selected_event_ids(self) -> list:
+        """回傳目前選取的事件 ID"""
+        event_ids: list = []
+        item: int = self.GetFirstSelected()
+        while item != -1:
+            event_ids.append(self.records[item][0])
+            item = self.GetNextSelected(item)
+        return event_ids
+
+
 class PasswordDialog(wx.Dialog):
     def __init__(self, parent, title):
         super().__init__(parent, title=title, size=(300, 165))
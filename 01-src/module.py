@@ -9,22 +9,125 @@ Copyright © 2024 CHEN JIA-LONG.
 '''
 
 import asyncio
+import atexit
+import cProfile
 import ctypes
+import hashlib
+import io
+import json
 import logging
 import os
+import pstats
+import queue
 import re
+import signal
+import struct
+import sys
+import threading
 import time
-import tkinter as tk
+from collections import deque
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from tkinter import filedialog
-from typing import Any, Coroutine, List, Optional, Tuple
-
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Coroutine,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import numpy as np
 import pandas as pd
 import telnetlib3
-from aioconsole.stream import aprint
+from tqdm import tqdm
+
+IS_WINDOWS: bool = sys.platform == "win32"
+
+
+def has_display() -> bool:
+    """
+    Check if a graphical display is available for Tk dialogs.
+
+    Returns:
+        bool: True on Windows and macOS, or when DISPLAY / WAYLAND_DISPLAY is set.
+    """
+    if IS_WINDOWS or sys.platform == "darwin":
+        return True
+    return bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+
+def install_exit_handler(on_exit: Callable[[str], Any]) -> None:
+    """
+    Register a handler for console close and termination events on this platform.
+
+    On Windows the handler is registered with SetConsoleCtrlHandler and runs on its own
+    thread. On POSIX SIGTERM and SIGHUP call the handler and then raise KeyboardInterrupt,
+    so asyncio.run() cancels main() and the TelnetClient context closes the connection.
+
+    Args:
+        on_exit (Callable[[str], Any]): Called with the event name, e.g. "CTRL_C_EVENT"
+                                        or "SIGTERM".
+    """
+    if IS_WINDOWS:
+        import win32api
+        import win32con
+
+        event_map: dict[int, str] = {
+            win32con.CTRL_C_EVENT: "CTRL_C_EVENT",
+            win32con.CTRL_BREAK_EVENT: "CTRL_BREAK_EVENT",
+            win32con.CTRL_CLOSE_EVENT: "CTRL_CLOSE_EVENT",
+            win32con.CTRL_LOGOFF_EVENT: "CTRL_LOGOFF_EVENT",
+            win32con.CTRL_SHUTDOWN_EVENT: "CTRL_SHUTDOWN_EVENT",
+        }
+
+        def console_handler(event: int) -> bool:
+            if event in event_map:
+                on_exit(event_map[event])
+                return True  # 返回True告訴系統我們已經處理了這個事件
+            return False
 
+        win32api.SetConsoleCtrlHandler(console_handler, True)
+        return
 
-def select_folder(windows_title: str = "Select Folder", path_arg: str = None) -> str:
+    def signal_handler(signum: int, frame) -> None:
+        on_exit(signal.Signals(signum).name)
+        raise KeyboardInterrupt
+
+    for signum in (signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, signal_handler)
+
+
+def run_async(main_coro: Coroutine, use_uvloop: bool = False) -> Any:
+    """
+    Run the main coroutine, on uvloop when requested and available.
+
+    Args:
+        main_coro (Coroutine): The coroutine to run.
+        use_uvloop (bool): Use uvloop if it is installed (never on Windows).
+
+    Returns:
+        Any: The result of the coroutine.
+    """
+    if use_uvloop and not IS_WINDOWS:
+        try:
+            import uvloop
+
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            logging.info("Use uvloop event loop.")
+        except ImportError:
+            logging.info("uvloop is not installed, use the default event loop.")
+    return asyncio.run(main_coro)
+
+
+def select_folder(
+    windows_title: str = "Select Folder", path_arg: str = None, headless: bool = False
+) -> str:
     """
     Open a dialog for the user to select a folder and return the folder's absolute path.
     If a path argument is provided, use it after validation and normalization.
@@ -32,12 +135,14 @@ def select_folder(windows_title: str = "Select Folder", path_arg: str = None) ->
     Args:
         windows_title (str): The title of the folder selection dialog.
         path_arg (str): The folder path provided as an argument.
+        headless (bool): If True, never open the dialog.
 
     Returns:
         str: The absolute path of the selected or provided folder.
 
     Raises:
-        ValueError: If the user cancels the folder selection or if the path argument is invalid.
+        ValueError: If the user cancels the folder selection, if the path argument is
+                    invalid or if a dialog is needed but there is no display.
     """
 
     def valid_path(path) -> bool:
@@ -62,6 +167,11 @@ def select_folder(windows_title: str = "Select Folder", path_arg: str = None) ->
             path_arg = None  # Reset path_arg to trigger folder selection dialog
 
     if not path_arg:
+        if headless or not has_display():
+            raise ValueError("No valid folder given and no display to select one, use --dir.")
+        import tkinter as tk
+        from tkinter import filedialog
+
         # Get the user's desktop path
         desktop_path: str = os.path.join(os.path.expanduser("~"), "Desktop")
 
@@ -116,7 +226,11 @@ def get_ip() -> str:
 
 
 def logger_init(
-    out_path: str = None, log_name: str = "SEL Waveform download.log", log_level: int = logging.INFO
+    out_path: str = None,
+    log_name: str = "SEL Waveform download.log",
+    log_level: int = logging.INFO,
+    max_bytes: int = 20 * 1024 * 1024,
+    backup_count: int = 5,
 ) -> None:
     """
     Initialize a logger that writes log messages to a timestamped file.
@@ -128,6 +242,9 @@ def logger_init(
                                   Default is "SEL Waveform download.log".
         log_level (int, optional): The logging level (e.g., logging.INFO, logging.DEBUG).
                                    Default is logging.INFO.
+        max_bytes (int, optional): The log file is rotated when it reaches this size.
+                                   Default is 20 MB.
+        backup_count (int, optional): The number of rotated files kept. Default is 5.
 
     Returns:
         None
@@ -137,13 +254,14 @@ def logger_init(
     log_filename: str = f"{current_time}_{log_name}"
     log_path: str = os.path.join(out_path, log_filename) if out_path else log_filename
     os.makedirs(os.path.dirname(log_path), exist_ok=True)
-    file_handler_args: Tuple = (log_path, "w", "utf-8")
-    logging.basicConfig(
-        level=log_level,
-        format="%(asctime)s %(levelname)s %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-        handlers=[logging.FileHandler(*file_handler_args)],
+    file_handler = RotatingFileHandler(
+        log_path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
     )
+    file_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    )
+    # Formatting and file I/O run on the listener thread, not on the event loop.
+    logging.basicConfig(level=log_level, handlers=[start_log_listener(file_handler)], force=True)
 
 
 def error_logger_init(out_path: str = None, log_level: int = logging.DEBUG) -> None:
@@ -178,46 +296,156 @@ def error_logger_init(out_path: str = None, log_level: int = logging.DEBUG) -> N
         "%(asctime)s %(levelname)s %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
     )
     error_file_handler.setFormatter(formatter)
-    logger.addHandler(error_file_handler)
+    logger.addHandler(start_log_listener(error_file_handler))
+
+
+class LocalQueueHandler(QueueHandler):
+    """
+    A QueueHandler for a listener in the same process.
+
+    The standard QueueHandler formats every record before queueing it, on the thread
+    that logs. Records here are queued unformatted, so the formatting is done by the
+    handlers on the listener thread as well.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Return the record unchanged; it never leaves this process."""
+        return record
+
+
+_log_listener: QueueListener | None = None
+_log_listener_running: bool = False
+
+
+def start_log_listener(*handlers: logging.Handler) -> logging.Handler:
+    """
+    Move the given handlers onto a background logging thread.
+
+    A running listener is stopped first. The listener is stopped again at exit, so
+    every queued record is written before the program ends.
+
+    Args:
+        *handlers (logging.Handler): The handlers doing the formatting and file I/O.
+
+    Returns:
+        logging.Handler: The queue handler to add to the logger instead of the handlers.
+    """
+    global _log_listener, _log_listener_running
+    if _log_listener is None:
+        atexit.register(stop_log_listener)
+    else:
+        stop_log_listener()
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    _log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    _log_listener_running = True
+    return LocalQueueHandler(log_queue)
+
+
+def stop_log_listener() -> None:
+    """
+    Write all queued log records and stop the background logging thread.
+
+    Safe to call more than once.
+    """
+    global _log_listener_running
+    if _log_listener is not None and _log_listener_running:
+        _log_listener_running = False
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
 
 
 class ErrorFileHandler(logging.Handler):
     """
-    A custom logging handler that tracks and writes log messages to a file
-    when an error (or higher severity) occurs.
+    A custom logging handler that keeps the latest log messages in memory and writes
+    them to a file when an error (or higher severity) occurs.
+
+    Until the first error, formatted messages are kept in a ring buffer bounded by both
+    the number of records and their total size, so memory stays constant however long
+    the run is. The first error writes the buffered context in one write; after that the
+    file stays open and every message is written directly.
 
     Attributes:
         filename (str): The name of the file where log messages are written.
+        capacity (int): The maximum number of records kept before the first error.
+        max_bytes (int): The maximum total size (characters) of the kept records.
         error_occurred (bool): A flag indicating whether an error has occurred.
 
     Methods:
-        emit(record): Processes a log record and writes it to the file
-                      if an error or higher severity has occurred.
+        emit(record): Buffers a log record, or writes it to the file once an error
+                      or higher severity has occurred.
+        close(): Closes the log file.
     """
 
-    def __init__(self, filename):
+    def __init__(
+        self,
+        filename: str,
+        capacity: int = 1000,
+        max_bytes: int = 1024 * 1024,
+        encoding: str = 'utf-8',
+    ) -> None:
         """
         Initialize the ErrorFileHandler.
 
         Args:
             filename (str): The name of the file where log messages will be written.
+            capacity (int): The maximum number of records kept before the first error.
+            max_bytes (int): The maximum total size (characters) of the kept records.
+            encoding (str): The encoding of the log file.
         """
         super().__init__()
-        self.filename = filename
-        self.error_occurred = False
+        self.filename: str = filename
+        self.capacity: int = capacity
+        self.max_bytes: int = max_bytes
+        self.encoding: str = encoding
+        self.error_occurred: bool = False
+        self._buffer: deque[str] = deque()
+        self._buffer_bytes: int = 0
+        self._stream = None
 
-    def emit(self, record):
+    def emit(self, record: logging.LogRecord) -> None:
         """
-        Write log messages to the file if an error or higher severity occurs.
+        Buffer the log message, or write it to the file if an error has occurred.
 
         Args:
             record (logging.LogRecord): The log record to process.
         """
-        if record.levelno >= logging.ERROR:
-            self.error_occurred = True
-        if self.error_occurred:
-            with open(self.filename, 'a') as log_file:
-                log_file.write(self.format(record) + '\n')
+        try:
+            message: str = self.format(record) + '\n'
+            if record.levelno >= logging.ERROR:
+                self.error_occurred = True
+
+            if not self.error_occurred:
+                self._buffer.append(message)
+                self._buffer_bytes += len(message)
+                while self._buffer and (
+                    len(self._buffer) > self.capacity or self._buffer_bytes > self.max_bytes
+                ):
+                    self._buffer_bytes -= len(self._buffer.popleft())
+                return
+
+            if self._stream is None:
+                self._stream = open(file=self.filename, mode='a', encoding=self.encoding)
+                self._buffer.append(message)
+                message = "".join(self._buffer)
+                self._buffer.clear()
+                self._buffer_bytes = 0
+            self._stream.write(message)
+            self._stream.flush()
+        except Exception:
+            self.handleError(record)
+
+    def close(self) -> None:
+        """Close the log file, if it was opened."""
+        self.acquire()
+        try:
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+        finally:
+            self.release()
+            super().close()
 
 
 def get_or_create_sel_download_log_folder(folder_name: str = "SEL download log") -> str:
@@ -246,11 +474,14 @@ def get_or_create_sel_download_log_folder(folder_name: str = "SEL download log")
 
 def set_hidden_attribute(folder_path: str) -> None:
     """
-    Set the Windows hidden attribute for a folder.
+    Set the Windows hidden attribute for a folder. Other platforms have no hidden
+    attribute, so the folder is left as it is.
 
     Args:
         folder_path (str): The absolute path of the folder to hide.
     """
+    if not IS_WINDOWS:
+        return
     # 定義 Windows API 的隱藏屬性值
     FILE_ATTRIBUTE_HIDDEN = 0x02
 
@@ -258,18 +489,83 @@ def set_hidden_attribute(folder_path: str) -> None:
     ctypes.windll.kernel32.SetFileAttributesW(folder_path, FILE_ATTRIBUTE_HIDDEN)
 
 
-class ErrorFileHandler(logging.Handler):
-    def __init__(self, filename):
-        super().__init__()
-        self.filename = filename
-        self.error_occurred = False
+def rotate_log_folder(folder_path: str, max_total_bytes: int = 200 * 1024 * 1024) -> None:
+    """
+    Keep the log files in a folder (and its subfolders) under a total size.
+
+    The oldest log files are deleted first. Other files, such as the JSON state files,
+    are never touched.
+
+    Args:
+        folder_path (str): The log folder, e.g. the "SEL download log" folder.
+        max_total_bytes (int): The maximum total size of the log files. Default is 200 MB.
+    """
+    log_files: List[Tuple[float, int, str]] = []
+    for root, _, filenames in os.walk(folder_path):
+        for filename in filenames:
+            if re.search(r"\.log(\.\d+)?$", filename):
+                path: str = os.path.join(root, filename)
+                try:
+                    stat: os.stat_result = os.stat(path)
+                except OSError:
+                    continue
+                log_files.append((stat.st_mtime, stat.st_size, path))
 
-    def emit(self, record):
-        if record.levelno >= logging.ERROR:
-            self.error_occurred = True
-        if self.error_occurred:
-            with open(file=self.filename, mode='a', encoding='utf-8') as log_file:
-                log_file.write(self.format(record) + '\n')
+    total_bytes: int = sum(size for _, size, _ in log_files)
+    for _, size, path in sorted(log_files):
+        if total_bytes <= max_total_bytes:
+            break
+        try:
+            os.remove(path)
+            total_bytes -= size
+            logging.debug(f"Log folder over {max_total_bytes} bytes, removed old log: {path}")
+        except OSError as e:
+            logging.warning(f"Failed to remove old log {path}: {e}")
+
+
+def load_state_file(filename: str, folder_name: str = "SEL download log") -> dict:
+    """
+    Load a JSON state file kept in the hidden SEL download log folder.
+
+    Args:
+        filename (str): The state file name, e.g. "relay_identity.json".
+        folder_name (str): The folder the state file is kept in.
+
+    Returns:
+        dict: The stored data, or an empty dict if the file is missing or unreadable.
+    """
+    state_path: str = os.path.join(get_or_create_sel_download_log_folder(folder_name), filename)
+    if not os.path.isfile(state_path):
+        return {}
+    try:
+        with open(state_path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignore unreadable state file {state_path}: {e}")
+        return {}
+
+
+def save_state_file(filename: str, data: dict, folder_name: str = "SEL download log") -> None:
+    """
+    Save a JSON state file into the hidden SEL download log folder.
+
+    The data is written to a temporary file first and then moved over the old file,
+    so a crash while saving never leaves a half written state file.
+
+    Args:
+        filename (str): The state file name, e.g. "relay_identity.json".
+        data (dict): The JSON serialisable data to store.
+        folder_name (str): The folder the state file is kept in.
+    """
+    state_path: str = os.path.join(get_or_create_sel_download_log_folder(folder_name), filename)
+    temp_path: str = f"{state_path}.tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file, ensure_ascii=False, indent=1)
+        os.replace(temp_path, state_path)
+    except OSError as e:
+        logging.error(f"Failed to save state file {state_path}: {e}")
 
 
 def expand_event_ids(event_id_str: str) -> list[str]:
@@ -315,21 +611,45 @@ def expand_event_ids(event_id_str: str) -> list[str]:
     return [str(id_) for id_ in sorted(set(expanded_ids))]
 
 
-def parse_chi_response(
-    chi_in: str, event_ids_arg: Optional[List[str]] = None
-) -> List[Tuple[str, str, str, str]]:
+def compress_event_ids(event_ids: Iterable[str | int]) -> str:
     """
-    Parse and print the CHI command response in a formatted table.
+    Compress event IDs into the comma-separated form read by expand_event_ids.
+
+    Args:
+        event_ids (Iterable[str | int]): The event IDs, in any order.
+
+    Returns:
+        str: The sorted IDs with consecutive runs written as ranges.
+
+    Example:
+        >>> compress_event_ids(["10", "1", "2", "5", "6", "7", "8"])
+        '1-2,5-8,10'
+    """
+    ids: List[int] = sorted({int(event_id) for event_id in event_ids})
+    parts: List[str] = []
+    start: int | None = None
+    for index, event_id in enumerate(ids):
+        if start is None:
+            start = event_id
+        if index + 1 == len(ids) or ids[index + 1] != event_id + 1:
+            parts.append(str(start) if start == event_id else f"{start}-{event_id}")
+            start = None
+    return ",".join(parts)
+
+
+def parse_chi_records(chi_in: str) -> pd.DataFrame | None:
+    """
+    Parse the CHI command response into a table of event records.
 
     Args:
         chi_in (str): The response from the CHI command.
-        event_ids_arg (Optional[List[str]]): The event IDs provided as command-line arguments.
 
     Returns:
-        List[Tuple[str, str, str, str]]: List of tuples containing the event ID, date,
-                                         event date time, and event description if found.
+        pd.DataFrame | None: The columns REC_NUM, YEAR, MONTH, DAY, HOUR, MIN, SEC, MSEC,
+                             EVENT and Formatted_Time ("YYYY/MM/DD hh:mm:ss.mmm"), or None
+                             if the response holds no CHI data.
     """
-    logging.debug(f"CHI original Data:\n{chi_in}")
+    log_payload("CHI original Data", chi_in)
     # Split the response into lines
     lines = chi_in.splitlines()
 
@@ -342,7 +662,7 @@ def parse_chi_response(
 
     if header_index is None:
         logging.error("No valid CHI data found.")
-        return []
+        return None
 
     # Extract headers and data lines
     headers: List[str] = lines[header_index].split(",")
@@ -381,6 +701,57 @@ def parse_chi_response(
         + '.'
         + data['MSEC'].str.zfill(3)
     )
+    return data
+
+
+def chi_event(selected_event: pd.Series) -> Tuple[str, str, str, str]:
+    """
+    Convert one CHI record into the event tuple used by the download flow.
+
+    Args:
+        selected_event (pd.Series): One row of parse_chi_records().
+
+    Returns:
+        Tuple[str, str, str, str]: The event ID, date ("MM/DD/YYYY"), event date time
+                                   ("YYYY.MM.DD-hh.mm.ss.mmm") and event description.
+    """
+    event_date_time: str = (
+        f"{selected_event['YEAR']}.{selected_event['MONTH']:0>2}."
+        f"{selected_event['DAY']:0>2}"
+        f"-{selected_event['HOUR']:0>2}.{selected_event['MIN']:0>2}."
+        f"{selected_event['SEC']:0>2}.{selected_event['MSEC']:0>3}"
+    )
+    return (
+        selected_event['REC_NUM'],
+        f"{selected_event['MONTH']:0>2}/{selected_event['DAY']:0>2}/{selected_event['YEAR']}",
+        event_date_time,
+        selected_event['EVENT'],
+    )
+
+
+def parse_chi_response(
+    chi_in: str,
+    event_ids_arg: Optional[List[str]] = None,
+    interactive: bool = True,
+    select_events: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+) -> List[Tuple[str, str, str, str]]:
+    """
+    Parse and print the CHI command response in a formatted table.
+
+    Args:
+        chi_in (str): The response from the CHI command.
+        event_ids_arg (Optional[List[str]]): The event IDs provided as command-line arguments.
+        interactive (bool): If True, ask the user for event IDs when none are selected.
+        select_events (Optional[Callable[[pd.DataFrame], pd.DataFrame]]): Select the events
+            from the parsed records instead of by event IDs.
+
+    Returns:
+        List[Tuple[str, str, str, str]]: List of tuples containing the event ID, date,
+                                         event date time, and event description if found.
+    """
+    data: pd.DataFrame | None = parse_chi_records(chi_in)
+    if data is None:
+        return []
 
     # Print the table with the formatted time
     display_data: pd.DataFrame = data[['REC_NUM', 'Formatted_Time', 'EVENT']]
@@ -389,35 +760,25 @@ def parse_chi_response(
     logging.debug(f"CHI DataFrame Data:\n{data}")
 
     valid_events = []
-    if event_ids_arg:
+    if select_events is not None:
+        for _, selected_event in select_events(data).iterrows():
+            valid_events.append(chi_event(selected_event))
+            print(f"Selected Event Id Number: {selected_event['REC_NUM']}")
+    elif event_ids_arg:
         # Check if the provided event IDs exist in the data
         for event_id in event_ids_arg:
             selected_event: pd.DataFrame = data[data['REC_NUM'] == event_id]
             if not selected_event.empty:
                 selected_event = selected_event.iloc[0]
-                event_date_time: str = (
-                    f"{selected_event['YEAR']}.{selected_event['MONTH']:0>2}."
-                    f"{selected_event['DAY']:0>2}"
-                    f"-{selected_event['HOUR']:0>2}.{selected_event['MIN']:0>2}."
-                    f"{selected_event['SEC']:0>2}.{selected_event['MSEC']:0>3}"
-                )
                 print(
                     f"Using provided Event Id Number: {selected_event['REC_NUM']}, "
                     f"Date: {selected_event['MONTH']:0>2}/{selected_event['DAY']:0>2}/"
                     f"{selected_event['YEAR']}"
                 )
-                valid_events.append(
-                    (
-                        selected_event['REC_NUM'],
-                        f"{selected_event['MONTH']:0>2}/{selected_event['DAY']:0>2}"
-                        f"/{selected_event['YEAR']}",
-                        event_date_time,
-                        selected_event['EVENT'],
-                    )
-                )
+                valid_events.append(chi_event(selected_event))
 
     # User input for selecting an event if no valid event IDs are provided
-    if not valid_events:
+    if not valid_events and interactive:
         while True:
             try:
                 selected_ids: str = input(
@@ -447,12 +808,6 @@ def parse_chi_response(
             selected_event = data[data['REC_NUM'] == selected_id]
             if not selected_event.empty:
                 selected_event = selected_event.iloc[0]
-                event_date_time: str = (
-                    f"{selected_event['YEAR']}.{selected_event['MONTH']:0>2}."
-                    f"{selected_event['DAY']:0>2}"
-                    f"-{selected_event['HOUR']:0>2}.{selected_event['MIN']:0>2}."
-                    f"{selected_event['SEC']:0>2}.{selected_event['MSEC']:0>3}"
-                )
                 logging.debug(
                     f"Selected Event Id Number: {selected_event['REC_NUM']}, "
                     f"Date: {selected_event['MONTH']:0>2}/{selected_event['DAY']:0>2}/{selected_event['YEAR']}"
@@ -461,19 +816,150 @@ def parse_chi_response(
                     f"Selected Event Id Number: {selected_event['REC_NUM']}, "
                     f"Date: {selected_event['MONTH']:0>2}/{selected_event['DAY']:0>2}/{selected_event['YEAR']}"
                 )
-                valid_events.append(
-                    (
-                        selected_event['REC_NUM'],
-                        f"{selected_event['MONTH']:0>2}/{selected_event['DAY']:0>2}"
-                        f"/{selected_event['YEAR']}",
-                        event_date_time,
-                        selected_event['EVENT'],
-                    )
-                )
+                valid_events.append(chi_event(selected_event))
 
     return valid_events
 
 
+# Relative query times, e.g. "24h" for the last 24 hours.
+QUERY_TIME_UNITS: dict[str, str] = {
+    "s": "seconds",
+    "m": "minutes",
+    "h": "hours",
+    "d": "days",
+    "w": "weeks",
+}
+
+
+def parse_query_time(value: str, end_of_day: bool = False, now: datetime | None = None) -> str:
+    """
+    Convert a query time into the CHI "Formatted_Time" format, so it compares as text.
+
+    Args:
+        value (str): A relative time ("30m", "24h", "7d") counted back from now, or a
+                     date / date time such as "2024-05-03", "2024/05/03 10:00".
+        end_of_day (bool): Let a date without a time mean the end of the day (for --until).
+        now (datetime | None): The current time. Default is datetime.now().
+
+    Raises:
+        ValueError: If the value is neither a relative time nor a date.
+
+    Returns:
+        str: The time as "YYYY/MM/DD hh:mm:ss.mmm".
+
+    Example:
+        >>> parse_query_time("24h", now=datetime(2024, 5, 3, 12))
+        '2024/05/02 12:00:00.000'
+
+        >>> parse_query_time("2024-05-03", end_of_day=True)
+        '2024/05/03 23:59:59.999'
+    """
+    value = value.strip()
+    relative: re.Match | None = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([smhdw])", value.lower())
+    if relative:
+        delta = timedelta(**{QUERY_TIME_UNITS[relative.group(2)]: float(relative.group(1))})
+        moment: datetime = (now or datetime.now()) - delta
+    else:
+        moment = datetime.fromisoformat(value.replace("/", "-"))
+        if end_of_day and len(value) <= 10:
+            moment += timedelta(days=1, microseconds=-1000)
+    return moment.strftime("%Y/%m/%d %H:%M:%S.%f")[:-3]
+
+
+def event_query(
+    since: str | None = None,
+    until: str | None = None,
+    latest: int | None = None,
+    match: str | None = None,
+    event_ids: Optional[List[str]] = None,
+    after: str | None = None,
+) -> Callable[[pd.DataFrame], pd.DataFrame]:
+    """
+    Build an event selection over the CHI records for parse_chi_response(select_events=).
+
+    All conditions are combined into one mask that is evaluated in a single pass over
+    the records; `latest` then keeps the newest matches. Times are compared with the
+    relay clock as shown by CHI.
+
+    Args:
+        since (str | None): Keep events at or after this time (see parse_query_time).
+        until (str | None): Keep events at or before this time; a date means its end.
+        latest (int | None): Keep only the newest N matching events.
+        match (str | None): Regular expression searched in the EVENT text (ignoring
+                            case), or "trip" for trip events (TRIP_EVENT_PATTERN).
+        event_ids (Optional[List[str]]): Keep only these event IDs.
+        after (str | None): Keep events strictly after this "Formatted_Time" value.
+
+    Raises:
+        ValueError: If a time or the regular expression is invalid.
+
+    Returns:
+        Callable[[pd.DataFrame], pd.DataFrame]: The selection, newest events first.
+    """
+    since_time: str | None = parse_query_time(since) if since else None
+    until_time: str | None = parse_query_time(until, end_of_day=True) if until else None
+    pattern: re.Pattern | None = None
+    if match:
+        try:
+            pattern = re.compile(TRIP_EVENT_PATTERN if match.lower() == "trip" else match, re.I)
+        except re.error as e:
+            raise ValueError(f"Invalid --match: {match!r} ({e})") from e
+
+    def select_events(data: pd.DataFrame) -> pd.DataFrame:
+        times: pd.Series = data["Formatted_Time"]
+        mask: pd.Series = pd.Series(True, index=data.index)
+        if since_time:
+            mask &= times >= since_time
+        if until_time:
+            mask &= times <= until_time
+        if after:
+            mask &= times > after
+        if event_ids:
+            mask &= data["REC_NUM"].isin(event_ids)
+        if pattern is not None:
+            events: pd.Series = data["EVENT"].str.strip().str.strip('"').str.strip()
+            mask &= events.str.contains(pattern, na=False)
+        selected: pd.DataFrame = data[mask].sort_values("Formatted_Time", ascending=False)
+        logging.debug(f"Event query selected {len(selected)} of {len(data)} CHI records.")
+        return selected.head(latest) if latest else selected
+
+    return select_events
+
+
+# Fields of a job request (agent, GUI runner, HTTP service) that select events by query.
+EVENT_QUERY_FIELDS: Tuple[str, ...] = ("since", "until", "latest", "match")
+
+
+def request_event_query(
+    request: dict[str, Any], event_ids: Optional[List[str]] = None
+) -> Callable[[pd.DataFrame], pd.DataFrame] | None:
+    """
+    Build the event query of a job request, if it has any EVENT_QUERY_FIELDS.
+
+    Args:
+        request (dict[str, Any]): The job request.
+        event_ids (Optional[List[str]]): The expanded "event_id" of the request, which
+                                         further limits the query.
+
+    Raises:
+        ValueError: If a query field is invalid.
+
+    Returns:
+        Callable[[pd.DataFrame], pd.DataFrame] | None: The selection, or None to select
+                                                       by event IDs.
+    """
+    if not any(request.get(key) for key in EVENT_QUERY_FIELDS):
+        return None
+    latest: Any = request.get("latest")
+    return event_query(
+        since=request.get("since"),
+        until=request.get("until"),
+        latest=int(latest) if latest else None,
+        match=request.get("match"),
+        event_ids=event_ids or None,
+    )
+
+
 def clean_filename(filename: str, replacement: str = '') -> str:
     """
     Clean the filename by removing or replacing illegal characters.
@@ -525,40 +1011,976 @@ def print_log(message: str, log_level: int = logging.DEBUG) -> None:
     logging.log(level=log_level, msg=message)
 
 
-class TelnetClient:
+# Relay capability registry. Each model group maps FID patterns (regular expressions,
+# first match wins) to the CEV command templates per sample mode and its limits:
+#   fid_pattern   : Regular expression searched in the FID.
+#   cev_commands  : Sample mode ("4" / "all") to CEV command template. Templates may use
+#                   {event_id} and {cyles}.
+#   event_length  : True if the command takes an event length (L<cyles>); a "No Data
+#                   Available" reply then means the length is too long.
+#   max_cyles     : The longest event length the model supports.
+#   supported     : False for the fallback entry of unknown relays.
+#   probe_command : A short command whose reply holds the newest event (daemon mode).
+#   analog_channels: Analog columns of a CEV row, used by the dry-run size estimate.
+#   samples_all   : Samples per cycle of the "all" sample mode.
+# More models can be added without code changes through relay_models.json, see
+# load_relay_models().
+RELAY_MODELS: dict[str, dict[str, Any]] = {
+    "311L_351": {
+        "fid_pattern": r"311L|351|311C",
+        "cev_commands": {"4": "CEV L{cyles} {event_id}", "all": "CEV R L{cyles} {event_id}"},
+        "event_length": True,
+        "max_cyles": 180,
+        "supported": True,
+        "probe_command": "CHI 1",
+        "analog_channels": 11,
+        "samples_all": 16,
+    },
+    "487E": {
+        "fid_pattern": r"487E",
+        "cev_commands": {"4": "CEV {event_id}", "all": "CEV {event_id} S8"},
+        "event_length": False,
+        "max_cyles": None,
+        "supported": True,
+        "probe_command": "CHI 1",
+        "analog_channels": 27,
+        "samples_all": 8,
+    },
+    "487B": {
+        "fid_pattern": r"487B",
+        "cev_commands": {"4": "CEV {event_id}", "all": "CEV R {event_id}"},
+        "event_length": False,
+        "max_cyles": None,
+        "supported": True,
+        "probe_command": "CHI 1",
+        "analog_channels": 24,
+        "samples_all": 16,
+    },
+    "other": {
+        "fid_pattern": r"",
+        "cev_commands": {"4": "CEV {event_id}"},
+        "event_length": False,
+        "max_cyles": None,
+        "supported": False,
+        "probe_command": "CHI 1",
+        "analog_channels": 12,
+        "samples_all": 4,
+    },
+}
+
+
+def load_relay_models(path: str = "relay_models.json") -> None:
     """
-    A simple Telnet client using telnetlib3 to connect to a device, send a command,
-    and print the response.
+    Merge extra relay model definitions from a JSON file into RELAY_MODELS.
+
+    The file holds an object of model name to definition, using the same keys as
+    RELAY_MODELS. New models are tried before the "other" fallback entry.
+    A missing file is silently ignored.
+
+    Args:
+        path (str): The JSON file with the extra model definitions.
+    """
+    if not os.path.isfile(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            extra_models: dict = json.load(file)
+    except (OSError, ValueError) as e:
+        print_log(f"Failed to load relay models from {path}: {e}", logging.ERROR)
+        return
+
+    fallback: dict = RELAY_MODELS.pop("other")
+    for model, definition in extra_models.items():
+        if not isinstance(definition, dict) or "cev_commands" not in definition:
+            logging.error(f"Relay model {model} in {path} has no cev_commands, ignored.")
+            continue
+        RELAY_MODELS[model] = {**fallback, "supported": True, **definition}
+        logging.info(f"Relay model {model} loaded from {path}.")
+    RELAY_MODELS["other"] = fallback
+
+
+def get_relay_model(fid: str | None) -> str:
+    """
+    Find the relay model group for a FID in the capability registry.
+
+    Args:
+        fid (str | None): The Firmware Identification string of the relay.
+
+    Returns:
+        str: The RELAY_MODELS key of the first matching model, or "other".
+    """
+    if fid:
+        for model, capability in RELAY_MODELS.items():
+            if capability["fid_pattern"] and re.search(capability["fid_pattern"], fid):
+                return model
+    return "other"
+
+
+def parse_id_response(id_response: str) -> dict[str, str]:
+    """
+    Parse the response of the "id" command into a dictionary.
+
+    Each line of the response looks like '"FID=SEL-351-R...","0A1B"', the first one
+    after the STX character; the checksum field is ignored.
+
+    Args:
+        id_response (str): The response from the "id" command.
+
+    Returns:
+        dict[str, str]: Field name to value, e.g. {"FID": "...", "DEVID": "..."}.
     """
+    identity: dict[str, str] = {}
+    for line in id_response.splitlines():
+        match = re.match(r'^[\s\x02]*"?([A-Za-z0-9_\-]+)=([^"]*)"?', line)
+        if match:
+            identity[match.group(1).upper()] = match.group(2).strip()
+    return identity
 
-    def __init__(self, ip: str, port: int, encoding: str = 'utf-8') -> None:
+
+# How payloads (responses, CHI, CEV, his+ser contents) are written to the log:
+#   full    : The whole payload (default).
+#   compact : SHA-256, byte count and a short head/tail excerpt.
+LOG_PAYLOAD_MODES: Tuple[str, ...] = ("full", "compact")
+log_payload_mode: str = "full"
+
+
+def set_log_payload_mode(mode: str) -> None:
+    """
+    Select how payloads are written to the log.
+
+    Args:
+        mode (str): One of LOG_PAYLOAD_MODES.
+
+    Raises:
+        ValueError: If the mode is not one of LOG_PAYLOAD_MODES.
+    """
+    global log_payload_mode
+    if mode not in LOG_PAYLOAD_MODES:
+        raise ValueError(f"Log payload mode must be one of {LOG_PAYLOAD_MODES}, got {mode}.")
+    log_payload_mode = mode
+
+
+def summarize_payload(payload: str, saved_path: str | None = None, excerpt: int = 60) -> str:
+    """
+    Summarize a payload as a hash, a byte count and a short head/tail excerpt.
+
+    Args:
+        payload (str): The payload to summarize.
+        saved_path (str | None): The file the payload was saved to, if any.
+        excerpt (int): The number of characters kept from each end.
+
+    Returns:
+        str: The one-line summary, e.g. "sha256=226c331890513a38 bytes=509 head=... tail=...".
+    """
+    data: bytes = payload.encode("utf-8", errors="replace")
+    summary: str = f"sha256={hashlib.sha256(data).hexdigest()[:16]} bytes={len(data)}"
+    if len(payload) <= excerpt * 2:
+        summary += f" content={payload!r}"
+    else:
+        summary += f" head={payload[:excerpt]!r} tail={payload[-excerpt:]!r}"
+    if saved_path:
+        summary += f" file={saved_path}"
+    return summary
+
+
+def is_emitted(log_level: int) -> bool:
+    """
+    Tell whether a record of the given level would be written by any log handler.
+
+    The root logger level alone is not enough: the handlers behind the log listener may
+    have their own, higher levels.
+
+    Args:
+        log_level (int): The logging level.
+
+    Returns:
+        bool: True if at least one handler writes records of this level.
+    """
+    root: logging.Logger = logging.getLogger()
+    if not root.isEnabledFor(log_level):
+        return False
+    handlers: List[logging.Handler] = [
+        handler for handler in root.handlers if not isinstance(handler, LocalQueueHandler)
+    ]
+    if _log_listener is not None and len(handlers) < len(root.handlers):
+        handlers += _log_listener.handlers
+    if not root.handlers:
+        handlers = [logging.lastResort] if logging.lastResort else []
+    return any(log_level >= handler.level for handler in handlers)
+
+
+def log_payload(
+    label: str, payload: str | None, log_level: int = logging.DEBUG, saved_path: str | None = None
+) -> None:
+    """
+    Log a payload according to the selected log payload mode.
+
+    Nothing is computed when no log handler would write the record (see is_emitted).
+
+    Args:
+        label (str): What the payload is, e.g. "CEV content".
+        payload (str | None): The payload to log.
+        log_level (int): The logging level to use. Default is logging.DEBUG.
+        saved_path (str | None): The file the payload was saved to, if any.
+    """
+    if not is_emitted(log_level):
+        return
+    if payload is None:
+        logging.log(log_level, f"{label}: None")
+    elif log_payload_mode == "full":
+        saved: str = f" (saved to {saved_path})" if saved_path else ""
+        logging.log(log_level, f"{label}{saved}:\n{payload}")
+    else:
+        logging.log(log_level, f"{label}: {summarize_payload(payload, saved_path)}")
+
+
+class RecordListHandler(logging.Handler):
+    """
+    Keep the last log records in memory, e.g. the asyncio slow-callback warnings.
+    """
+
+    def __init__(self, capacity: int = 500, level: int = logging.WARNING) -> None:
         """
-        Initialize the Telnet client with the IP address, port, and encoding.
+        Initialize the handler.
 
         Args:
-            ip (str): The IP address of the device.
-            port (int): The port number to connect to.
-            encoding (str): The character encoding to use.
+            capacity (int): The number of records kept. Default is 500.
+            level (int): The minimum level of the kept records. Default is WARNING.
         """
-        self.ip: str = ip
-        self.port: int = port
-        self.encoding: str = encoding
-        self.reader = None
-        self.writer = None
+        super().__init__(level)
+        self.records: deque = deque(maxlen=capacity)
 
-    async def __aenter__(self) -> "TelnetClient":
+    def emit(self, record: logging.LogRecord) -> None:
         """
-        Enter the asynchronous context manager.
+        Keep the record.
+
+        Args:
+            record (logging.LogRecord): The log record.
         """
-        await self.connect()
-        return self
+        self.records.append(record)
 
-    async def __aexit__(self, exc_type, exc_value, exc_tb):
+
+class RunProfiler:
+    """
+    Profile a run: CPU profile, asyncio slow callbacks and event loop lag.
+
+    start() and stop() must be called on the running event loop. stop() writes
+    "profile_<time>.prof" (for pstats / snakeviz) and "profile_<time>.txt" (a readable
+    report) into the output folder.
+    """
+
+    def __init__(
+        self,
+        out_path: str,
+        lag_interval: float = 0.05,
+        slow_callback: float = 0.1,
+        top: int = 40,
+    ) -> None:
         """
-        Exit the asynchronous context manager.
+        Initialize the profiler.
+
+        Args:
+            out_path (str): The folder of the profile files, e.g. the SEL download log.
+            lag_interval (float): Seconds between two event loop lag samples. Default is 0.05.
+            slow_callback (float): Callbacks running longer than this many seconds are
+                                   reported by asyncio. Default is 0.1.
+            top (int): The number of functions listed in the report. Default is 40.
         """
-        try:
-            await self.close()
+        self.out_path: str = out_path
+        self.lag_interval: float = lag_interval
+        self.slow_callback: float = slow_callback
+        self.top: int = top
+        self.lags: List[float] = []
+        self._profile: cProfile.Profile = cProfile.Profile()
+        self._slow_callbacks: RecordListHandler = RecordListHandler()
+        self._lag_task: asyncio.Task | None = None
+        self._started: datetime | None = None
+
+    def start(self) -> None:
+        """
+        Start the CPU profile, the asyncio debug mode and the event loop lag monitor.
+        """
+        loop = asyncio.get_running_loop()
+        loop.set_debug(True)
+        loop.slow_callback_duration = self.slow_callback
+        logging.getLogger("asyncio").addHandler(self._slow_callbacks)
+        self._lag_task = asyncio.ensure_future(self._monitor_lag())
+        self._started = datetime.now()
+        self._profile.enable()
+
+    async def _monitor_lag(self) -> None:
+        """
+        Sleep lag_interval again and again and record how late each wake-up was.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            expected: float = loop.time() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            self.lags.append(max(loop.time() - expected, 0.0))
+
+    def stop(self) -> str | None:
+        """
+        Stop profiling and write the profile and the report.
+
+        Returns:
+            str | None: The report path, or None if the profiler was not started.
+        """
+        if self._started is None:
+            return None
+        self._profile.disable()
+        if self._lag_task:
+            self._lag_task.cancel()
+        logging.getLogger("asyncio").removeHandler(self._slow_callbacks)
+        asyncio.get_running_loop().set_debug(False)
+
+        stem: str = os.path.join(
+            self.out_path, f"profile_{self._started.strftime('%Y%m%d_%H.%M.%S')}"
+        )
+        self._profile.dump_stats(f"{stem}.prof")
+        with open(f"{stem}.txt", "w", encoding="utf-8") as file:
+            file.write(self.report())
+        self._started = None
+        print_log(f"Profile saved: {stem}.txt / .prof", logging.INFO)
+        return f"{stem}.txt"
+
+    def report(self) -> str:
+        """
+        Describe the event loop lag, the slow callbacks and the hottest functions.
+
+        Returns:
+            str: The report text.
+        """
+        lines: List[str] = [
+            f"Profile {self._started:%Y-%m-%d %H:%M:%S} - {datetime.now():%H:%M:%S}",
+            "",
+            f"Event loop lag (sampled every {self.lag_interval * 1000:.0f} ms):",
+        ]
+        if self.lags:
+            lags: List[float] = sorted(self.lags)
+            lines.append(
+                f"  samples {len(lags)}, mean {sum(lags) / len(lags) * 1000:.1f} ms, "
+                f"p95 {lags[int(len(lags) * 0.95)] * 1000:.1f} ms, "
+                f"max {lags[-1] * 1000:.1f} ms, "
+                f"over {self.slow_callback * 1000:.0f} ms: "
+                f"{sum(lag > self.slow_callback for lag in lags)}"
+            )
+        lines.append("")
+        lines.append(
+            f"Slow callbacks (> {self.slow_callback * 1000:.0f} ms): "
+            f"{len(self._slow_callbacks.records)}"
+        )
+        for record in self._slow_callbacks.records:
+            created: datetime = datetime.fromtimestamp(record.created)
+            lines.append(f"  {created:%H:%M:%S} {record.getMessage()}")
+
+        for sort_key in ("cumulative", "tottime"):
+            stream = io.StringIO()
+            pstats.Stats(self._profile, stream=stream).sort_stats(sort_key).print_stats(self.top)
+            lines.append("")
+            lines.append(f"Top {self.top} functions by {sort_key} time:")
+            lines.append(stream.getvalue())
+        return "\n".join(lines)
+
+
+class ProgressReporter:
+    """
+    A shared progress reporter for the bulk transfers (CEV and SER) of a session.
+
+    One reporter is shared by every command of a client. Each phase shows the command,
+    the bytes received, the transfer rate and, when the expected size is known, the ETA.
+    The read loop only calls update(), which is a counter increment; tqdm redraws at most
+    every `mininterval` seconds. A disabled reporter does nothing, for headless or fleet
+    runs.
+
+    Attributes:
+        enabled (bool): Whether progress is displayed.
+        mininterval (float): Minimum seconds between two redraws.
+    """
+
+    # Commands whose responses are large enough to be worth a progress bar.
+    PHASE_COMMANDS: Tuple[str, ...] = ("CEV", "SER")
+
+    def __init__(self, enabled: bool = True, mininterval: float = 0.5) -> None:
+        """
+        Initialize the progress reporter.
+
+        Args:
+            enabled (bool): If False, the reporter never displays anything.
+            mininterval (float): Minimum seconds between two redraws.
+        """
+        self.enabled: bool = enabled
+        self.mininterval: float = mininterval
+        self._bar: tqdm | None = None
+
+    def wants(self, command: str) -> bool:
+        """Return True if the command should be shown as a progress phase."""
+        return self.enabled and command.strip().upper().startswith(self.PHASE_COMMANDS)
+
+    def start(self, phase: str, total: int | None = None) -> None:
+        """
+        Start a new phase. Any phase still running is finished first.
+
+        Args:
+            phase (str): The description shown in front of the bar, e.g. the command.
+            total (int | None): The expected number of bytes, enables the ETA.
+        """
+        self.finish()
+        if not self.enabled:
+            return
+        self._bar = tqdm(
+            desc=phase,
+            total=total,
+            unit="B",
+            unit_scale=True,
+            unit_divisor=1024,
+            mininterval=self.mininterval,
+            leave=False,
+            dynamic_ncols=True,
+            disable=None,  # Disable automatically when the output is not a terminal
+        )
+
+    def update(self, nbytes: int) -> None:
+        """Add received bytes to the running phase."""
+        if self._bar is not None:
+            self._bar.update(nbytes)
+
+    def finish(self) -> None:
+        """Finish the running phase and remove its bar."""
+        if self._bar is not None:
+            self._bar.close()
+            self._bar = None
+
+
+# Commands sent to raise the access level before HIS / CHI / SER / CEV.
+LOGIN_COMMANDS: Tuple[str, ...] = ("ACC", "PASS")
+
+
+def login_accepted(responses: List[str]) -> bool:
+    """
+    Tell whether the ACC / PASS responses show a raised access level.
+
+    The login is accepted when the relay ends at its "=>" level prompt and did not reject
+    the password. "Invalid Access Level" is the normal answer of PASS at level 1 and is
+    not a login failure.
+
+    Args:
+        responses (List[str]): The responses of the login commands, in order.
+
+    Returns:
+        bool: True if the session is at access level 1 or higher.
+
+    Examples:
+        >>> login_accepted(["ACC\\nLevel 1\\n=>", "PASS\\nInvalid Access Level\\n=>"])
+        True
+        >>> login_accepted(["ACC\\nPassword: ", "PASS\\nInvalid Password\\n="])
+        False
+        >>> login_accepted(["ACC\\nPassword: "])
+        False
+    """
+    if not responses or any("invalid password" in r.lower() for r in responses):
+        return False
+    return re.search(r"=>+\s*$", responses[-1]) is not None
+
+
+# Cached relay identities older than this (seconds) are read from the relay again.
+IDENTITY_MAX_AGE: int = 60 * 60
+IDENTITY_CACHE_FILE: str = "relay_identity.json"
+
+# Communications processors / port servers that reach several relay ports over one
+# Telnet session. "login": commands sent to the gateway once, "prompts": the gateway
+# prompts, "connect": the command that opens a transparent connection to a port,
+# "connect_wait": seconds to let the connection settle, "disconnect": the sequence
+# that ends it (sent without a line ending).
+GATEWAY_PROFILES: dict[str, dict[str, Any]] = {
+    "sel2030": {
+        "login": ["ACC", "PASS"],
+        "prompts": ["*>", "*"],
+        "connect": "PORT {port}",
+        "connect_wait": 1.0,
+        "disconnect": "\x04",
+    },
+}
+
+
+def ends_at_prompt(buffer: bytes, markers: Tuple[bytes, ...]) -> bool:
+    """
+    Tell whether a gateway answer ends with one of the prompts on a line of its own.
+
+    A prompt must be the whole last line, so a banner or an echo that merely ends with
+    "*" does not end the answer early.
+
+    Args:
+        buffer (bytes): The answer received so far.
+        markers (Tuple[bytes, ...]): The prompts.
+
+    Returns:
+        bool: True if the last non-empty line is one of the prompts.
+
+    Examples:
+        >>> ends_at_prompt(b"PORT 3\\r\\n*>", (b"*>", b"*"))
+        True
+        >>> ends_at_prompt(b"*** SEL-2030 ***", (b"*>", b"*"))
+        False
+        >>> ends_at_prompt(b"ACC\\r\\nPassword: ", (b"*", b"Password:"))
+        True
+    """
+    return buffer.rstrip().rsplit(b"\n", 1)[-1].strip() in markers
+
+
+def load_gateway_profiles(path: str = "gateways.json") -> None:
+    """
+    Merge extra gateway profiles from a JSON file into GATEWAY_PROFILES.
+
+    The file holds an object of profile name to profile, using the same keys as
+    GATEWAY_PROFILES; missing keys are taken from the "sel2030" profile. A missing file
+    is silently ignored.
+
+    Args:
+        path (str): The JSON file with the extra gateway profiles.
+    """
+    if not os.path.isfile(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            extra_profiles: dict = json.load(file)
+    except (OSError, ValueError) as e:
+        print_log(f"Failed to load gateway profiles from {path}: {e}", logging.ERROR)
+        return
+    for name, profile in extra_profiles.items():
+        if not isinstance(profile, dict):
+            logging.error(f"Gateway profile {name} in {path} is not an object, ignored.")
+            continue
+        GATEWAY_PROFILES[name] = {**GATEWAY_PROFILES["sel2030"], **profile}
+        logging.info(f"Gateway profile {name} loaded from {path}.")
+
+
+# Read sizes of the response reader; the size grows while the relay keeps filling it.
+READ_SIZE_MIN: int = 1024
+READ_SIZE_MAX: int = 64 * 1024
+# Bytes kept from the previous chunk when searching a prompt ("Password:" is the longest).
+PROMPT_OVERLAP: int = len("Password:") - 1
+# Measured time-to-first-byte, throughput and response sizes per relay, kept between runs.
+LINK_STATS_FILE: str = "link_stats.json"
+LINK_EWMA_ALPHA: float = 0.3
+# Responses smaller or quicker than this say little about the throughput of the link.
+RATE_MIN_BYTES: int = 4096
+RATE_MIN_SECONDS: float = 0.2
+# Derived idle timeout: IDLE_GAP_FACTOR x longest silence seen in a response + IDLE_MARGIN,
+# clamped. The relay echoes the command at once, so the silence (e.g. while a CEV is
+# prepared) says more about a healthy response than the time-to-first-byte.
+IDLE_GAP_FACTOR: float = 4.0
+IDLE_MARGIN: float = 2.0
+IDLE_TIMEOUT_MIN: float = 5.0
+IDLE_TIMEOUT_MAX: float = 120.0
+# Wait for the first byte: at least TTFB_FACTOR x the measured time-to-first-byte.
+TTFB_FACTOR: float = 3.0
+# Derived total timeout: TOTAL_FACTOR x the expected transfer time, plus the idle timeout,
+# and never less than the caller's timeout.
+TOTAL_FACTOR: float = 3.0
+# Read-only queries that never prompt, so send_commands may write them back-to-back.
+PIPELINE_COMMANDS: Tuple[str, ...] = ("ID", "HIS", "CHI", "SER")
+
+
+def command_shape(command: str) -> str:
+    """
+    Reduce a command to its shape, so responses of the same shape have similar sizes.
+
+    The trailing event ID is dropped, e.g. "CEV R L60 3" -> "CEV R L60".
+
+    Args:
+        command (str): The command.
+
+    Returns:
+        str: The upper-case command without a trailing number.
+    """
+    words: List[str] = command.upper().split()
+    if len(words) > 1 and words[-1].isdigit():
+        words = words[:-1]
+    return " ".join(words)
+
+
+def timing_key(command: str) -> str:
+    """
+    Key of the time-to-first-byte and silence measurements of a command.
+
+    Commands of the same shape share their timing, e.g. "CEV L15" and "CEV R L180" are
+    measured apart. SER date ranges fall back to the command word, so the key set stays
+    bounded.
+
+    Args:
+        command (str): The command.
+
+    Returns:
+        str: The command shape, or the command word if the shape holds a date.
+
+    Examples:
+        >>> timing_key("cev r l60 3")
+        'CEV R L60'
+        >>> timing_key("SER 01/02/2026 01/03/2026")
+        'SER'
+    """
+    shape: str = command_shape(command)
+    return shape.split()[0] if "/" in shape else shape
+
+
+def ewma(average: float | None, sample: float, alpha: float = LINK_EWMA_ALPHA) -> float:
+    """
+    Update an exponentially weighted moving average.
+
+    Args:
+        average (float | None): The current average, or None before the first sample.
+        sample (float): The new sample.
+        alpha (float): The weight of the new sample. Default is LINK_EWMA_ALPHA.
+
+    Returns:
+        float: The updated average.
+    """
+    return sample if average is None else average + alpha * (sample - average)
+
+
+def is_pipeline_command(command: str) -> bool:
+    """
+    Check whether a command is a read-only query that may be pipelined.
+
+    Args:
+        command (str): The command, e.g. "SER 04/29/2024 04/30/2024".
+
+    Returns:
+        bool: True if the first word of the command is one of PIPELINE_COMMANDS.
+    """
+    words: List[str] = command.split()
+    return bool(words) and words[0].upper() in PIPELINE_COMMANDS
+
+
+def find_response_end(buffer: bytearray, scan_from: int = 0, etx_at: int = -1) -> Tuple[int, int]:
+    """
+    Find the end of the first relay response in the buffer.
+
+    A response ends after the "=>" prompt, after a "Password:" prompt, or after the "="
+    (level 0) prompt that follows the ETX of an STX/ETX framed response.
+
+    Args:
+        buffer (bytearray): The received bytes.
+        scan_from (int): The position to start searching from (bytes before it were
+                         already searched). Default is 0.
+        etx_at (int): The ETX position found by an earlier search, or -1.
+
+    Returns:
+        Tuple[int, int]: The index just after the prompt (-1 if the response is not
+                         complete yet) and the ETX position (-1 if none).
+    """
+    if etx_at < 0:
+        etx_at = buffer.find(b"\x03", scan_from)
+    ends: List[int] = []
+    prompt: int = buffer.find(b"=>", scan_from)
+    if prompt >= 0:
+        ends.append(prompt + 2)
+    password: int = buffer.find(b"Password:", scan_from)
+    if password >= 0:
+        ends.append(password + len(b"Password:"))
+    if etx_at >= 0:
+        level_0: int = buffer.find(b"=", max(scan_from, etx_at))
+        if level_0 >= 0:
+            ends.append(level_0 + (2 if buffer.startswith(b">", level_0 + 1) else 1))
+    return (min(ends) if ends else -1), etx_at
+
+
+# Session capture file: CAPTURE_MAGIC, one JSON header line, then records of
+# CAPTURE_RECORD (direction b"S" sent / b"R" received, seconds since start, length) + payload.
+CAPTURE_MAGIC: bytes = b"SELCAP1\n"
+CAPTURE_RECORD: struct.Struct = struct.Struct("<cdI")
+
+
+class SessionCapture:
+    """
+    Record the byte stream of a relay session with timestamps into a capture file.
+    """
+
+    def __init__(self, path: str, header: dict[str, Any]) -> None:
+        """
+        Create the capture file and write its header.
+
+        Args:
+            path (str): The capture file path.
+            header (dict[str, Any]): Session details stored in the header, e.g. ip and port.
+        """
+        self.path: str = path
+        self._file = open(path, "wb")
+        self._file.write(CAPTURE_MAGIC)
+        self._file.write(json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n")
+        self._start: float = time.monotonic()
+
+    def record(self, direction: bytes, data: bytes) -> None:
+        """
+        Append one record.
+
+        Args:
+            direction (bytes): b"S" for bytes sent to the relay, b"R" for bytes received.
+            data (bytes): The payload.
+        """
+        if self._file.closed or not data:
+            return
+        elapsed: float = time.monotonic() - self._start
+        self._file.write(CAPTURE_RECORD.pack(direction, elapsed, len(data)))
+        self._file.write(data)
+
+    def close(self) -> None:
+        """
+        Close the capture file.
+        """
+        if not self._file.closed:
+            self._file.close()
+            print_log(f"Session capture saved: {self.path}", logging.INFO)
+
+
+def read_capture(path: str) -> Tuple[dict[str, Any], List[Tuple[bytes, float, bytes]]]:
+    """
+    Read a capture file written by SessionCapture.
+
+    Args:
+        path (str): The capture file path.
+
+    Raises:
+        ValueError: If the file is not a session capture or is truncated.
+
+    Returns:
+        Tuple[dict[str, Any], List[Tuple[bytes, float, bytes]]]: The header and the
+            (direction, seconds since start, payload) records.
+    """
+    with open(path, "rb") as file:
+        if file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a session capture file.")
+        header: dict[str, Any] = json.loads(file.readline())
+        records: List[Tuple[bytes, float, bytes]] = []
+        while head := file.read(CAPTURE_RECORD.size):
+            if len(head) < CAPTURE_RECORD.size:
+                raise ValueError(f"{path} is truncated.")
+            direction, elapsed, length = CAPTURE_RECORD.unpack(head)
+            data: bytes = file.read(length)
+            if len(data) < length:
+                raise ValueError(f"{path} is truncated.")
+            records.append((direction, elapsed, data))
+    return header, records
+
+
+class ReplayWriter:
+    """
+    Stand-in for the telnetlib3 writer that plays a capture back instead of a relay.
+
+    Each write releases the received records that followed the matching sent record
+    in the capture, at the original pace scaled by speed (0 = as fast as possible).
+    """
+
+    def __init__(self, records: List[Tuple[bytes, float, bytes]], speed: float = 1.0) -> None:
+        """
+        Initialize the replay from the capture records.
+
+        Args:
+            records (List[Tuple[bytes, float, bytes]]): The records of read_capture.
+            speed (float): The replay speed factor; 0 replays without any delay.
+        """
+        self.speed: float = speed
+        self._records: deque = deque(records)
+        # (time the data may be read, data) of the released received records
+        self.released: deque = deque()
+        self._closing: bool = False
+        self._release()  # The greeting received before the first command
+
+    def _release(self, sent_at: float | None = None) -> None:
+        """
+        Release the received records up to the next sent record.
+
+        Args:
+            sent_at (float | None): The capture time of the sent record the replay is at.
+        """
+        now: float = asyncio.get_running_loop().time() if self.speed else 0.0
+        while self._records and self._records[0][0] == b"R":
+            _, elapsed, data = self._records.popleft()
+            delay: float = (elapsed - (sent_at or elapsed)) / self.speed if self.speed else 0.0
+            self.released.append((now + delay, data))
+
+    def at_end(self) -> bool:
+        """Whether the capture has no more received records, only sent ones (or none)."""
+        return all(direction == b"S" for direction, _, _ in self._records)
+
+    def write(self, data: bytes) -> None:
+        """
+        Play the next sent record of the capture and release its responses.
+
+        Args:
+            data (bytes): The bytes the client sends.
+        """
+        if not self._records:
+            logging.warning(f"Replay: capture ended, {data!r} is not answered.")
+            return
+        _, sent_at, expected = self._records.popleft()
+        if data != expected:
+            logging.warning(f"Replay: sent {data!r}, the capture has {expected!r}.")
+        self._release(sent_at)
+
+    async def drain(self) -> None:
+        """Nothing to flush in a replay."""
+
+    def is_closing(self) -> bool:
+        """Whether close() was called."""
+        return self._closing
+
+    def close(self) -> None:
+        """End the replay."""
+        self._closing = True
+
+
+class ReplayReader:
+    """
+    Stand-in for the telnetlib3 reader that returns the bytes released by a ReplayWriter.
+    """
+
+    def __init__(self, writer: ReplayWriter) -> None:
+        """
+        Initialize the reader of a replay.
+
+        Args:
+            writer (ReplayWriter): The replay writer that releases the received bytes.
+        """
+        self.writer: ReplayWriter = writer
+
+    async def read(self, n: int = -1) -> bytes:
+        """
+        Read up to n released bytes, waiting until they are due at the replay speed.
+
+        Raises:
+            asyncio.TimeoutError: If the relay was silent at this point of the capture
+                                  (the client has to send the next command first).
+
+        Returns:
+            bytes: The data, or b"" at the end of the capture.
+        """
+        released: deque = self.writer.released
+        if not released:
+            if self.writer.at_end() or self.writer.is_closing():
+                return b""
+            raise asyncio.TimeoutError("Replay: the relay was silent here.")
+        due, data = released[0]
+        wait: float = due - asyncio.get_running_loop().time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        if 0 < n < len(data):
+            released[0] = (due, data[n:])
+            return data[:n]
+        released.popleft()
+        return data
+
+
+def open_replay(path: str, speed: float = 1.0) -> Tuple[ReplayReader, ReplayWriter]:
+    """
+    Open a capture file as a replay transport for TelnetClient.
+
+    Args:
+        path (str): The capture file path.
+        speed (float): The replay speed factor; 0 replays without any delay.
+
+    Returns:
+        Tuple[ReplayReader, ReplayWriter]: The reader and writer of the replay.
+    """
+    _, records = read_capture(path)
+    writer = ReplayWriter(records, speed=speed)
+    return ReplayReader(writer), writer
+
+
+class TelnetClient:
+    """
+    A simple Telnet client using telnetlib3 to connect to a device, send a command,
+    and print the response.
+    """
+
+    def __init__(
+        self,
+        ip: str,
+        port: int,
+        encoding: str = 'utf-8',
+        progress: ProgressReporter | None = None,
+        raw: bool = True,
+        pipeline: bool = True,
+        capture_path: str | None = None,
+        replay_path: str | None = None,
+        replay_speed: float = 1.0,
+        gateway: str | None = None,
+    ) -> None:
+        """
+        Initialize the Telnet client with the IP address, port, and encoding.
+
+        Args:
+            ip (str): The IP address of the device.
+            port (int): The port number to connect to.
+            encoding (str): The character encoding to use.
+            progress (ProgressReporter | None): The shared progress reporter. Default is an
+                                                enabled reporter for this client.
+            raw (bool): If True, the Telnet stream carries bytes and each response is decoded
+                        once when it is complete. If False, telnetlib3 decodes every read.
+                        Default is True.
+            pipeline (bool): If True, send_commands writes read-only queries back-to-back.
+                             Default is True.
+            capture_path (str | None): Record the session byte stream into this capture
+                                       file. Default is no capture.
+            replay_path (str | None): Play this capture file back instead of connecting
+                                      to the relay. Default is a live connection.
+            replay_speed (float): The replay speed factor; 0 replays without any delay.
+            gateway (str | None): The GATEWAY_PROFILES name when ip:port is a
+                                  communications processor; switch_port() then selects
+                                  the relay behind it. Default is a direct connection.
+        """
+        self.ip: str = ip
+        self.port: int = port
+        self.encoding: str = encoding
+        self.raw: bool = raw
+        self.pipeline: bool = pipeline
+        self.capture_path: str | None = capture_path
+        self.replay_path: str | None = replay_path
+        self.replay_speed: float = replay_speed
+        self.capture: SessionCapture | None = None
+        self.gateway: dict[str, Any] | None = GATEWAY_PROFILES[gateway] if gateway else None
+        self.gateway_port: int | None = None  # The relay port behind the gateway
+        self._gateway_logged_in: bool = False
+        # Captured and replayed sessions ignore the identity cache, so both send the same
+        # commands.
+        self.use_caches: bool = not (capture_path or replay_path)
+        self.progress: ProgressReporter = progress if progress else ProgressReporter()
+        self.reader = None
+        self.writer = None
+        self._rx_buffer: bytearray = bytearray()  # Reused by every response
+        self._rx_pending: bytearray = bytearray()  # Start of the next pipelined response
+        self._split_prompt: bool = False  # The last response ended at a bare "=" prompt
+        self._last_rx: float = 0.0
+        self._first_rx: float | None = None
+        self._max_gap: float = 0.0
+        self._sent_at: float | None = None  # Cleared once the first response is measured
+        # "ttfb" and "gap" (seconds per timing_key), "rate" (bytes/s) and "sizes"
+        # (bytes per command shape)
+        self.link: dict[str, Any] = {"ttfb": {}, "gap": {}, "rate": None, "sizes": {}}
+        self.fid: str | None = None
+        self.identity: dict[str, str] | None = None
+        self.authenticated: bool = False
+
+    @property
+    def relay_key(self) -> str:
+        """The key of this relay in the persistent caches, "ip:port" or "ip:port#gateway port"."""
+        if self.gateway_port is not None:
+            return f"{self.ip}:{self.port}#{self.gateway_port}"
+        return f"{self.ip}:{self.port}"
+
+    async def __aenter__(self) -> "TelnetClient":
+        """
+        Enter the asynchronous context manager.
+        """
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_tb):
+        """
+        Exit the asynchronous context manager.
+        """
+        try:
+            await self.close()
         except Exception as e:
             print(f"When close telnet to SEL Relay, error occurred: {e}")
             logging.error(f"When close telnet to SEL Relay, error occurred: {e}")
@@ -567,16 +1989,30 @@ class TelnetClient:
         """
         Establish a Telnet connection to the device.
         """
-        if not self.writer:
+        if not self.writer and self.replay_path:
+            self.reader, self.writer = open_replay(self.replay_path, speed=self.replay_speed)
+            logging.info(f"Replay {self.replay_path} as {self.ip}:{self.port}")
+        elif not self.writer:
             try:
                 self.reader, self.writer = await telnetlib3.open_connection(
                     host=self.ip,
                     port=self.port,
-                    encoding=self.encoding,
+                    encoding=False if self.raw else self.encoding,
                     connect_minwait=2,  # Minimum wait time for Telnet negotiations
                     connect_maxwait=3,  # Maximum wait time for Telnet negotiations
                 )
                 logging.info(f"Connected to {self.ip}:{self.port}")
+                self.link.update(load_state_file(LINK_STATS_FILE).get(self.relay_key, {}))
+                if self.capture_path:
+                    self.capture = SessionCapture(
+                        self.capture_path,
+                        header={
+                            "ip": self.ip,
+                            "port": self.port,
+                            "encoding": self.encoding,
+                            "created": datetime.now().isoformat(timespec="seconds"),
+                        },
+                    )
             except Exception as e:
                 logging.warn(f"Failed to connect: {e}")
                 # Attempt to ping the device
@@ -593,431 +2029,2819 @@ class TelnetClient:
         """
         Close the Telnet connection.
         """
-        print_log("SEL relay connect close call.", logging.INFO)
-        if self.writer:
+        print_log("SEL relay connect close call.", logging.INFO)
+        if not self.replay_path:
+            self.save_link_stats()
+        if self.writer:
+            try:
+                if not self.writer.is_closing() and self.gateway_port is not None:
+                    await self._leave_port()
+                if not self.writer.is_closing():
+                    await self.send_command(command="QUI", show_res=True, timeout=1)
+                    await self.send_command(command="EXIT", show_res=True, timeout=1)
+                    print_log("!!!SEL Relay connection closed.!!!", logging.INFO)
+                    self.writer.close()
+                    await asyncio.sleep(0.5)  # Allow some time for the connection to close properly
+                else:
+                    print_log("Writer is already closing.", logging.WARN)
+            except Exception as e:
+                logging.error(f"Error closing connection: {e}")
+                raise
+            finally:
+                if self.capture:
+                    self.capture.close()
+        else:
+            logging.warning("Connection was not established.")
+            raise ConnectionError("SEL Relay no connect.")
+
+    async def login(self) -> List[str]:
+        """
+        Raise the access level of the session with the ACC and PASS commands.
+
+        The commands are sent one at a time; a failed command is logged and the next one
+        is still sent. The session only counts as authenticated if the relay answers
+        with its level prompt (see login_accepted).
+
+        Returns:
+            List[str]: The responses of the login commands that were answered.
+        """
+        responses: List[str] = []
+        for command in LOGIN_COMMANDS:
+            try:
+                if self.writer is None or self.writer.is_closing():
+                    print_log(f"Writer is already closing. Command: {command}", logging.WARN)
+                    continue
+                responses.append(await self.send_command(command))
+            except ConnectionError:
+                print_log(f"Writer is already closing. Command: {command}", logging.WARN)
+            except Exception as e:
+                logging.error(f"Error during {command} command: {e}")
+        self.authenticated = login_accepted(responses)
+        if not self.authenticated:
+            print_log(f"Login to {self.relay_key} was not accepted.", logging.WARN)
+        return responses
+
+    async def switch_port(self, port: int) -> None:
+        """
+        Connect the gateway session to the relay on another gateway port.
+
+        The gateway login runs once per session. When a relay is connected already, its
+        access level is dropped with QUI and the transparent connection is ended before
+        the next port is opened. The identity, login state and link measurements then
+        belong to the new relay.
+
+        Args:
+            port (int): The relay port number on the gateway.
+
+        Raises:
+            ValueError: If the client was not created with a gateway profile.
+            ConnectionError: If the gateway or the relay does not answer with its prompt.
+        """
+        if self.gateway is None:
+            raise ValueError("switch_port needs a TelnetClient with a gateway profile.")
+        if self.gateway_port == port:
+            return
+        gateway_prompts: Tuple[str, ...] = tuple(self.gateway["prompts"])
+        if self.gateway_port is not None:
+            await self._leave_port()
+        elif not self._gateway_logged_in:
+            for command in self.gateway["login"]:
+                await self._gateway_exchange(
+                    f"{command}\r\n", markers=(*gateway_prompts, "Password:")
+                )
+            self._gateway_logged_in = True
+
+        await self._write_text(self.gateway["connect"].format(port=port) + "\r\n")
+        self.gateway_port = port  # Set before the relay answers, so a failure still leaves it
+        await asyncio.sleep(self.gateway["connect_wait"])
+        await self._gateway_exchange("\r\n", markers=("=", "=>"))
+        self.identity = None
+        self.fid = None
+        self.authenticated = False
+        self.link = {"ttfb": {}, "gap": {}, "rate": None, "sizes": {}}
+        self.link.update(load_state_file(LINK_STATS_FILE).get(self.relay_key, {}))
+        print_log(f"Gateway {self.ip}:{self.port} switched to port {port}.", logging.INFO)
+
+    async def _leave_port(self) -> None:
+        """
+        Drop the access level of the connected relay and end the transparent connection.
+        """
+        if not self.replay_path:
+            self.save_link_stats()
+        await self.send_command(command="QUI", show_res=False, timeout=1)
+        await self._gateway_exchange(
+            self.gateway["disconnect"], markers=tuple(self.gateway["prompts"])
+        )
+        logging.info(f"Gateway {self.ip}:{self.port} left port {self.gateway_port}.")
+        self.gateway_port = None
+
+    async def _gateway_exchange(
+        self, data: str, markers: Tuple[str, ...], timeout: float = 10
+    ) -> str:
+        """
+        Write text and read until the received text ends with one of the markers.
+
+        Gateway prompts (e.g. "*>") and the level 0 relay prompt "=" are not recognised
+        by the response reader, so port switching reads with its own end markers.
+
+        Args:
+            data (str): The text to write, including any line ending.
+            markers (Tuple[str, ...]): The prompts that end the answer.
+            timeout (float): The maximum time in seconds for the answer. Default is 10.
+
+        Raises:
+            ConnectionError: If no marker arrives within the timeout.
+
+        Returns:
+            str: The answer.
+        """
+        await self._wait_for_previous_data(2)
+        await self._write_text(data)
+        end_markers: Tuple[bytes, ...] = tuple(marker.encode(self.encoding) for marker in markers)
+        loop = asyncio.get_running_loop()
+        deadline: float = loop.time() + timeout
+        buffer: bytearray = bytearray()
+        try:
+            while not ends_at_prompt(buffer, end_markers):
+                chunk: bytes | str = await asyncio.wait_for(
+                    self.reader.read(READ_SIZE_MIN), max(deadline - loop.time(), 0.0)
+                )
+                if not chunk:
+                    raise ConnectionError("Gateway closed the connection.")
+                if isinstance(chunk, str):
+                    chunk = chunk.encode(self.encoding)
+                if self.capture:
+                    self.capture.record(b"R", chunk)
+                buffer += chunk
+        except asyncio.TimeoutError:
+            raise ConnectionError(f"Gateway {self.ip}:{self.port} did not answer {data!r}.")
+        answer: str = buffer.decode(self.encoding, errors="replace")
+        log_payload(f"Gateway answer to {data.strip()!r}", answer)
+        return answer
+
+    async def probe_newest_event(self) -> Tuple[str, str] | None:
+        """
+        Read the newest event record with one short command (the model's probe_command).
+
+        If the relay session has dropped back to access level 0, the session logs in
+        again and repeats the probe once.
+
+        Returns:
+            Tuple[str, str] | None: The Formatted_Time and EVENT of the newest event, or
+                                    None if the relay has no event records.
+        """
+        probe_command: str = RELAY_MODELS[self.model]["probe_command"]
+        response: str = await self.send_command(command=probe_command, show_res=False)
+        if "invalid access level" in response.lower():
+            logging.info(f"{self.relay_key} access level dropped, login again.")
+            await self.login()
+            response = await self.send_command(command=probe_command, show_res=False)
+
+        data: pd.DataFrame | None = parse_chi_records(response)
+        if data is None or data.empty:
+            return None
+        newest: pd.Series = data.sort_values("Formatted_Time").iloc[-1]
+        return newest['Formatted_Time'], newest['EVENT']
+
+    async def cancel_all_tasks(self):
+        """
+        Cancel all running asyncio tasks except the current one.
+        """
+        current_task = asyncio.current_task()
+        for task in asyncio.all_tasks():
+            if task is not current_task:
+                task.cancel()
+        await asyncio.gather(*asyncio.all_tasks(), return_exceptions=True)
+
+    async def ping_device(self) -> bool:
+        """
+        Ping the device to check if it is reachable.
+
+        Returns:
+            bool: True if the device responds to ping, False otherwise.
+        """
+        # Use the ping command with 1 packet
+        ping_args: List[str] = (
+            ["ping", "-n", "1", self.ip] if IS_WINDOWS else ["ping", "-c", "1", "-W", "2", self.ip]
+        )
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *ping_args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            stdout: bytes
+            stderr: bytes
+            stdout, stderr = await process.communicate()
+
+            if process.returncode == 0:
+                logging.info(f"Ping to {self.ip} successful.")
+                return True
+            else:
+                error_mes: str = f"Ping to {self.ip} failed: {stderr.decode().strip()}"
+                print(error_mes)
+                logging.warn(error_mes)
+                return False
+        except FileNotFoundError:
+            logging.info("No ping command on this system, probe the Telnet port instead.")
+            return await self.probe_port()
+        except Exception as e:
+            print(f"Error during ping: {e}")
+            logging.error(f"Error during ping: {e}")
+            return False
+
+    async def probe_port(self, timeout: float = 3) -> bool:
+        """
+        Check if the device is reachable by opening (and closing) a TCP connection.
+
+        A refused connection still proves the device is reachable.
+
+        Args:
+            timeout (float): The maximum time in seconds to wait for the connection.
+
+        Returns:
+            bool: True if the device answered, False otherwise.
+        """
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.ip, self.port), timeout=timeout
+            )
+            writer.close()
+            return True
+        except ConnectionRefusedError:
+            return True
+        except (OSError, asyncio.TimeoutError) as e:
+            logging.warning(f"Probe to {self.ip}:{self.port} failed: {e}")
+            return False
+
+    def _check_command(self, command: str) -> None:
+        """
+        Refuse prohibited commands and commands without a connection.
+
+        Args:
+            command (str): The command to send.
+
+        Raises:
+            ConnectionError: If there is no active connection to any device.
+            ProhibitedCommandError: If the command is prohibited.
+        """
+        prohibited_commands: List[str] = ["SER C", "HIS C", "COM C", "2AC"]
+
+        # Check for prohibited commands
+        for prohibited_command in prohibited_commands:
+            if prohibited_command.lower() in command.lower():
+                raise ProhibitedCommandError(
+                    command, f"The command '{prohibited_command}' is not allowed."
+                )
+
+        if not self.writer:
+            raise ConnectionError("Not connected to SEL Relay.")
+
+    async def _write_commands(self, commands: List[str]) -> None:
+        """
+        Write one or more commands to the relay in a single write.
+
+        Args:
+            commands (List[str]): The commands, without line endings.
+
+        Raises:
+            ConnectionError: If the writer is closing or already closed.
+        """
+        await self._write_text("".join(command + '\r\n' for command in commands))
+
+    async def _write_text(self, data: str) -> None:
+        """
+        Write text to the connection as it is, e.g. a gateway disconnect sequence.
+
+        Args:
+            data (str): The text to write.
+
+        Raises:
+            ConnectionError: If the writer is closing or already closed.
+        """
+        try:
+            payload: bytes = data.encode(self.encoding)
+            self.writer.write(payload if self.raw or self.replay_path else data)
+            if self.capture:
+                self.capture.record(b"S", payload)
+            await self.writer.drain()
+            self._sent_at = asyncio.get_running_loop().time()
+        except AttributeError as e:
+            print_log(
+                f"Failed to send command due to writer being None or closing: {e}", logging.WARN
+            )
+            raise ConnectionError("Writer is closing or already closed.")
+
+    async def _receive(
+        self, command: str, timeout: float, expected_bytes: int | None = None
+    ) -> str:
+        """
+        Read and decode the response of one command that was already written.
+
+        Args:
+            command (str): The command the response belongs to.
+            timeout (float): The idle timeout in seconds used until the link is measured.
+            expected_bytes (int | None): The expected response size. Default is the size
+                                         of the last response of the same shape.
+
+        Raises:
+            ConnectionError: If the response is not received within the timeout period.
+
+        Returns:
+            str: The response from the device.
+        """
+        first_timeout, idle_timeout, total_timeout = self.command_timeouts(
+            command, timeout, expected_bytes
+        )
+        logging.debug(
+            f"Timeouts of [{command.strip()}]: first byte {first_timeout:.1f}s, "
+            f"idle {idle_timeout:.1f}s, total {total_timeout}s."
+        )
+        show_progress: bool = self.progress.wants(command)
+        if show_progress:
+            self.progress.start(
+                phase=command.strip(),
+                total=expected_bytes or self.link["sizes"].get(command_shape(command)),
+            )
+
+        try:
+            await self._read_response(
+                timeout=idle_timeout,
+                show_progress=show_progress,
+                total_timeout=total_timeout,
+                first_timeout=first_timeout,
+            )
+        except asyncio.TimeoutError:
+            error_message: str = f"Timeout waiting for response to command: {command.strip()}"
+            logging.error(error_message)
+            raise ConnectionError(error_message)
+        finally:
+            if show_progress:
+                self.progress.finish()
+        self._record_link_stats(command, len(self._rx_buffer))
+
+        # Replace multiple line breaks with a single line break
+        response: str = re.sub(
+            r'\r\n+', '\n', self._rx_buffer.decode(self.encoding, errors="replace")
+        )
+        self._rx_buffer.clear()
+        logging.info(f"Command sent: {command}")
+        log_payload("Response received", response, log_level=logging.INFO)
+        return response
+
+    async def send_command(
+        self,
+        command: str,
+        show_res: bool = True,
+        timeout: int = 10,
+        expected_bytes: int | None = None,
+    ) -> str:
+        """
+        Send a command to the connected device and receive the response.
+
+        Args:
+            command (str): The command to send to the device.
+            show_res (bool): If True, prints a message indicating the command was sent. Default is True.
+            timeout (int): The maximum idle time in seconds to wait for data until the link
+                           to this relay is measured. Default is 10 seconds.
+            expected_bytes (int | None): The expected response size, used for the total
+                                         timeout. Default is the last size of the same shape.
+
+        Raises:
+            ConnectionError: If there is no active connection to any device.
+            asyncio.TimeoutError: If the response is not received within the timeout period.
+            ProhibitedCommandError: If the command is prohibited.
+
+        Returns:
+            str: The response from the device.
+        """
+        self._check_command(command)
+
+        # Wait until the device stops sending data
+        if command.strip().lower() not in ["exit", "qui"]:
+            logging.debug(f"Comaand is [{command}]. Start wait for previous data.")
+            await self._wait_for_previous_data(10)
+            logging.debug(f"Comaand is [{command}]. End waite for previous data.")
+
+        command_print: str = (
+            f"\nSend 【{command}】 command to Relay Device, please wait Relay feedback."
+        )
+        logging.debug(command_print)
+        if show_res is True:
+            print(command_print)
+        await self._write_commands([command])
+
+        if command.strip().lower() in ["exit", "qui"]:
+            await asyncio.sleep(1)
+            return ""
+        return await self._receive(command, timeout, expected_bytes)
+
+    async def send_commands(
+        self, commands: List[str], show_res: bool = True, timeout: int = 10
+    ) -> List[str]:
+        """
+        Send a batch of commands and return their responses in the same order.
+
+        Runs of read-only queries (PIPELINE_COMMANDS) are written back-to-back in one
+        write, and the combined stream is split into per-command responses at the prompt
+        boundaries. Any other command (e.g. ACC / PASS, which answer with a password
+        prompt) is sent on its own with send_command, in order. With pipeline disabled
+        every command is sent on its own.
+
+        Args:
+            commands (List[str]): The commands to send.
+            show_res (bool): If True, prints a message for each command. Default is True.
+            timeout (int): The maximum idle time in seconds per response. Default is 10.
+
+        Raises:
+            ConnectionError: If there is no active connection or a response times out.
+            ProhibitedCommandError: If a command is prohibited.
+
+        Returns:
+            List[str]: The response of each command.
+        """
+        responses: List[str] = []
+        batch: List[str] = []
+        for command in [*commands, None]:
+            if command is not None and self.pipeline and is_pipeline_command(command):
+                batch.append(command)
+                continue
+            if len(batch) == 1:
+                responses.append(await self.send_command(batch[0], show_res, timeout))
+            elif batch:
+                responses.extend(await self._send_pipelined(batch, show_res, timeout))
+            batch = []
+            if command is not None:
+                responses.append(await self.send_command(command, show_res, timeout))
+        return responses
+
+    async def _send_pipelined(
+        self, commands: List[str], show_res: bool = True, timeout: int = 10
+    ) -> List[str]:
+        """
+        Write read-only commands back-to-back and read their responses in order.
+
+        Args:
+            commands (List[str]): The read-only commands to send.
+            show_res (bool): If True, prints a message for each command. Default is True.
+            timeout (int): The maximum idle time in seconds per response. Default is 10.
+
+        Returns:
+            List[str]: The response of each command.
+        """
+        for command in commands:
+            self._check_command(command)
+        await self._wait_for_previous_data(10)
+
+        command_print: str = (
+            f"\nSend 【{' | '.join(commands)}】 commands to Relay Device, please wait Relay "
+            "feedback."
+        )
+        logging.debug(command_print)
+        if show_res is True:
+            print(command_print)
+        await self._write_commands(commands)
+
+        responses: List[str] = []
+        for command in commands:
+            responses.append(await self._receive(command, timeout))
+        return responses
+
+    async def _read_response(
+        self,
+        timeout: float,
+        show_progress: bool = False,
+        total_timeout: float | None = None,
+        first_timeout: float | None = None,
+    ) -> None:
+        """
+        Read one response into the receive buffer, with a single idle watchdog.
+
+        The reader task runs without a timer per chunk. The watchdog only wakes up when
+        no data arrived for `timeout` seconds since the last chunk (or at the total
+        deadline), so a long CEV transfer costs one timer per idle window instead of one
+        per read.
+
+        Args:
+            timeout (float): The maximum idle time in seconds between two chunks.
+            show_progress (bool): If True, report the received bytes to the progress bar.
+            total_timeout (float | None): The maximum time in seconds for the whole
+                                          response. Default is no limit.
+            first_timeout (float | None): The maximum time in seconds until the first
+                                          chunk arrives. Default is `timeout`.
+
+        Raises:
+            asyncio.TimeoutError: If no data arrives within the timeout, or the response
+                                  is not complete within the total timeout.
+            ConnectionError: If the relay closes the connection.
+        """
+        loop = asyncio.get_running_loop()
+        self._rx_buffer.clear()
+        self._last_rx = loop.time()
+        self._first_rx = None
+        self._max_gap = 0.0
+        deadline: float = self._last_rx + total_timeout if total_timeout else float("inf")
+        read_task: asyncio.Task = asyncio.ensure_future(self._read_until_prompt(show_progress))
+        try:
+            while True:
+                # The relay may think a while before the first byte (e.g. preparing a CEV)
+                idle: float = timeout
+                if self._first_rx is None:
+                    idle = max(first_timeout or 0, timeout)
+                wake_at: float = min(self._last_rx + idle, deadline)
+                done, _ = await asyncio.wait({read_task}, timeout=max(wake_at - loop.time(), 0.0))
+                if done:
+                    read_task.result()
+                    return
+                now: float = loop.time()
+                if now - self._last_rx >= idle or now >= deadline:
+                    raise asyncio.TimeoutError
+        finally:
+            if not read_task.done():
+                read_task.cancel()
+
+    async def _read_until_prompt(self, show_progress: bool = False) -> None:
+        """
+        Fill the receive buffer with exactly one response, up to and including its prompt.
+
+        Bytes received after the prompt (the start of the next pipelined response) are
+        kept in the pending buffer for the next read. The read size doubles while the
+        relay keeps filling it (bulk CEV / SER data) and the prompt search only looks at
+        the newly received bytes. A response that ended at a bare "=" may have had its
+        "=>" split over two chunks; a ">" at the start of the next response is dropped.
+
+        Args:
+            show_progress (bool): If True, report the received bytes to the progress bar.
+
+        Raises:
+            ConnectionError: If the relay closes the connection.
+        """
+        loop = asyncio.get_running_loop()
+        buffer: bytearray = self._rx_buffer
+        buffer += self._rx_pending
+        self._rx_pending.clear()
+        read_size: int = READ_SIZE_MIN
+        scan_from: int = 0
+        etx_at: int = -1
+        while True:
+            if self._split_prompt and buffer:
+                if buffer.startswith(b">"):
+                    del buffer[:1]
+                self._split_prompt = False
+            end, etx_at = find_response_end(buffer, scan_from, etx_at)
+            if end >= 0:
+                self._rx_pending += buffer[end:]
+                del buffer[end:]
+                self._split_prompt = not self._rx_pending and buffer.endswith(b"=")
+                return
+
+            chunk: bytes | str = await self.reader.read(read_size)
+            if not chunk:
+                raise ConnectionError("SEL Relay closed the connection.")
+            if isinstance(chunk, str):
+                chunk = chunk.encode(self.encoding)
+            if self.capture:
+                self.capture.record(b"R", chunk)
+            now: float = loop.time()
+            self._max_gap = max(self._max_gap, now - self._last_rx)
+            self._last_rx = now
+            if self._first_rx is None:
+                self._first_rx = now
+            scan_from = max(len(buffer) - PROMPT_OVERLAP, 0)  # Prompt split over chunks
+            buffer += chunk
+            if show_progress:
+                self.progress.update(len(chunk))
+            if len(chunk) >= read_size:
+                read_size = min(read_size * 2, READ_SIZE_MAX)
+
+    def command_timeouts(
+        self, command: str, timeout: float, expected_bytes: int | None = None
+    ) -> Tuple[float, float, float | None]:
+        """
+        Derive the first-byte, idle and total timeouts of a command from the measured link.
+
+        The idle timeout follows the longest silence measured in earlier responses of the
+        same shape, so a dead link fails in seconds; a CEV never gets less than the
+        caller's timeout, because the relay may pause while it prepares a longer event.
+        The first byte is awaited at least TTFB_FACTOR times the measured time-to-first-
+        byte and never less than the caller's timeout. The total timeout allows
+        TOTAL_FACTOR times the expected transfer time, so a slow but steady transfer is
+        never cut off by a fixed limit.
+
+        Args:
+            command (str): The command.
+            timeout (float): The idle timeout used while the command has no measurement.
+            expected_bytes (int | None): The expected response size. Default is the size
+                                         of the last response of the same shape.
+
+        Returns:
+            Tuple[float, float, float | None]: The first-byte timeout, the idle timeout and
+                                               the total timeout (None if the size or
+                                               throughput is unknown), in seconds.
+        """
+        key: str = timing_key(command)
+        ttfb: float | None = self.link["ttfb"].get(key)
+        gap: float | None = self.link["gap"].get(key)
+        if gap is None:
+            idle_timeout: float = timeout
+        else:
+            idle_timeout = min(
+                max(IDLE_GAP_FACTOR * gap + IDLE_MARGIN, IDLE_TIMEOUT_MIN), IDLE_TIMEOUT_MAX
+            )
+            if key.startswith("CEV"):
+                idle_timeout = max(idle_timeout, timeout)
+        first_timeout: float = max(idle_timeout, TTFB_FACTOR * (ttfb or 0), timeout)
+
+        if expected_bytes is None:
+            expected_bytes = self.link["sizes"].get(command_shape(command))
+        rate: float | None = self.link["rate"]
+        if not expected_bytes or not rate:
+            return first_timeout, idle_timeout, None
+        total_timeout: float = first_timeout + TOTAL_FACTOR * expected_bytes / rate + idle_timeout
+        return first_timeout, idle_timeout, round(max(total_timeout, timeout), 1)
+
+    def estimate_transfer(self, command: str, model_bytes: int) -> Tuple[int, float, str]:
+        """
+        Estimate the response size and duration of a command from the measured link.
+
+        Args:
+            command (str): The command.
+            model_bytes (int): The size to assume when no response of the same shape was
+                               measured yet.
+
+        Returns:
+            Tuple[int, float, str]: The size in bytes, the duration in seconds and the
+                                    source of the size ("measured" or "model").
+        """
+        measured: int | None = self.link["sizes"].get(command_shape(command))
+        nbytes: int = measured or model_bytes
+        ttfb: float = self.link["ttfb"].get(timing_key(command), PLAN_DEFAULT_TTFB)
+        seconds: float = ttfb + nbytes / (self.link["rate"] or PLAN_DEFAULT_RATE)
+        return nbytes, round(seconds, 1), "measured" if measured else "model"
+
+    def _record_link_stats(self, command: str, nbytes: int) -> None:
+        """
+        Update the link measurements with the response that was just received.
+
+        Only the first response after a write gives a time-to-first-byte; the later
+        responses of a pipelined batch may already be waiting in the buffer.
+
+        Args:
+            command (str): The command of the response.
+            nbytes (int): The size of the response in bytes.
+        """
+        if not command.strip() or self._first_rx is None:
+            return
+        key: str = timing_key(command)
+        if self._sent_at is not None:
+            ttfb: float = self._first_rx - self._sent_at
+            self.link["ttfb"][key] = round(ewma(self.link["ttfb"].get(key), ttfb), 4)
+            self.link["gap"][key] = round(ewma(self.link["gap"].get(key), self._max_gap), 4)
+            self._sent_at = None
+        transfer_time: float = self._last_rx - self._first_rx
+        if nbytes >= RATE_MIN_BYTES and transfer_time >= RATE_MIN_SECONDS:
+            self.link["rate"] = round(ewma(self.link["rate"], nbytes / transfer_time), 1)
+        shape: str = command_shape(command)
+        if "/" not in shape:  # SER date ranges vary in size; keep only repeatable shapes
+            self.link["sizes"][shape] = nbytes
+
+    def save_link_stats(self) -> None:
+        """
+        Save the link measurements of this relay into LINK_STATS_FILE.
+        """
+        if not self.link["ttfb"]:
+            return
+        link_stats: dict = load_state_file(LINK_STATS_FILE)
+        link_stats[self.relay_key] = self.link
+        save_state_file(LINK_STATS_FILE, link_stats)
+
+    async def _wait_for_previous_data(self, timeout: int = 10) -> None:
+        """
+        Wait for the device to finish sending any previous data.
+
+        Args:
+            timeout (int): The maximum time in seconds to wait for previous data to be fully received.
+
+        Raises:
+            asyncio.TimeoutError: If the data is not completely received within the timeout period.
+        """
+        self._rx_pending.clear()  # Leftovers of an earlier response are stale now
+        self._split_prompt = False
+        start_time = time.time()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(self.reader.read(1024), timeout=1)
+                logging.debug(f"Wait for previous data:{chunk}")
+                if self.capture and chunk:
+                    self.capture.record(
+                        b"R", chunk.encode(self.encoding) if isinstance(chunk, str) else chunk
+                    )
+                if not chunk:
+                    logging.debug(f"wait for previous data, chunk is empty: {chunk}")
+                    await asyncio.sleep(0.5)
+                    break  # No more data
+                if time.time() - start_time > timeout:
+                    raise asyncio.TimeoutError("Timeout waiting for previous data to be received.")
+            except asyncio.TimeoutError:
+                break  # No data received in the last interval, consider it done
+            except Exception as e:
+                print_log(
+                    message=f"When wait for previous data, occur error: {e}",
+                    log_level=logging.ERROR,
+                )
+                # logging.error(f"When wait for previous data, occur error: {e}")
+                break
+
+    async def get_identity(self, retries: int = 1, use_cache: bool = True) -> dict[str, str]:
+        """
+        Retrieve the relay identity (FID, DEVID, model, ...) with a single "id" command.
+
+        The parsed identity is kept for the session, and stored per relay in the persistent
+        identity cache. When the cache holds an entry younger than IDENTITY_MAX_AGE, it is
+        used without sending any command; its model is looked up again from the FID, so
+        a changed relay_models.json applies at once.
+
+        Args:
+            retries (int): The maximum number of attempts to retrieve the identity.
+            use_cache (bool): If False, always read the identity from the relay.
+
+        Returns:
+            dict[str, str]: The identity fields; empty if the relay gave no valid answer.
+
+        Raises:
+            ConnectionError: If the connection to the device fails after all retries.
+            asyncio.TimeoutError: If the response is not received within the timeout.
+            Exception: If any unexpected error occurs during execution.
+        """
+        if self.identity:
+            return self.identity
+
+        use_cache = use_cache and self.use_caches
+        identity_cache: dict = load_state_file(IDENTITY_CACHE_FILE) if use_cache else {}
+        cached: dict | None = identity_cache.get(self.relay_key)
+        if cached and time.time() - cached.get("LAST_SEEN", 0) < IDENTITY_MAX_AGE:
+            logging.debug(f"Use cached identity of {self.relay_key}: {cached}")
+            self._set_identity({**cached, "MODEL": get_relay_model(cached.get("FID"))})
+            return self.identity
+
+        for attempt in range(1, retries + 1):  # Retry up to `retries` times
+            try:
+                id_response: str = await self.send_command(command="id", show_res=False)
+                log_payload("ID command response", id_response)
+
+                identity: dict[str, str] = parse_id_response(id_response or "")
+                if "FID" in identity:
+                    identity["MODEL"] = get_relay_model(identity["FID"])
+                    identity["LAST_SEEN"] = time.time()
+                    self._set_identity(identity)
+                    if not self.replay_path:
+                        identity_cache = load_state_file(IDENTITY_CACHE_FILE)
+                        identity_cache[self.relay_key] = identity
+                        save_state_file(IDENTITY_CACHE_FILE, identity_cache)
+                    return self.identity
+
+                logging.error(f"FID not found in the response on attempt {attempt}.")
+                if attempt < retries:
+                    await asyncio.sleep(3)  # Wait before retrying
+
+            except (ConnectionError, asyncio.TimeoutError) as e:
+                logging.warning(f"Attempt {attempt} failed: {e}")
+                if attempt == retries:  # If max retries reached, raise the exception
+                    raise e
+            except Exception as e:
+                logging.error(f"Unexpected error occurred: {e}")
+                raise e
+
+        return {}
+
+    def _set_identity(self, identity: dict) -> None:
+        """Keep the identity for this session and refresh the derived attributes."""
+        self.identity = identity
+        self.fid = identity.get("FID")
+
+    @property
+    def model(self) -> str:
+        """The RELAY_MODELS key of the connected relay, "other" if unknown."""
+        return (self.identity or {}).get("MODEL") or get_relay_model(self.fid)
+
+    async def get_relay_name(self) -> str | None:
+        """
+        Retrieve the relay name from the "DEVID" field of the relay identity.
+
+        Returns:
+            str | None: The relay name if found in the "DEVID" field, otherwise None.
+        """
+        identity: dict[str, str] = await self.get_identity()
+        return identity.get("DEVID") or None
+
+    async def get_fid(self, retries: int = 1) -> str | None:
+        """
+        Retrieve the Firmware Identification (FID) from the relay identity.
+
+        Args:
+            retries (int): The maximum number of attempts to retrieve the FID.
+
+        Returns:
+            str | None: The FID value if found in the response, otherwise None.
+
+        Raises:
+            ConnectionError: If the connection to the device fails after all retries.
+            asyncio.TimeoutError: If the response is not received within the timeout.
+        """
+        identity: dict[str, str] = await self.get_identity(retries=retries)
+        return identity.get("FID")
+
+    async def download_waveform(
+        self,
+        event_id: str,
+        cyles: str,
+        samples: str,
+        model: str = "other",
+        auto_cyles: bool = False,
+    ) -> Coroutine[Any, Any, Tuple[str, str | None, str]]:
+        """
+        Download waveform data for the given event ID, event length (cyles), and samples per cycle.
+
+        Args:
+            event_id (str): The event ID for which to download the waveform.
+            cyles (str): The length of the event in cycles. In auto mode this is only the
+                         upper bound of the search and may be empty.
+            samples (str): The number of samples per cycle (4 or all).
+            model (str): The relay model group, e.g. "311L_351".
+            auto_cyles (bool): If True, search the largest valid event length instead of
+                               asking the user when the relay answers "No Data Available".
+
+        Returns:
+            str: The response from the device after successfully downloading the waveform.
+            str: The length of the event in cycles.
+            str: The cev command.
+        """
+        cev_response: str = None
+        cev_command: str = None
+        timeout: int = 60
+        capability: dict[str, Any] = RELAY_MODELS.get(model, RELAY_MODELS["other"])
+        cev_commands: dict[str, str] = capability["cev_commands"]
+        try:
+            if capability["event_length"] and auto_cyles:
+                cev_response, cyles, cev_command = await self.find_event_length(
+                    event_id=event_id,
+                    samples=samples,
+                    model=model,
+                    max_cyles=int(cyles) if is_positive_integer(str(cyles)) else None,
+                    timeout=timeout,
+                )
+                return
+
+            sample_mode: str = samples.lower()
+            if not capability["supported"]:
+                print_log(
+                    message="This model of relay accident waveform download is not supported. "
+                    "Only download 4 samples/cyles accident waveforms.",
+                    log_level=logging.WARN,
+                )
+            elif sample_mode not in cev_commands:
+                print("Samples/Cyles can only enter 4 or all. Now download 4 Samples/Cyles")
+            if sample_mode not in cev_commands:
+                sample_mode = "4"
+
+            while True:
+                cev_command = cev_commands[sample_mode].format(event_id=event_id, cyles=cyles)
+                cev_response = await self.send_command(command=cev_command, timeout=timeout)
+
+                if "No Data Available" not in cev_response:
+                    print("Download waveform completed")
+                    break
+                if capability["event_length"]:
+                    print(
+                        "No Data Available. The entered Event Length is too long. Please re-enter."
+                    )
+                    cyles = input("Please enter Event Length(Cyles) to download: ")
+                    continue
+                print_log(
+                    message=f"No Data can download. Command: {cev_command}",
+                    log_level=logging.ERROR,
+                )
+                break
+
+        except ConnectionError as e:
+            print_log(f"Connect Error occurred (CEV command: {cev_command}): {e}", logging.WARN)
+        except Exception as e:
+            print_log(f"An Error occured (CEV command: {cev_command}): {e}", logging.ERROR)
+
+        finally:
+            return cev_response, cyles, cev_command
+
+    async def find_event_length(
+        self,
+        event_id: str,
+        samples: str,
+        model: str = "311L_351",
+        max_cyles: int | None = None,
+        max_probes: int | None = None,
+        timeout: int = 60,
+    ) -> Tuple[str | None, str, str | None]:
+        """
+        Download an event with the first event length (cyles) the relay accepts.
+
+        The candidates are tried from the length last accepted for the relay model and
+        FID (or the longest one) downward, and the search stops at the first accepted
+        length. A rejected probe only costs a short "No Data Available" reply, and the
+        event is downloaded exactly once.
+
+        Args:
+            event_id (str): The event ID for which to download the waveform.
+            samples (str): The number of samples per cycle (4 or all).
+            model (str): The relay model group used for the cache key.
+            max_cyles (int | None): Upper bound of the search. Default is the max_cyles of
+                                    the model.
+            max_probes (int | None): The maximum number of CEV commands sent for this
+                                     event. Default tries every candidate.
+            timeout (int): The maximum time in seconds to wait for each CEV response.
+
+        Returns:
+            Tuple[str | None, str, str | None]: The CEV response (None if no length was
+                                                accepted), the event length used and the
+                                                last CEV command sent.
+        """
+        cev_commands: dict[str, str] = RELAY_MODELS[model]["cev_commands"]
+        cev_template: str = cev_commands.get(samples.lower(), cev_commands["4"])
+        cache_key: Tuple[str, str] = (model, self.fid or "")
+        cached: int | None = event_length_cache.get(cache_key)
+        candidates: List[int] = event_length_candidates(
+            ceiling=max_cyles or RELAY_MODELS[model]["max_cyles"], cached=cached
+        )
+        logging.debug(f"Event length candidates for {cache_key}: {candidates}, cached {cached}")
+
+        start: int = candidates.index(cached) if cached in candidates else 0
+        tries: List[int] = candidates[start:][: max_probes or None]
+        cev_command: str | None = None
+        for cyles in tries:
+            cev_command = cev_template.format(event_id=event_id, cyles=cyles)
+            cev_response: str = await self.send_command(command=cev_command, timeout=timeout)
+            if "No Data Available" in cev_response:
+                logging.debug(f"No Data Available for {cev_command}, try a shorter event length.")
+                continue
+            event_length_cache[cache_key] = cyles
+            print_log(f"Download waveform completed, Event Length: {cyles}", logging.INFO)
+            return cev_response, str(cyles), cev_command
+
+        print_log(
+            message=f"No valid Event Length found for event {event_id}. Command: {cev_command}",
+            log_level=logging.ERROR,
+        )
+        return None, str(candidates[-1]), cev_command
+
+
+# Typical SEL event report lengths (LER setting), longest first.
+EVENT_LENGTH_CANDIDATES: Tuple[int, ...] = (180, 60, 30, 15)
+
+# Event length accepted by the relay, keyed by (model, FID).
+event_length_cache: dict[Tuple[str, str], int] = {}
+
+
+def event_length_candidates(ceiling: int | None = None, cached: int | None = None) -> List[int]:
+    """
+    Build the ordered list of event lengths to try for an automatic CEV download.
+
+    The list starts at the ceiling, walks down the typical LER values and then keeps
+    halving down to 1 cycle. A cached length within the ceiling is added to the list,
+    so the search can start there, but it does not limit the longer candidates.
+
+    Args:
+        ceiling (int | None): The largest length to try. Default is the longest typical length.
+        cached (int | None): A length previously accepted by the same relay model and FID.
+
+    Returns:
+        List[int]: Event lengths, longest first.
+
+    Example:
+        >>> event_length_candidates()
+        [180, 60, 30, 15, 7, 3, 1]
+
+        >>> event_length_candidates(ceiling=90, cached=45)
+        [90, 60, 45, 30, 15, 7, 3, 1]
+    """
+    ceiling = ceiling or EVENT_LENGTH_CANDIDATES[0]
+    candidates: List[int] = [ceiling] + [c for c in EVENT_LENGTH_CANDIDATES if c < ceiling]
+    while candidates[-1] > 1:
+        candidates.append(candidates[-1] // 2)
+    if cached and cached <= ceiling and cached not in candidates:
+        candidates = sorted(candidates + [cached], reverse=True)
+    return candidates
+
+
+def is_positive_integer(input_str: Any) -> bool:
+    """
+    Checks if the input represents a positive integer.
+
+    Args:
+        input_str (any): The input to check. Can be of any type.
+
+    Returns:
+        bool: True if the input is a positive integer in string format,
+              False otherwise.
+    """
+    if not isinstance(input_str, str):
+        return False
+    return input_str.isdigit() and int(input_str) > 0
+
+
+class HisSerReport:
+    """
+    Stream the his+ser report of a session into its file, section by section.
+
+    The report is opened under a provisional name when the session starts, so a crash
+    leaves the sections received so far on disk. Once the events are selected it is
+    renamed after the selected event range.
+    """
+
+    def __init__(self, save_path: str, relay: str) -> None:
+        """
+        Open the report under its provisional name.
+
+        Args:
+            save_path (str): The folder of the report.
+            relay (str): The relay address, used in the provisional name.
+        """
+        self.save_path: str = save_path
+        started: str = datetime.now().strftime("%Y.%m.%d-%H.%M.%S")
+        self.path: str = os.path.join(
+            save_path, clean_filename(f"his+ser_partial_{relay}_{started}") + ".txt"
+        )
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._sections: int = 0
+
+    def write(self, section: str) -> None:
+        """
+        Append one section (a header line or a relay response).
+
+        Args:
+            section (str): The section text.
+        """
+        if self._sections:
+            self._file.write("\n")
+        self._file.write(section)
+        self._sections += 1
+
+    def flush(self) -> None:
+        """
+        Push the written sections to the file, e.g. at the end of a download phase.
+        """
+        self._file.flush()
+
+    def _move(self, filename: str) -> None:
+        """
+        Rename the report file, closing it while it is moved (Windows cannot rename an
+        open file) and reopening it for appending.
+
+        Args:
+            filename (str): The new file name in the report folder.
+        """
+        self._file.close()
+        new_path: str = os.path.join(self.save_path, filename)
+        os.replace(self.path, new_path)
+        self.path = new_path
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def name_after(self, device_id: str | None, event_times: List[str]) -> str:
+        """
+        Give the report its final name from the selected event range.
+
+        The name is "his+ser_<device>_<event time>" for one event and
+        "his+ser_<device>_<oldest>_to_<newest>" for several events.
+
+        Args:
+            device_id (str | None): The relay name, left out when unknown.
+            event_times (List[str]): The event date times ("YYYY.MM.DD-hh.mm.ss.mmm").
+
+        Returns:
+            str: The report path.
+        """
+        oldest, newest = min(event_times), max(event_times)
+        event_range: str = oldest if oldest == newest else f"{oldest}_to_{newest}"
+        stem: str = f"his+ser_{device_id}_{event_range}" if device_id else f"his+ser_{event_range}"
+        self._move(clean_filename(stem) + ".txt")
+        logging.debug(f"Save his+ser path+filename:{self.path}")
+        return self.path
+
+    def cancel(self) -> None:
+        """
+        Close the report as the cancel marker "his+ser_cancel.txt".
+        """
+        try:
+            self.write("!!!User cancel download.!!!")
+            self._move("his+ser_cancel.txt")
+        except OSError as e:
+            print_log(f"Failed to write to cancel file: {e}", logging.ERROR)
+        finally:
+            self.close()
+
+    def discard(self) -> None:
+        """
+        Close and delete the report, e.g. when no event was selected.
+        """
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            logging.warning(f"Failed to remove {self.path}: {e}")
+
+    def close(self) -> None:
+        """
+        Close the report file.
+        """
+        if not self._file.closed:
+            self._file.close()
+            logging.info(f"his+ser report saved: {self.path} ({self._sections} sections)")
+
+
+def load_relay_list(path: str, default_port: int = 23) -> List[Tuple[str, int]]:
+    """
+    Load a relay list file with one relay per line.
+
+    Lines look like "192.168.1.10", "192.168.1.10:23" or "192.168.1.10,23". Empty lines
+    and text after '#' are ignored, and so are lines without a valid IP address.
+
+    Args:
+        path (str): The relay list file.
+        default_port (int): The port used when a line has none. Default is 23.
+
+    Returns:
+        List[Tuple[str, int]]: The (ip, port) of every relay, without duplicates.
+    """
+    relays: List[Tuple[str, int]] = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file, 1):
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            fields: List[str] = re.split(r"[:,\s]+", line, maxsplit=1)
+            ip: str = fields[0]
+            port: str = fields[1] if len(fields) > 1 else ""
+            if not is_valid_ip(ip) or (port and not port.isdigit()):
+                logging.error(f"Invalid relay in {path} line {line_number}: {line}")
+                continue
+            relay: Tuple[str, int] = (ip, int(port) if port else default_port)
+            if relay not in relays:
+                relays.append(relay)
+    return relays
+
+
+def prompt_samples(samples: str | None, interactive: bool = True) -> str:
+    """
+    Validate the samples per cycle, asking the user until it is "4" or "all".
+
+    Args:
+        samples (str | None): The samples per cycle given as an argument.
+        interactive (bool): If False, an invalid value raises instead of prompting.
+
+    Returns:
+        str: "4" or "all".
+
+    Raises:
+        ValueError: If the value is invalid and prompting is not allowed.
+    """
+    samples = samples.lower() if samples in ['4', 'all', 'ALL'] else '0'
+    if not interactive and samples not in ['4', 'all']:
+        raise ValueError("Samples/Cyles can only be 4 or all.")
+    while samples != "4" and samples.lower() != "all":
+        samples = input("Please enter Samples/Cyles (4 or all) to download: ")
+        if samples != "4" and samples.lower() != "all":
+            print("Samples/Cyles can only enter 4 or all, please enter again.")
+    logging.debug(f"samples：{samples}")
+    return samples.lower()
+
+
+def prompt_cyles() -> str | None:
+    """
+    Ask the user for the event length (cyles) to download.
+
+    Returns:
+        str | None: A positive integer string, or None if the user typed 'exit'.
+    """
+    while True:
+        download_cyles = input(
+            "Please enter Event Length (Cyles) to download (or 'exit' to exit): "
+        ).strip()
+        if download_cyles.lower() == "exit":
+            print("!!!User cancel download.!!!")
+            return None
+        elif is_positive_integer(download_cyles):
+            print(f"Valid Event Length (Cyles) entered: {download_cyles}")
+            return download_cyles
+        else:
+            print("Invalid input. Please enter a positive integer.")
+
+
+# Local 4 samples/cyles CEV from a raw-sample CEV. The AC channels (currents and
+# voltages, not VDC) go through a one-cycle cosine filter like the relay's filtered
+# report; other analog columns are sampled and digital columns are combined per interval.
+CEV_DERIVED_SAMPLES: int = 4
+CEV_AC_CHANNEL_PATTERN: str = r"^[IV](?!DC)"
+# RMS error relative to the channel peak accepted by validate_derived_cev().
+CEV_DERIVE_TOLERANCE: float = 0.05
+
+
+def split_cev_checksum(line: str) -> Tuple[str, str | None]:
+    """
+    Split the trailing checksum field from a CEV line.
+
+    Args:
+        line (str): The line without its line ending.
+
+    Returns:
+        Tuple[str, str | None]: The line before the checksum and the checksum (4 hex
+                                digits), or the line and None if it has no checksum.
+    """
+    match: re.Match | None = re.match(r'^(.*),"([0-9A-Fa-f]{4})"\s*$', line)
+    return (match.group(1), match.group(2).upper()) if match else (line, None)
+
+
+def cev_checksum(body: str, with_comma: bool = False) -> str:
+    """
+    Compute the checksum of a CEV line: the byte sum of the line, modulo 0x10000.
+
+    Args:
+        body (str): The line before the checksum field.
+        with_comma (bool): Also count the comma in front of the checksum field.
+
+    Returns:
+        str: The checksum as 4 upper-case hex digits.
+    """
+    text: str = body + "," if with_comma else body
+    return f"{sum(text.encode('ascii', errors='replace')) & 0xFFFF:04X}"
+
+
+def parse_cev(cev_text: str) -> dict[str, Any]:
+    """
+    Locate the summary, the channel header and the sample rows of a CEV report.
+
+    Args:
+        cev_text (str): The CEV report as saved by download_session.
+
+    Raises:
+        ValueError: If the report has no summary, channel header or sample rows.
+
+    Returns:
+        dict[str, Any]: "lines" (the lines with their endings), "summary" (index of the
+                        summary values line), "summary_columns", "header" (index of the
+                        channel header), "columns", "rows" (the split sample rows),
+                        "first_row" / "end_row" (line indices), "samples_per_cycle" and
+                        "with_comma" (checksum convention of the report).
+    """
+    lines: List[str] = cev_text.splitlines(keepends=True)
+    bodies: List[str] = [split_cev_checksum(line.rstrip("\r\n"))[0] for line in lines]
+    summary_header: int | None = next(
+        (index for index, body in enumerate(bodies) if '"SAM/CYC_A"' in body), None
+    )
+    if summary_header is None or summary_header + 3 >= len(lines):
+        raise ValueError("CEV report has no SAM/CYC_A summary.")
+    summary_columns: List[str] = [cell.strip('"') for cell in bodies[summary_header].split(",")]
+    summary_values: List[str] = bodies[summary_header + 1].split(",")
+    samples_per_cycle: int = int(summary_values[summary_columns.index("SAM/CYC_A")])
+
+    header: int = summary_header + 2
+    columns: List[str] = [cell.strip('"') for cell in bodies[header].split(",")]
+    first_row: int = header + 1
+    end_row: int = first_row
+    rows: List[List[str]] = []
+    while end_row < len(lines):
+        body, checksum = split_cev_checksum(lines[end_row].rstrip("\r\n"))
+        cells: List[str] = body.split(",")
+        if checksum is None or len(cells) != len(columns) or cells[0].startswith('"'):
+            break
+        rows.append(cells)
+        end_row += 1
+    if not rows:
+        raise ValueError("CEV report has no sample rows.")
+
+    body, checksum = split_cev_checksum(lines[first_row].rstrip("\r\n"))
+    return {
+        "lines": lines,
+        "summary": summary_header + 1,
+        "summary_columns": summary_columns,
+        "header": header,
+        "columns": columns,
+        "rows": rows,
+        "first_row": first_row,
+        "end_row": end_row,
+        "samples_per_cycle": samples_per_cycle,
+        "with_comma": checksum == cev_checksum(body, with_comma=True),
+    }
+
+
+def _line_ending(line: str) -> str:
+    """
+    Return the line ending ("\\r\\n", "\\n" or "") of a line.
+    """
+    return line[len(line.rstrip("\r\n")) :]
+
+
+def _cev_line(cells: List[str], ending: str, with_comma: bool) -> str:
+    """
+    Join CEV cells into a line with its checksum.
+
+    Args:
+        cells (List[str]): The cells, quoted where needed.
+        ending (str): The line ending.
+        with_comma (bool): The checksum convention of the report.
+
+    Returns:
+        str: The line.
+    """
+    body: str = ",".join(cells)
+    return f'{body},"{cev_checksum(body, with_comma)}"{ending}'
+
+
+def derive_4_sample_cev(cev_text: str, cev_command: str | None = None) -> str:
+    """
+    Produce the 4 samples/cyles CEV of an event from its raw-sample CEV.
+
+    Each 4 samples/cyles value of an AC channel is the one-cycle cosine filter output
+    2/N * sum(x[j - n] * cos(2 * pi * n / N)) at the raw sample j, which reproduces the
+    fundamental in phase without delay. The window before the first sample repeats the
+    first cycle. Other analog columns keep the value at j, the TRIG column keeps the
+    first marker of the quarter cycle up to j and the hex element columns are OR-ed
+    over it, so short pulses are not lost.
+    The layout, header and settings stay as they are; SAM/CYC_A, SAM/CYC_D, the changed
+    checksums and the echoed command are updated.
+
+    Args:
+        cev_text (str): The raw-sample CEV report.
+        cev_command (str | None): The 4 samples/cyles command echoed on the first line,
+                                  e.g. "CEV L60 1". Default keeps the first line.
+
+    Raises:
+        ValueError: If the report cannot be parsed or its samples per cycle is not a
+                    multiple of 4.
+
+    Returns:
+        str: The 4 samples/cyles CEV report.
+    """
+    cev: dict[str, Any] = parse_cev(cev_text)
+    spc: int = cev["samples_per_cycle"]
+    if spc % CEV_DERIVED_SAMPLES or spc <= CEV_DERIVED_SAMPLES:
+        raise ValueError(f"Cannot derive 4 samples/cyles from {spc} samples/cyles.")
+    step: int = spc // CEV_DERIVED_SAMPLES
+    rows: List[List[str]] = cev["rows"]
+    columns: List[str] = cev["columns"]
+    with_comma: bool = cev["with_comma"]
+    picks: np.ndarray = np.arange(0, len(rows), step)
+
+    numeric: List[int] = [i for i, cell in enumerate(rows[0]) if not cell.startswith('"')]
+    ac_channels: List[int] = [
+        i for i in numeric if re.match(CEV_AC_CHANNEL_PATTERN, columns[i].upper())
+    ]
+    samples: np.ndarray = np.array([[float(row[i]) for i in ac_channels] for row in rows])
+    kernel: np.ndarray = 2 / spc * np.cos(2 * np.pi * np.arange(spc) / spc)
+    padded: np.ndarray = np.vstack([samples[:spc], samples])  # x[-m] = x[spc - m]
+    windows: np.ndarray = np.lib.stride_tricks.sliding_window_view(padded, spc, axis=0)
+    # windows[j + 1] holds x[j - spc + 1 .. j]; reversing the kernel pairs x[j - n] with n.
+    filtered: np.ndarray = windows[picks + 1] @ kernel[::-1]
+    decimals: dict[int, int] = {
+        i: len(rows[0][i].split(".")[1]) if "." in rows[0][i] else 0 for i in numeric
+    }
+
+    out_rows: List[str] = []
+    ending: str = _line_ending(cev["lines"][cev["first_row"]])
+    for k, j in enumerate(picks):
+        interval: List[List[str]] = rows[max(j - step + 1, 0) : j + 1]  # Since the last pick
+        cells: List[str] = list(rows[j])
+        for a, i in enumerate(ac_channels):
+            value: float = round(float(filtered[k, a]), decimals[i]) + 0.0  # No "-0.000"
+            cells[i] = f"{value:.{decimals[i]}f}"
+        for i, cell in enumerate(cells):
+            if i in numeric:
+                continue
+            values: List[str] = [row[i].strip('"') for row in interval]
+            if columns[i].upper() == "TRIG":
+                cells[i] = f'"{next((value for value in values if value), "")}"'
+            elif all(re.fullmatch(r"[0-9A-Fa-f]+", value) for value in values):
+                combined: int = 0
+                for value in values:
+                    combined |= int(value, 16)
+                cells[i] = f'"{combined:0{len(values[0])}X}"'
+        out_rows.append(_cev_line(cells, ending, with_comma))
+
+    lines: List[str] = list(cev["lines"])
+    summary_line: str = lines[cev["summary"]]
+    summary_cells: List[str] = split_cev_checksum(summary_line.rstrip("\r\n"))[0].split(",")
+    for name in ("SAM/CYC_A", "SAM/CYC_D"):
+        if name in cev["summary_columns"]:
+            index: int = cev["summary_columns"].index(name)
+            summary_cells[index] = str(min(int(summary_cells[index]), CEV_DERIVED_SAMPLES))
+    lines[cev["summary"]] = _cev_line(summary_cells, _line_ending(summary_line), with_comma)
+    if cev_command and lines[0].strip().upper().startswith("CEV"):
+        lines[0] = cev_command + _line_ending(lines[0])
+    return "".join(lines[: cev["first_row"]] + out_rows + lines[cev["end_row"] :])
+
+
+def validate_derived_cev(derived_text: str, relay_text: str) -> dict[str, Any]:
+    """
+    Compare a locally derived 4 samples/cyles CEV with the one produced by the relay.
+
+    Args:
+        derived_text (str): The CEV of derive_4_sample_cev().
+        relay_text (str): The 4 samples/cyles CEV downloaded from the relay.
+
+    Returns:
+        dict[str, Any]: "rows" (derived and relay row counts), "channels" (AC channel
+                        name to [RMS error, max error], relative to the relay channel
+                        peak), "digital_mismatches" (rows whose element columns differ)
+                        and "ok" (row counts equal and every RMS error within
+                        CEV_DERIVE_TOLERANCE).
+    """
+    derived: dict[str, Any] = parse_cev(derived_text)
+    relay: dict[str, Any] = parse_cev(relay_text)
+    count: int = min(len(derived["rows"]), len(relay["rows"]))
+    channels: dict[str, List[float]] = {}
+    digital_mismatches: int = 0
+    for i, name in enumerate(relay["columns"]):
+        if name not in derived["columns"]:
+            continue
+        j: int = derived["columns"].index(name)
+        if relay["rows"][0][i].startswith('"'):
+            if name.upper() != "TRIG":
+                digital_mismatches += sum(
+                    int(derived["rows"][k][j].strip('"') or "0", 16)
+                    != int(relay["rows"][k][i].strip('"') or "0", 16)
+                    for k in range(count)
+                )
+            continue
+        if not re.match(CEV_AC_CHANNEL_PATTERN, name.upper()):
+            continue
+        expected: np.ndarray = np.array([float(row[i]) for row in relay["rows"][:count]])
+        error: np.ndarray = (
+            np.array([float(row[j]) for row in derived["rows"][:count]]) - expected
+        )
+        peak: float = float(np.max(np.abs(expected))) or 1.0
+        channels[name] = [
+            round(float(np.sqrt(np.mean(error**2))) / peak, 4),
+            round(float(np.max(np.abs(error))) / peak, 4),
+        ]
+    return {
+        "rows": [len(derived["rows"]), len(relay["rows"])],
+        "channels": channels,
+        "digital_mismatches": digital_mismatches,
+        "ok": len(derived["rows"]) == len(relay["rows"])
+        and all(rms <= CEV_DERIVE_TOLERANCE for rms, _ in channels.values()),
+    }
+
+
+def cev_metadata(cev_text: str) -> dict[str, Any]:
+    """
+    Extract the identity, event and sampling data of a saved CEV report.
+
+    Args:
+        cev_text (str): The CEV report as saved by download_session.
+
+    Raises:
+        ValueError: If the report cannot be parsed, see parse_cev.
+
+    Returns:
+        dict[str, Any]: "command" (the echoed CEV command or None), "fid", "event_time"
+                        ("YYYY/MM/DD hh:mm:ss.mmm" or None), "event", "samples_per_cycle",
+                        "cycles", "channels", "rows" and "checksum_errors" (lines whose
+                        checksum does not match).
+    """
+    cev: dict[str, Any] = parse_cev(cev_text)
+    lines: List[str] = cev["lines"]
+    command: str = lines[0].strip()
+    fid: re.Match | None = re.search(r'FID=([^"\r\n]+)', cev_text)
+
+    event_time: str | None = None
+    checksum_errors: int = 0
+    for index, line in enumerate(lines):
+        body, checksum = split_cev_checksum(line.rstrip("\r\n").lstrip("\x02\x03"))
+        if checksum is not None and checksum != cev_checksum(body, cev["with_comma"]):
+            checksum_errors += 1
+        if body.startswith('"MONTH","DAY","YEAR"') and index + 1 < len(lines):
+            values: List[str] = split_cev_checksum(lines[index + 1].rstrip("\r\n"))[0].split(",")
+            if len(values) >= 7 and all(value.strip().isdigit() for value in values[:7]):
+                month, day, year, hour, minute, second, msec = (v.strip() for v in values[:7])
+                event_time = (
+                    f"{year}/{month:0>2}/{day:0>2} {hour:0>2}:{minute:0>2}:{second:0>2}."
+                    f"{msec:0>3}"
+                )
+
+    summary: dict[str, str] = dict(
+        zip(
+            cev["summary_columns"],
+            split_cev_checksum(lines[cev["summary"]].rstrip("\r\n"))[0].split(","),
+        )
+    )
+    cycles: str = summary.get("NUM_OF_CYC", "").strip()
+    return {
+        "command": command if command.upper().startswith("CEV") else None,
+        "fid": fid.group(1).strip() if fid else None,
+        "event_time": event_time,
+        "event": summary.get("EVENT", "").strip().strip('"'),
+        "samples_per_cycle": cev["samples_per_cycle"],
+        "cycles": int(cycles) if cycles.isdigit() else None,
+        "channels": len(cev["columns"]),
+        "rows": len(cev["rows"]),
+        "checksum_errors": checksum_errors,
+    }
+
+
+# CHI EVENT texts of events that tripped, e.g. "AG T", "BC T" or "TRIP".
+TRIP_EVENT_PATTERN: str = r"(?:^|\s)T$|TRIP"
+
+# Rules of order_events(); the first rule decides, later rules break ties.
+PRIORITY_RULES: Tuple[str, ...] = ("trip", "newest", "oldest")
+DEFAULT_PRIORITY: Tuple[str, ...] = ("trip", "newest")
+
+
+def is_trip_event(event: str) -> bool:
+    """
+    Check whether a CHI EVENT text describes a trip.
+
+    Args:
+        event (str): The EVENT text, with or without quotes.
+
+    Returns:
+        bool: True for trip events.
+    """
+    return re.search(TRIP_EVENT_PATTERN, event.strip().strip('"').upper()) is not None
+
+
+def order_events(
+    events: List[Tuple[str, str, str, str]], rules: Sequence[str] = DEFAULT_PRIORITY
+) -> List[Tuple[str, str, str, str]]:
+    """
+    Order the selected events by priority rules, so the important waveforms come first.
+
+    Args:
+        events (List[Tuple[str, str, str, str]]): The event tuples of parse_chi_response.
+        rules (Sequence[str]): PRIORITY_RULES to apply, the first one decides. An empty
+                               sequence keeps the given order.
+
+    Raises:
+        ValueError: If a rule is unknown.
+
+    Returns:
+        List[Tuple[str, str, str, str]]: The events in download order.
+    """
+    ordered: List[Tuple[str, str, str, str]] = list(events)
+    for rule in reversed(rules):  # Stable sorts: the last sort is the main key
+        if rule == "trip":
+            ordered.sort(key=lambda event: not is_trip_event(event[3]))
+        elif rule == "newest":
+            ordered.sort(key=lambda event: event[2], reverse=True)
+        elif rule == "oldest":
+            ordered.sort(key=lambda event: event[2])
+        else:
+            raise ValueError(f"Unknown priority rule: {rule}")
+    return ordered
+
+
+async def download_session(
+    client: TelnetClient,
+    save_path: str,
+    samples: str | None = None,
+    cyles: int | str | None = None,
+    event_ids: Optional[List[str]] = None,
+    auto_cyles: bool = False,
+    interactive: bool = True,
+    login: bool = True,
+    select_events: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+    priority: Sequence[str] = DEFAULT_PRIORITY,
+    time_budget: float | None = None,
+    progressive: str | None = None,
+    derive_4: bool = False,
+    validate_derived: bool = False,
+) -> dict[str, Any]:
+    """
+    Run the download flow of one relay on a connected client.
+
+    The flow reads the relay identity, collects ACC / PASS / HIS, selects the events from
+    CHI, downloads SER for the event dates into the his+ser report (streamed to disk as
+    the responses arrive, see HisSerReport) and saves one CEV file per event.
+
+    The events are downloaded in priority order. With a time budget, no CEV download is
+    started once the budget is spent or, on a measured link, when its estimated duration
+    no longer fits; the remaining events are listed in a JSON journal next to the files.
+    A progressive download first saves the 4 samples/cyles CEV of every event and then
+    goes back for the raw samples of the events selected by progressive_events().
+    With derive_4 only the raw samples are downloaded and the 4 samples/cyles CEV is
+    derived locally (derive_4_sample_cev), saved under the name the relay's would get.
+
+    Args:
+        client (TelnetClient): The connected client.
+        save_path (str): The folder to save the his+ser and CEV files in.
+        samples (str | None): Samples per cycle, "4" or "all".
+        cyles (int | str | None): Event length (cyles) to download.
+        event_ids (Optional[List[str]]): The event IDs to download.
+        auto_cyles (bool): Search the largest valid event length per event.
+        interactive (bool): If False, never prompt: missing event IDs select nothing and
+                            a missing event length enables auto_cyles.
+        login (bool): If False, skip ACC / PASS because the session is already logged in.
+        select_events (Optional[Callable[[pd.DataFrame], pd.DataFrame]]): Select the events
+            from the CHI records instead of by event IDs.
+        priority (Sequence[str]): The PRIORITY_RULES ordering the downloads.
+        time_budget (float | None): Seconds the whole session may take. Default is no limit.
+        progressive (str | None): The events to upgrade to raw samples after the 4
+                                  samples/cyles pass ("all", "trip" or event IDs), or
+                                  None for a single pass with `samples`.
+        derive_4 (bool): Download raw samples only and derive 4 samples/cyles locally.
+        validate_derived (bool): With derive_4, also download the relay's 4 samples/cyles
+                                 CEV, save the derived one with a " derived" suffix and
+                                 compare them (validate_derived_cev).
+
+    Returns:
+        dict[str, Any]: "events" (the selected event tuples in download order), "files"
+                        (saved file paths), "failed" (CEV file names that failed),
+                        "skipped" (events left out by the time budget), "validation"
+                        (event ID to validate_derived_cev result) and "cancelled".
+    """
+    result: dict[str, Any] = {
+        "events": [],
+        "files": [],
+        "failed": [],
+        "skipped": [],
+        "validation": {},
+        "cancelled": False,
+    }
+    loop = asyncio.get_running_loop()
+    started_at: float = loop.time()
+
+    # One "id" command (or the identity cache) gives FID, DEVID and model.
+    identity: dict[str, str] = await client.get_identity(retries=5)
+    fid: str | None = identity.get("FID")
+    print_log(message=f"FID= {fid}", log_level=logging.INFO)
+
+    model: str = client.model
+    logging.debug(f"Model variable = {model}")
+
+    # The his+ser report is written as the responses arrive.
+    report = HisSerReport(save_path, relay=client.ip)
+    try:
+        report.write(f"Connect IP: {client.ip}")
+        if client.gateway_port is not None:
+            report.write(f"Gateway port: {client.gateway_port}")
+        # Get current time save in his+ser data.
+        now: datetime = datetime.now()
+        formatted_time: str = now.strftime("%Y/%m/%d %A %H:%M:%S.%f")
+
+        report.write(f"Current computer time: {formatted_time}")
+        report.write("==================================================\n")
+        # Collect responses for HIS commands; the login goes one command at a time, the
+        # read-only HIS and CHI go out as one pipelined batch.
+        login_responses: List[str] = await client.login() if login else []
+        if client.writer.is_closing():
+            print_log("Writer is already closing. Command: HIS, CHI", logging.WARN)
+        his_response, chi_response = await client.send_commands(["HIS", "CHI"])
+        for response in [*login_responses, his_response]:
+            print(f"Response from SEL Relay: {response}")
+            report.write(response)
+        report.flush()
+
+        try:
+            valid_events: List[Tuple[str, str, str, str]] = parse_chi_response(
+                chi_in=chi_response,
+                event_ids_arg=event_ids,
+                interactive=interactive,
+                select_events=select_events,
+            )
+        except CancelSignal as e:
+            print_log(e, logging.INFO)
+            report.cancel()
+            result["cancelled"] = True
+            return result
+        if not valid_events:
+            print_log("No event selected to download.", logging.INFO)
+            report.discard()
+            return result
+        valid_events = order_events(valid_events, priority)
+        result["events"] = valid_events
+
+        # Validate samples argument; a progressive download sets the samples per phase.
+        if progressive is None and not derive_4:
+            samples = prompt_samples(samples, interactive=interactive)
+        phases: List[Tuple[str, List[Tuple[str, str, str, str]]]] = cev_phases(
+            model, samples, valid_events, progressive, derive_4, validate_derived
+        )
+        derived_cev: dict[str, str | None] = {}
+
+        # Validate cyles argument; in auto mode it is only the ceiling of each event's search.
+        phase_cyles: str = str(cyles) if is_positive_integer(str(cyles)) else ''
+        logging.debug(f"download cyles：{phase_cyles}")
+        if not phase_cyles and not auto_cyles:
+            if interactive:
+                phase_cyles = prompt_cyles()
+                if phase_cyles is None:
+                    report.cancel()
+                    result["cancelled"] = True
+                    return result
+            else:
+                auto_cyles = True
+
+        # Get SEL Relay Name
+        device_id: str | None = await client.get_relay_name()
+        report.name_after(device_id, [event[2] for event in valid_events])
+        result["files"].append(report.path)
+
+        # Download SER data.
+        downloaded_date: list = []
+        logging.debug(f"vaild_events variable: \n{valid_events}\n")
+        for event_id, date, event_date_time, trip_event in valid_events:
+            if date not in downloaded_date:
+                downloaded_date.append(date)
+        ser_responses: List[str] = await client.send_commands(
+            [f"SER {get_previous_day(date_str=date)} {date}" for date in downloaded_date]
+        )
+        for ser_response in ser_responses:
+            print(f"Response from SEL Relay: {ser_response}")
+            report.write(ser_response)
+
+        # Check for None, case-insensitive "invalid", or "No SER Data"
+        if any(
+            response is None
+            or any(substring in response.lower() for substring in ["invalid", "no ser data"])
+            for response in ser_responses
+        ):
+            ser_response: str = await client.send_command("SER 50")
+            print(f"Response from SEL Relay: {ser_response}")
+            report.write(ser_response)
+        report.flush()
+
+        # Each phase saves its own CEV files; the raw phase of a progressive download only
+        # starts once every 4 samples/cyles file is on disk.
+        for sample_mode, phase_events in phases:
+            # The raw phase searches its own length, the 4 samples/cyles one is not reused.
+            download_cyles: str = phase_cyles
+            if progressive is not None:
+                print_log(
+                    f"Download {len(phase_events)} events with {sample_mode} samples/cyles.",
+                    logging.INFO,
+                )
+            for index, (event_id, date, event_date_time, trip_event) in enumerate(phase_events):
+                if time_budget is not None and not fits_time_budget(
+                    client,
+                    started_at + time_budget - loop.time(),
+                    plan_cev_command(model, fid, sample_mode, download_cyles, auto_cyles, event_id),
+                    sample_mode,
+                ):
+                    for skipped_event in phase_events[index:]:
+                        result["skipped"].append(
+                            {
+                                "event_id": skipped_event[0],
+                                "event_time": skipped_event[2],
+                                "event": skipped_event[3].strip('"'),
+                                "samples": sample_mode,
+                                "reason": "time budget",
+                            }
+                        )
+                        report.write(
+                            f"Skipped by time budget: event {skipped_event[0]} "
+                            f"{skipped_event[2]} ({sample_mode} samples/cyles)"
+                        )
+                    report.flush()
+                    print_log(
+                        f"Time budget of {time_budget:g}s spent, "
+                        f"{len(phase_events) - index} events skipped.",
+                        logging.WARN,
+                    )
+                    break
+
+                cev_response: str = None
+                cev_command: str = None
+
+                # Download waveform
+                logging.debug(f"In for round, event_id variable: {event_id}")
+                cev_response, event_cyles, cev_command = await client.download_waveform(
+                    event_id=event_id,
+                    cyles=download_cyles,
+                    samples=sample_mode,
+                    model=model,
+                    auto_cyles=auto_cyles,
+                )
+                if not auto_cyles:
+                    download_cyles = event_cyles  # A length re-entered by the user is kept
+
+                # Set cev filename
+                cev_filename: str = cev_file_name(
+                    device_id, event_date_time, trip_event, cev_command
+                )
+
+                # Save cev file
+                if cev_response is None:
+                    report.write(f"Failed to download waveform file: {cev_filename}.cev")
+                    report.flush()
+                    result["failed"].append(f"{cev_filename}.cev")
+                else:
+                    cev_path_filename: str = os.path.join(save_path, f"{cev_filename}.cev")
+                    logging.debug(f"CEV filename & path: {cev_path_filename}")
+                    with open(cev_path_filename, "w", encoding="utf-8") as file:
+                        file.write(cev_response)
+                    log_payload("CEV content", cev_response, saved_path=cev_path_filename)
+                    result["files"].append(cev_path_filename)
+
+                    if derive_4 and sample_mode == "all":
+                        derived_cev[event_id] = save_derived_cev(
+                            report,
+                            result,
+                            cev_response,
+                            plan_cev_command(model, fid, "4", event_cyles, False, event_id)[0],
+                            os.path.join(save_path, cev_filename),
+                            (device_id, event_date_time, trip_event),
+                            suffix=" derived" if validate_derived else "",
+                        )
+                    elif sample_mode == "4" and derived_cev.get(event_id):
+                        try:
+                            validation: dict[str, Any] = validate_derived_cev(
+                                derived_cev[event_id], cev_response
+                            )
+                        except ValueError as e:
+                            validation = {"ok": False, "error": str(e)}
+                        result["validation"][event_id] = validation
+                        report.write(
+                            f"Derived 4 samples/cyles check of event {event_id}: {validation}"
+                        )
+                        print_log(
+                            f"Derived 4 samples/cyles of event {event_id} "
+                            f"{'matches' if validation['ok'] else 'differs from'} the relay.",
+                            logging.INFO if validation["ok"] else logging.WARN,
+                        )
+
+        if time_budget is not None:
+            journal: dict[str, Any] = {
+                "relay": client.relay_key,
+                "device_id": device_id,
+                "time_budget": time_budget,
+                "elapsed": round(loop.time() - started_at, 1),
+                "priority": list(priority),
+                "progressive": progressive,
+                "order": [event[0] for event in valid_events],
+                "files": list(result["files"]),
+                "failed": result["failed"],
+                "skipped": result["skipped"],
+            }
+            result["files"].append(save_download_journal(save_path, journal))
+    finally:
+        report.close()
+
+    return result
+
+
+def cev_phases(
+    model: str,
+    samples: str,
+    events: List[Tuple[str, str, str, str]],
+    progressive: str | None = None,
+    derive_4: bool = False,
+    validate_derived: bool = False,
+) -> List[Tuple[str, List[Tuple[str, str, str, str]]]]:
+    """
+    Split the CEV downloads into passes of one sample mode each.
+
+    Args:
+        model (str): The relay model group, e.g. "311L_351".
+        samples (str): The samples per cycle of a single pass, "4" or "all".
+        events (List[Tuple[str, str, str, str]]): The event tuples in download order.
+        progressive (str | None): The progressive_events() selection, or None.
+        derive_4 (bool): Download raw samples only; 4 samples/cyles is derived locally.
+        validate_derived (bool): With derive_4, also download the relay's 4 samples/cyles
+                                 CEV to check the derived one.
+
+    Raises:
+        ValueError: If both progressive and derive_4 are given.
+
+    Returns:
+        List[Tuple[str, List[Tuple[str, str, str, str]]]]: The sample mode and events of
+                                                           each pass, in download order.
+    """
+    if progressive is not None and derive_4:
+        raise ValueError("A progressive download cannot derive 4 samples/cyles locally.")
+    if progressive is None and not derive_4:
+        return [(samples, events)]
+    if "all" not in RELAY_MODELS.get(model, RELAY_MODELS["other"])["cev_commands"]:
+        print_log(
+            f"Relay model {model} has no raw sample download, only 4 samples/cyles is used.",
+            logging.WARN,
+        )
+        return [("4", events)]
+    if derive_4:
+        return [("all", events)] + ([("4", events)] if validate_derived else [])
+    return [("4", events), ("all", progressive_events(events, progressive))]
+
+
+def cev_file_name(
+    device_id: str | None, event_date_time: str, trip_event: str, cev_command: str
+) -> str:
+    """
+    Build the CEV file name (without extension) of an event.
+
+    Args:
+        device_id (str | None): The relay name, or None if unknown.
+        event_date_time (str): The event date time ("YYYY.MM.DD-hh.mm.ss.mmm").
+        trip_event (str): The CHI EVENT text.
+        cev_command (str): The CEV command that produced the report.
+
+    Returns:
+        str: The cleaned file name.
+    """
+    if device_id:
+        return clean_filename(f"{device_id}_{event_date_time}_{trip_event}_{cev_command}")
+    return clean_filename(f"{cev_command}_{trip_event}_{event_date_time}")
+
+
+def save_derived_cev(
+    report: HisSerReport,
+    result: dict[str, Any],
+    raw_cev: str,
+    cev_command: str,
+    raw_path: str,
+    event: Tuple[str | None, str, str],
+    suffix: str = "",
+) -> str | None:
+    """
+    Derive the 4 samples/cyles CEV from a downloaded raw CEV and save it.
+
+    Args:
+        report (HisSerReport): The his+ser report, notes the derived file.
+        result (dict[str, Any]): The download_session result, gets the file or failure.
+        raw_cev (str): The raw-sample CEV report.
+        cev_command (str): The 4 samples/cyles command the relay would have been sent.
+        raw_path (str): The raw CEV path without extension, for the log.
+        event (Tuple[str | None, str, str]): The device ID, event date time and EVENT text.
+        suffix (str): Appended to the file name, e.g. " derived".
+
+    Returns:
+        str | None: The derived report, or None if it could not be derived.
+    """
+    filename: str = cev_file_name(*event, cev_command) + suffix + ".cev"
+    try:
+        derived: str = derive_4_sample_cev(raw_cev, cev_command)
+    except ValueError as e:
+        print_log(f"Cannot derive {filename} from {raw_path}.cev: {e}", logging.ERROR)
+        report.write(f"Failed to derive waveform file: {filename}")
+        result["failed"].append(filename)
+        return None
+    path: str = os.path.join(os.path.dirname(raw_path), filename)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(derived)
+    report.write(f"Derived from raw samples: {filename}")
+    result["files"].append(path)
+    logging.info(f"Derived 4 samples/cyles CEV saved: {path}")
+    return derived
+
+
+def progressive_events(
+    events: List[Tuple[str, str, str, str]], selection: str
+) -> List[Tuple[str, str, str, str]]:
+    """
+    Select the events whose raw samples are fetched in the second progressive pass.
+
+    Args:
+        events (List[Tuple[str, str, str, str]]): The event tuples in download order.
+        selection (str): "all", "trip" (trip events only) or event IDs such as "1,3-5".
+
+    Returns:
+        List[Tuple[str, str, str, str]]: The selected events, in download order.
+
+    Example:
+        >>> events = [("1", "", "", '"AG T"'), ("2", "", "", '"TRIG"')]
+        >>> [event[0] for event in progressive_events(events, "trip")]
+        ['1']
+    """
+    if selection.lower() == "all":
+        return list(events)
+    if selection.lower() == "trip":
+        return [event for event in events if is_trip_event(event[3])]
+    event_ids: List[str] = expand_event_ids(selection)
+    return [event for event in events if event[0] in event_ids]
+
+
+def fits_time_budget(
+    client: TelnetClient, remaining: float, planned: Tuple[str, int, str], samples: str
+) -> bool:
+    """
+    Check whether the next CEV download fits into the rest of the time budget.
+
+    The estimate is only trusted on a link with a measured throughput; otherwise the
+    download starts as long as any budget is left.
+
+    Args:
+        client (TelnetClient): The connected client.
+        remaining (float): The seconds left of the budget.
+        planned (Tuple[str, int, str]): The CEV command of plan_cev_command().
+        samples (str): The samples per cycle, "4" or "all".
+
+    Returns:
+        bool: True if the download should start.
+    """
+    if remaining <= 0:
+        return False
+    if not client.link["rate"]:
+        return True
+    cev_command, cyles, _ = planned
+    needed: float = client.estimate_transfer(
+        cev_command, estimate_cev_bytes(client.model, samples, cyles)
+    )[1]
+    logging.debug(f"Time budget: {remaining:.1f}s left, {cev_command} needs ~{needed:.1f}s.")
+    return needed <= remaining
+
+
+def save_download_journal(save_path: str, journal: dict[str, Any]) -> str:
+    """
+    Save the journal of a time-budgeted download as JSON next to the downloaded files.
+
+    Args:
+        save_path (str): The download folder.
+        journal (dict[str, Any]): The journal.
+
+    Returns:
+        str: The journal path.
+    """
+    relay: str = journal["device_id"] or journal["relay"].replace(":", "_")
+    stem: str = f"journal_{relay}_"
+    stem += datetime.now().strftime("%Y.%m.%d-%H.%M.%S")
+    path: str = os.path.join(save_path, clean_filename(stem) + ".json")
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(journal, file, indent=2, ensure_ascii=False)
+    logging.info(f"Download journal saved: {path}")
+    return path
+
+
+# Size model of the dry-run planner. A CEV row holds the analog channels plus the
+# digital element columns and the checksum; the header holds the event summary and
+# the SETTINGS section.
+PLAN_CEV_HEADER_BYTES: int = 8 * 1024
+PLAN_CEV_ANALOG_BYTES: int = 10  # e.g. "-1234.567,"
+PLAN_CEV_DIGITAL_BYTES: int = 48
+PLAN_SER_BYTES: int = 8 * 1024  # One SER date range, a few dozen rows
+# Assumed link while a relay has no measurement: a 9600 baud serial port behind a port
+# server, answering within a second.
+PLAN_DEFAULT_RATE: float = 960.0
+PLAN_DEFAULT_TTFB: float = 1.0
+
+
+def estimate_cev_bytes(model: str, samples: str, cyles: int) -> int:
+    """
+    Estimate the size of a CEV response from the sample mode, cycles and channel count.
+
+    Args:
+        model (str): The relay model group, e.g. "311L_351".
+        samples (str): The samples per cycle, "4" or "all".
+        cyles (int): The event length in cycles.
+
+    Returns:
+        int: The estimated response size in bytes.
+
+    Example:
+        >>> estimate_cev_bytes("311L_351", "4", 60)
+        46112
+    """
+    capability: dict[str, Any] = RELAY_MODELS.get(model, RELAY_MODELS["other"])
+    samples_per_cycle: int = capability["samples_all"] if samples == "all" else 4
+    row_bytes: int = capability["analog_channels"] * PLAN_CEV_ANALOG_BYTES + PLAN_CEV_DIGITAL_BYTES
+    return PLAN_CEV_HEADER_BYTES + cyles * samples_per_cycle * row_bytes
+
+
+def plan_cev_command(
+    model: str,
+    fid: str | None,
+    samples: str,
+    cyles: int | str | None,
+    auto_cyles: bool,
+    event_id: str,
+) -> Tuple[str, int, str]:
+    """
+    Predict the CEV command download_waveform will send first for an event.
+
+    An automatic event length search starts at the length cached for the model and FID,
+    or at the longest candidate. Models without an event length use the relay LER setting,
+    which is unknown here and assumed to be the shortest typical length.
+
+    Args:
+        model (str): The relay model group, e.g. "311L_351".
+        fid (str | None): The Firmware Identification string of the relay.
+        samples (str): The samples per cycle, "4" or "all".
+        cyles (int | str | None): The event length (cyles), or the ceiling in auto mode.
+        auto_cyles (bool): The event length is searched automatically.
+        event_id (str): The event ID.
+
+    Returns:
+        Tuple[str, int, str]: The CEV command, the event length in cycles and a note on
+                              how the length was chosen.
+    """
+    capability: dict[str, Any] = RELAY_MODELS.get(model, RELAY_MODELS["other"])
+    cev_template: str = capability["cev_commands"].get(samples, capability["cev_commands"]["4"])
+    given: int | None = int(cyles) if is_positive_integer(str(cyles)) else None
+    note: str = ""
+    if not capability["event_length"]:
+        length: int = EVENT_LENGTH_CANDIDATES[-1]
+        note = f"relay LER, {length} cycles assumed"
+    elif auto_cyles or given is None:
+        cached: int | None = event_length_cache.get((model, fid or ""))
+        candidates: List[int] = event_length_candidates(
+            ceiling=given or capability["max_cyles"], cached=cached
+        )
+        length = cached if cached in candidates else candidates[0]
+        note = f"auto length, first try of {len(candidates)}"
+    else:
+        length = given
+    return cev_template.format(event_id=event_id, cyles=length), length, note
+
+
+def derived_cev_command(fid: str | None, command: str | None) -> str | None:
+    """
+    Find the 4 samples/cyles CEV command of the event of a raw-sample CEV command.
+
+    The relay model is found from the FID, the command is matched against the model's
+    "all" command and its event ID and length are put into the model's "4" command.
+
+    Args:
+        fid (str | None): The Firmware Identification string of the relay.
+        command (str | None): The raw-sample CEV command, e.g. "CEV R L60 3".
+
+    Returns:
+        str | None: The 4 samples/cyles command, or None if the model has no raw-sample
+                    command or the command does not match it.
+
+    Examples:
+        >>> derived_cev_command("SEL-351-5-R513-V0-Z103103-D20110429", "CEV R L60 3")
+        'CEV L60 3'
+        >>> derived_cev_command("SEL-487E-3-R300", "CEV 3 S8")
+        'CEV 3'
+        >>> derived_cev_command("SEL-351-5-R513", "CEV 3 S8") is None
+        True
+    """
+    cev_commands: dict[str, str] = RELAY_MODELS[get_relay_model(fid)]["cev_commands"]
+    if not command or "all" not in cev_commands:
+        return None
+    pattern: str = r"\s+".join(re.escape(word) for word in cev_commands["all"].split())
+    pattern = pattern.replace(r"\{event_id\}", r"(?P<event_id>\d+)")
+    pattern = pattern.replace(r"\{cyles\}", r"(?P<cyles>\d+)")
+    match: re.Match | None = re.fullmatch(pattern, command.strip(), re.IGNORECASE)
+    if match is None:
+        return None
+    return cev_commands["4"].format(**{"cyles": "", **match.groupdict()})
+
+
+async def plan_session(
+    client: TelnetClient,
+    samples: str | None = None,
+    cyles: int | str | None = None,
+    event_ids: Optional[List[str]] = None,
+    auto_cyles: bool = False,
+    interactive: bool = True,
+    login: bool = True,
+    select_events: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+    priority: Sequence[str] = DEFAULT_PRIORITY,
+    progressive: str | None = None,
+    derive_4: bool = False,
+    validate_derived: bool = False,
+) -> dict[str, Any]:
+    """
+    Plan the download of one relay without downloading anything.
+
+    Only the identity, ACC / PASS, HIS and CHI are read. The SER and CEV commands that
+    download_session would send are then listed with their estimated size and duration.
+    A size measured earlier for the same command shape (see link_stats.json) is used
+    before the size model; the duration uses the measured time to first byte and
+    throughput of the link, or PLAN_DEFAULT_TTFB / PLAN_DEFAULT_RATE without them.
+
+    Args:
+        client (TelnetClient): The connected client.
+        samples (str | None): Samples per cycle, "4" or "all".
+        cyles (int | str | None): Event length (cyles) to download.
+        event_ids (Optional[List[str]]): The event IDs to plan. Default is every CHI event.
+        auto_cyles (bool): Plan the automatic event length search.
+        interactive (bool): If False, never prompt for the samples per cycle.
+        login (bool): If False, skip ACC / PASS because the session is already logged in.
+        select_events (Optional[Callable[[pd.DataFrame], pd.DataFrame]]): Select the events
+            from the CHI records instead of by event IDs.
+        priority (Sequence[str]): The PRIORITY_RULES ordering the downloads.
+        progressive (str | None): Plan a progressive download, see download_session.
+        derive_4 (bool): Plan raw samples only, see download_session.
+        validate_derived (bool): Also plan the relay's 4 samples/cyles CEV.
+
+    Returns:
+        dict[str, Any]: "relay", "model", "fid", "samples", "rate" (bytes/s), "rate_source",
+                        "events", "commands" (one dict per command with "command",
+                        "bytes", "seconds", "source" and "note"), "total_bytes" and
+                        "total_seconds".
+    """
+    identity: dict[str, str] = await client.get_identity(retries=5)
+    fid: str | None = identity.get("FID")
+    model: str = client.model
+    if login:
+        await client.login()
+    responses: List[str] = await client.send_commands(["HIS", "CHI"])
+
+    if select_events is None and not event_ids:
+
+        def select_events(data: pd.DataFrame) -> pd.DataFrame:  # Plan every event
+            return data
+
+    valid_events: List[Tuple[str, str, str, str]] = parse_chi_response(
+        chi_in=responses[-1],
+        event_ids_arg=event_ids,
+        interactive=False,
+        select_events=select_events,
+    )
+    valid_events = order_events(valid_events, priority)
+    if progressive is None and not derive_4:
+        samples = prompt_samples(samples, interactive=interactive)
+    cev_commands: dict[str, str] = RELAY_MODELS.get(model, RELAY_MODELS["other"])["cev_commands"]
+    phases: List[Tuple[str, List[Tuple[str, str, str, str]]]] = [
+        (sample_mode if sample_mode in cev_commands else "4", phase_events)
+        for sample_mode, phase_events in cev_phases(
+            model, samples, valid_events, progressive, derive_4, validate_derived
+        )
+    ]
+
+    rate: float | None = client.link["rate"]
+    plan: dict[str, Any] = {
+        "relay": client.relay_key,
+        "model": model,
+        "fid": fid,
+        "samples": "+".join(sample_mode for sample_mode, _ in phases),
+        "rate": rate or PLAN_DEFAULT_RATE,
+        "rate_source": "measured" if rate else "assumed",
+        "events": valid_events,
+        "commands": [],
+    }
+
+    def add_command(command: str, model_bytes: int, note: str = "") -> None:
+        nbytes, seconds, source = client.estimate_transfer(command, model_bytes)
+        plan["commands"].append(
+            {
+                "command": command,
+                "bytes": nbytes,
+                "seconds": seconds,
+                "source": source,
+                "note": note,
+            }
+        )
+
+    dates: List[str] = list(dict.fromkeys(event[1] for event in valid_events))
+    for date in dates:
+        add_command(f"SER {get_previous_day(date_str=date)} {date}", PLAN_SER_BYTES)
+
+    for sample_mode, phase_events in phases:
+        for event_id, _, _, _ in phase_events:
+            cev_command, plan_cyles, note = plan_cev_command(
+                model, fid, sample_mode, cyles, auto_cyles or not cyles, event_id
+            )
+            add_command(cev_command, estimate_cev_bytes(model, sample_mode, plan_cyles), note)
+
+    plan["total_bytes"] = sum(command["bytes"] for command in plan["commands"])
+    plan["total_seconds"] = round(sum(command["seconds"] for command in plan["commands"]), 1)
+    return plan
+
+
+def format_plan(plan: dict[str, Any]) -> str:
+    """
+    Format a download plan of plan_session as a table.
+
+    Args:
+        plan (dict[str, Any]): The plan.
+
+    Returns:
+        str: The plan as text.
+    """
+    lines: List[str] = [
+        f"Download plan of {plan['relay']} (model {plan['model']}, FID {plan['fid']})",
+        f"Events: {', '.join(event[0] for event in plan['events']) or 'none'}, "
+        f"samples/cyles: {plan['samples']}, "
+        f"link rate: {plan['rate']:.0f} B/s ({plan['rate_source']})",
+        f"{'Command':<24}{'Bytes':>10}{'Seconds':>10}  Source",
+    ]
+    for command in plan["commands"]:
+        note: str = f", {command['note']}" if command["note"] else ""
+        lines.append(
+            f"{command['command']:<24}{command['bytes']:>10}{command['seconds']:>10.1f}  "
+            f"{command['source']}{note}"
+        )
+    lines.append(f"{'Total':<24}{plan['total_bytes']:>10}{plan['total_seconds']:>10.1f}")
+    return "\n".join(lines)
+
+
+# Local download agent: JSON lines over a localhost TCP socket.
+AGENT_HOST: str = "127.0.0.1"
+AGENT_PORT: int = 50231
+# Close pooled sessions before the relay's own port TIMEOUT drops them to level 0.
+SESSION_IDLE_TIMEOUT: float = 300
+# Seconds the CHI records fetched for the GUI event list are reused before a refetch.
+CHI_CACHE_TTL: float = 120
+
+
+class SessionPool:
+    """
+    Keep connected and logged-in TelnetClient sessions to recently used relays.
+
+    A session is used by one job at a time (one lock per relay), and sessions left idle
+    longer than idle_timeout are closed by reap_idle().
+    """
+
+    def __init__(
+        self,
+        idle_timeout: float = SESSION_IDLE_TIMEOUT,
+        progress: ProgressReporter | None = None,
+    ) -> None:
+        """
+        Initialize an empty session pool.
+
+        Args:
+            idle_timeout (float): Seconds a session may stay unused before it is closed.
+            progress (ProgressReporter | None): The progress reporter of the new clients.
+                                                Default is a disabled reporter.
+        """
+        self.idle_timeout: float = idle_timeout
+        self.progress: ProgressReporter = progress if progress else ProgressReporter(False)
+        self._sessions: dict[str, dict[str, Any]] = {}
+
+    @asynccontextmanager
+    async def session(self, ip: str, port: int) -> AsyncIterator[TelnetClient]:
+        """
+        Lend the logged-in session of a relay, connecting and logging in only if needed.
+
+        A session that fails with a connection error is closed and removed, so the next
+        job starts a new one.
+
+        Args:
+            ip (str): The relay IP address.
+            port (int): The relay Telnet port.
+
+        Yields:
+            TelnetClient: The connected and logged-in client.
+        """
+        key: str = f"{ip}:{port}"
+        entry: dict[str, Any] = self._sessions.setdefault(
+            key, {"client": None, "lock": asyncio.Lock(), "last_used": time.monotonic()}
+        )
+        async with entry["lock"]:
+            client: TelnetClient | None = entry["client"]
             try:
-                if not self.writer.is_closing():
-                    await self.send_command(command="QUI", show_res=True, timeout=1)
-                    await self.send_command(command="EXIT", show_res=True, timeout=1)
-                    print_log("!!!SEL Relay connection closed.!!!", logging.INFO)
-                    self.writer.close()
-                    await asyncio.sleep(0.5)  # Allow some time for the connection to close properly
+                if client is None or not client.writer or client.writer.is_closing():
+                    client = TelnetClient(ip=ip, port=port, progress=self.progress)
+                    entry["client"] = client
+                    await client.connect()
+                    await client.get_identity(retries=3)
+                    await client.login()
+                    print_log(f"Session to {key} opened.", logging.INFO)
                 else:
-                    print_log("Writer is already closing.", logging.WARN)
-            except Exception as e:
-                logging.error(f"Error closing connection: {e}")
+                    logging.info(f"Reuse session to {key}.")
+                yield client
+            except (ConnectionError, OSError, asyncio.TimeoutError):
+                await self._close_entry(key, entry)
                 raise
-        else:
-            logging.warning("Connection was not established.")
-            raise ConnectionError("SEL Relay no connect.")
+            except asyncio.CancelledError:
+                # A cancelled job may leave a response in flight, drop the session at once.
+                if entry["client"] is not None and entry["client"].writer:
+                    entry["client"].writer.close()
+                entry["client"] = None
+                raise
+            finally:
+                entry["last_used"] = time.monotonic()
 
-    async def cancel_all_tasks(self):
-        """
-        Cancel all running asyncio tasks except the current one.
+    async def _close_entry(self, key: str, entry: dict[str, Any]) -> None:
         """
-        current_task = asyncio.current_task()
-        for task in asyncio.all_tasks():
-            if task is not current_task:
-                task.cancel()
-        await asyncio.gather(*asyncio.all_tasks(), return_exceptions=True)
+        Close the client of a pool entry, ignoring errors of a dead connection.
 
-    async def ping_device(self) -> bool:
+        Args:
+            key (str): The relay key, "ip:port".
+            entry (dict[str, Any]): The pool entry.
         """
-        Ping the device to check if it is reachable.
+        client: TelnetClient | None = entry["client"]
+        entry["client"] = None
+        if client is None or not client.writer or client.writer.is_closing():
+            return
+        try:
+            await client.close()
+        except Exception as e:
+            logging.debug(f"Close session to {key}: {e}")
+        print_log(f"Session to {key} closed.", logging.INFO)
 
-        Returns:
-            bool: True if the device responds to ping, False otherwise.
+    async def reap_idle(self) -> None:
         """
-        try:
-            # Use the ping command with 1 packet (Windows)
-            process = await asyncio.create_subprocess_shell(
-                f'ping -n 1 {self.ip}',
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-            )
-            stdout: bytes
-            stderr: bytes
-            stdout, stderr = await process.communicate()
+        Close the sessions that are not in use and idle longer than idle_timeout.
+        """
+        now: float = time.monotonic()
+        for key, entry in list(self._sessions.items()):
+            if entry["client"] is None or entry["lock"].locked():
+                continue
+            if now - entry["last_used"] > self.idle_timeout:
+                async with entry["lock"]:
+                    await self._close_entry(key, entry)
+
+    async def run_reaper(self, interval: float = 30) -> None:
+        """
+        Call reap_idle() every interval seconds until cancelled.
 
-            if process.returncode == 0:
-                logging.info(f"Ping to {self.ip} successful.")
-                return True
-            else:
-                error_mes: str = f"Ping to {self.ip} failed: {stderr.decode().strip()}"
-                print(error_mes)
-                logging.warn(error_mes)
-                return False
-        except Exception as e:
-            print(f"Error during ping: {e}")
-            logging.error(f"Error during ping: {e}")
-            return False
+        Args:
+            interval (float): Seconds between two checks. Default is 30.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            await self.reap_idle()
 
-    async def send_command(self, command: str, show_res: bool = True, timeout: int = 10) -> str:
+    async def close(self, key: str | None = None) -> None:
         """
-        Send a command to the connected device and receive the response.
+        Close one session, or every session when key is None.
 
         Args:
-            command (str): The command to send to the device.
-            show_res (bool): If True, prints a message indicating the command was sent. Default is True.
-            timeout (int): The maximum time in seconds to wait for a response. Default is 10 seconds.
+            key (str | None): The relay key, "ip:port". Default is None (all sessions).
+        """
+        for entry_key, entry in list(self._sessions.items()):
+            if key is None or entry_key == key:
+                async with entry["lock"]:
+                    await self._close_entry(entry_key, entry)
 
-        Raises:
-            ConnectionError: If there is no active connection to any device.
-            asyncio.TimeoutError: If the response is not received within the timeout period.
-            ProhibitedCommandError: If the command is prohibited.
+    def status(self) -> List[dict[str, Any]]:
+        """
+        Describe the pooled sessions.
 
         Returns:
-            str: The response from the device.
+            List[dict[str, Any]]: One dict per relay with "relay", "connected", "busy",
+                                  "idle" (seconds) and "fid".
         """
+        now: float = time.monotonic()
+        return [
+            {
+                "relay": key,
+                "connected": entry["client"] is not None,
+                "busy": entry["lock"].locked(),
+                "idle": round(now - entry["last_used"], 1),
+                "fid": entry["client"].fid if entry["client"] else None,
+            }
+            for key, entry in self._sessions.items()
+        ]
+
+
+async def submit_agent_job(
+    request: dict[str, Any], port: int = AGENT_PORT, timeout: float | None = None
+) -> dict[str, Any]:
+    """
+    Send one request to the local download agent and wait for its reply.
 
-        prohibited_commands: List[str] = ["SER C", "HIS C", "COM C", "2AC"]
+    Args:
+        request (dict[str, Any]): The request, e.g. {"cmd": "download", "ip": ..., "dir": ...}.
+        port (int): The agent port on localhost. Default is AGENT_PORT.
+        timeout (float | None): Seconds to wait for the reply. Default is no limit.
 
-        # Check for prohibited commands
-        for prohibited_command in prohibited_commands:
-            if prohibited_command.lower() in command.lower():
-                raise ProhibitedCommandError(
-                    command, f"The command '{prohibited_command}' is not allowed."
-                )
+    Raises:
+        OSError: If no agent listens on the port.
 
-        if not self.writer:
-            raise ConnectionError("Not connected to SEL Relay.")
+    Returns:
+        dict[str, Any]: The reply; "ok" is False and "error" is set when the job failed.
+    """
+    reader, writer = await asyncio.open_connection(AGENT_HOST, port)
+    try:
+        writer.write(json.dumps(request).encode("utf-8") + b"\n")
+        await writer.drain()
+        reply: bytes = await asyncio.wait_for(reader.readline(), timeout)
+    finally:
+        writer.close()
+    if not reply:
+        raise ConnectionError("The download agent closed the connection.")
+    return json.loads(reply)
 
-        # Wait until the device stops sending data
-        if command.strip().lower() not in ["exit", "qui"]:
-            logging.debug(f"Comaand is [{command}]. Start wait for previous data.")
-            await self._wait_for_previous_data(10)
-            logging.debug(f"Comaand is [{command}]. End waite for previous data.")
 
-        command_print: str = (
-            f"\nSend 【{command}】 command to Relay Device, please wait Relay feedback."
+class CallbackProgress(ProgressReporter):
+    """
+    A progress reporter that hands the transfer state to a callback instead of tqdm.
+
+    The callback gets {"phase", "bytes", "total", "rate"} at most every `mininterval`
+    seconds and once when the phase finishes; it runs on the event loop thread.
+    """
+
+    def __init__(self, callback: Callable[[dict[str, Any]], None], mininterval: float = 0.5):
+        """
+        Initialize the callback progress reporter.
+
+        Args:
+            callback (Callable[[dict[str, Any]], None]): Receives the transfer state.
+            mininterval (float): Minimum seconds between two callbacks.
+        """
+        super().__init__(enabled=True, mininterval=mininterval)
+        self.callback: Callable[[dict[str, Any]], None] = callback
+        self._phase: str | None = None
+        self._total: int | None = None
+        self._bytes: int = 0
+        self._started: float = 0.0
+        self._reported: float = 0.0
+
+    def start(self, phase: str, total: int | None = None) -> None:
+        """Start a new phase, see ProgressReporter.start."""
+        self.finish()
+        self._phase, self._total, self._bytes = phase, total, 0
+        self._started = self._reported = time.monotonic()
+        self._emit()
+
+    def update(self, nbytes: int) -> None:
+        """Add received bytes to the running phase."""
+        if self._phase is None:
+            return
+        self._bytes += nbytes
+        if time.monotonic() - self._reported >= self.mininterval:
+            self._emit()
+
+    def finish(self) -> None:
+        """Report the end of the running phase."""
+        if self._phase is not None:
+            self._emit()
+            self._phase = None
+
+    def _emit(self) -> None:
+        """Hand the current transfer state to the callback."""
+        now: float = time.monotonic()
+        elapsed: float = now - self._started
+        self._reported = now
+        self.callback(
+            {
+                "phase": self._phase,
+                "bytes": self._bytes,
+                "total": self._total,
+                "rate": self._bytes / elapsed if elapsed > 0 else 0.0,
+            }
         )
-        logging.debug(command_print)
-        if show_res is True:
-            print(command_print)
-        command = command + '\r\n'
-        try:
-            self.writer.write(command)
-            await self.writer.drain()
-        except AttributeError as e:
-            print_log(
-                f"Failed to send command due to writer being None or closing: {e}", logging.WARN
-            )
-            raise ConnectionError("Writer is closing or already closed.")
 
-        response: str = ""
-        start_time = time.time()
-        etx: bool = False
 
-        spinner_task = asyncio.create_task(self.spinner())
+class AsyncJobRunner:
+    """
+    Run download jobs in-process on an asyncio event loop in a background thread.
+
+    Jobs are queued and run at most `max_jobs` at a time, on the sessions of a
+    SessionPool, so a second job for the same relay reuses the logged-in session. A job
+    waits for the earlier jobs of its relay before it takes a slot, so a busy relay does
+    not hold back the jobs of other relays. Every change of a job (state, transfer phase, bytes,
+    throughput, result) is handed to `on_update` on the loop thread; a GUI forwards it
+    to its own thread, e.g. with wx.CallAfter. The job states are read and written under
+    one lock, since submit() and cancel() may be called from other threads.
+
+    A job ends "done" (every selected event saved), "partial" (some events saved, the
+    others in "failed"), "failed" (nothing saved, or an error) or "cancelled".
+    """
+
+    def __init__(
+        self,
+        max_jobs: int = 2,
+        on_update: Callable[[dict[str, Any]], None] | None = None,
+        idle_timeout: float = SESSION_IDLE_TIMEOUT,
+    ) -> None:
+        """
+        Initialize the runner; start() starts its thread.
 
+        Args:
+            max_jobs (int): The maximum number of jobs running at the same time.
+            on_update (Callable[[dict[str, Any]], None] | None): Receives a copy of the
+                job state after every change.
+            idle_timeout (float): Seconds an unused relay session stays open.
+        """
+        self.max_jobs: int = max_jobs
+        self.on_update: Callable[[dict[str, Any]], None] | None = on_update
+        self.idle_timeout: float = idle_timeout
+        self.jobs: dict[int, dict[str, Any]] = {}
+        self.loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+        self.pool: SessionPool | None = None
+        self._limit: asyncio.Semaphore | None = None
+        self._relay_locks: dict[str, asyncio.Lock] = {}
+        self._futures: dict[int, Future] = {}
+        self._chi_cache: dict[str, Tuple[float, pd.DataFrame | None]] = {}
+        self._next_id: int = 1
+        self._jobs_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run_loop, name="download-runner", daemon=True)
+
+    def start(self) -> None:
+        """Start the event loop thread."""
+        self._thread.start()
+
+    def _run_loop(self) -> None:
+        """Run the event loop until stop()."""
+        asyncio.set_event_loop(self.loop)
+        self.pool = SessionPool(idle_timeout=self.idle_timeout)
+        self._limit = asyncio.Semaphore(self.max_jobs)
+        reaper: asyncio.Task = self.loop.create_task(self.pool.run_reaper())
         try:
-            while True:
-                if command.strip().lower() in ["exit", "qui"]:
-                    await asyncio.sleep(1)
-                    break
-                chunk: str = await asyncio.wait_for(self.reader.read(1024), timeout)
-                if chunk:
-                    # Replace multiple line breaks with a single line break
-                    chunk = re.sub(r'\r\n+', '\n', chunk)
-                    response += chunk
-                    if "\x03" in chunk:
-                        etx = True
-                        logging.debug("Read response to etx.")
-                    if "=>" in chunk or "Password:" in chunk:
-                        break
-                    if etx and "=" in chunk:
-                        logging.debug("Read response have etx and '=', break.")
-                        break
-                    start_time: float = time.time()  # Reset the timer on receiving valid data
-                else:
-                    if time.time() - start_time > timeout:
-                        raise asyncio.TimeoutError
-        except asyncio.TimeoutError:
-            error_message: str = f"Timeout waiting for response to command: {command.strip()}"
-            logging.error(error_message)
-            raise ConnectionError(error_message)
+            self.loop.run_forever()
         finally:
-            spinner_task.cancel()
+            reaper.cancel()
+            self.loop.run_until_complete(self.pool.close())
+            self.loop.close()
 
-        response = re.sub(r'\r\n+', '\r\n', response)
-        logging.info(f"Command sent: {command}")
-        logging.info(f"Response received: {response}")
-        return response
-
-    async def _wait_for_previous_data(self, timeout: int = 10) -> None:
+    def submit(self, job: dict[str, Any]) -> int:
         """
-        Wait for the device to finish sending any previous data.
+        Queue a download job.
 
         Args:
-            timeout (int): The maximum time in seconds to wait for previous data to be fully received.
+            job (dict[str, Any]): "ip", "dir" and optionally "port", "samples", "cyles",
+                                  "event_id" plus the other download_session options of
+                                  the agent request ("priority", "time_budget", ...).
 
-        Raises:
-            asyncio.TimeoutError: If the data is not completely received within the timeout period.
+        Returns:
+            int: The job ID.
         """
-        start_time = time.time()
-        while True:
-            try:
-                chunk = await asyncio.wait_for(self.reader.read(1024), timeout=1)
-                logging.debug(f"Wait for previous data:{chunk}")
-                if not chunk:
-                    logging.debug(f"wait for previous data, chunk is empty: {chunk}")
-                    await asyncio.sleep(0.5)
-                    break  # No more data
-                if time.time() - start_time > timeout:
-                    raise asyncio.TimeoutError("Timeout waiting for previous data to be received.")
-            except asyncio.TimeoutError:
-                break  # No data received in the last interval, consider it done
-            except Exception as e:
-                print_log(
-                    message=f"When wait for previous data, occur error: {e}",
-                    log_level=logging.ERROR,
-                )
-                # logging.error(f"When wait for previous data, occur error: {e}")
-                break
+        with self._jobs_lock:  # submit() may be called from several threads
+            job_id: int = self._next_id
+            self._next_id += 1
+            self.jobs[job_id] = state = {
+                "id": job_id,
+            "ip": job["ip"],
+                "port": int(job.get("port") or 23),
+                "state": "queued",
+                "phase": None,
+                "bytes": 0,
+                "rate": 0.0,
+                "files": [],
+                "failed": [],
+                "skipped": [],
+                "error": None,
+                "submitted": datetime.now().isoformat(timespec="seconds"),
+                "started": None,
+                "finished": None,
+            }
+            snapshot: dict[str, Any] = dict(state)
+        self._notify(snapshot)
+        future: Future = asyncio.run_coroutine_threadsafe(self._run_job(job_id, job), self.loop)
+        with self._jobs_lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda done: self._on_done(job_id, done))
+        return job_id
+
+    def cancel(self, job_id: int) -> None:
+        """Cancel a queued or running job; a running transfer stops at once."""
+        with self._jobs_lock:
+            future: Future | None = self._futures.get(job_id)
+        if future is not None:
+            future.cancel()
+
+    def active(self) -> List[int]:
+        """Return the IDs of the queued and running jobs."""
+        with self._jobs_lock:
+            futures: List[Tuple[int, Future]] = list(self._futures.items())
+        return [job_id for job_id, future in futures if not future.done()]
+
+    def snapshot(self) -> dict[int, dict[str, Any]]:
+        """Return copies of the job states, taken under the job lock."""
+        with self._jobs_lock:
+            return {job_id: dict(state) for job_id, state in self.jobs.items()}
+
+    def stop(self, timeout: float = 10) -> None:
+        """
+        Cancel every job, close the relay sessions and end the loop thread.
 
-    async def spinner(self):
-        spinner_chars: List[str] = ['|', '/', '-', '\\']
-        idx = 0
-        while True:
-            idx: int = (idx + 1) % len(spinner_chars)
-            await aprint(spinner_chars[idx], end='\r', flush=True)
-            await asyncio.sleep(0.1)
+        Args:
+            timeout (float): Seconds to wait for the thread to end.
+        """
+        for job_id in self.active():
+            self.cancel(job_id)
+        if self._thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout)
 
-    async def get_relay_name(self) -> str | None:
+    def fetch_events(self, ip: str, port: int = 23, max_age: float = CHI_CACHE_TTL) -> Future:
         """
-        Retrieve the relay name from the SEL device using the "id" command.
+        Fetch the CHI records of a relay on the loop thread, reusing a recent result.
 
-        The function sends the "id" command to the SEL device and extracts the relay name from
-        the "DEVID" field in the response.
-        If the "DEVID" field is not found in the response, the function returns None.
+        The fetch uses the pooled session, so the download that usually follows finds it
+        connected and logged in.
+
+        Args:
+            ip (str): The relay IP address.
+            port (int): The relay Telnet port.
+            max_age (float): Seconds a cached result is reused; 0 always refetches.
 
         Returns:
-            str | None: The relay name if found in the "DEVID" field, otherwise None.
+            Future: Resolves to the parse_chi_records() table, or None without CHI data.
         """
-        id_response: str = await self.send_command(command="id", show_res=False)
-        if "DEVID" in id_response:
-            # Extract DEVID value
-            for line in id_response.splitlines():
-                if "DEVID" in line:
-                    return line.split("=")[1].split(",")[0].strip('"')
-        else:
-            return None
-
-    async def get_fid(self, retries: int = 1) -> str | None:
+        key: str = f"{ip}:{port}"
+        cached: Tuple[float, pd.DataFrame | None] | None = self._chi_cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] <= max_age:
+            future: Future = Future()
+            future.set_result(cached[1])
+            return future
+        return asyncio.run_coroutine_threadsafe(self._fetch_events(ip, port), self.loop)
+
+    async def _fetch_events(self, ip: str, port: int) -> pd.DataFrame | None:
         """
-        Retrieve the Firmware Identification (FID) from the SEL device using the "id" command.
-
-        The function attempts to send the "id" command to the SEL device and extracts the FID
-        from the response. It retries up to the specified number of times if the command fails
-        due to connection issues or if the FID is not found in the response.
+        Read and cache the CHI records of a relay.
 
         Args:
-            retries (int): The maximum number of attempts to retrieve the FID.
+            ip (str): The relay IP address.
+            port (int): The relay Telnet port.
 
         Returns:
-            str | None: The FID value if found in the response, otherwise None.
-
-        Raises:
-            ConnectionError: If the connection to the device fails after all retries.
-            asyncio.TimeoutError: If the response is not received within the timeout.
-            Exception: If any unexpected error occurs during execution.
+            pd.DataFrame | None: The parse_chi_records() table.
         """
-        for attempt in range(1, retries + 1):  # Retry up to `retries` times
+        async with self.pool.session(ip, port) as client:
+            responses: List[str] = await client.send_commands(["CHI"])
+        data: pd.DataFrame | None = parse_chi_records(responses[0])
+        self._chi_cache[f"{ip}:{port}"] = (time.monotonic(), data)
+        return data
+
+    def _update(self, job_id: int, **changes: Any) -> None:
+        """Apply changes to a job state and notify."""
+        with self._jobs_lock:
+            state: dict[str, Any] = self.jobs[job_id]
+            state.update(changes)
+            snapshot: dict[str, Any] = dict(state)
+        self._notify(snapshot)
+
+    def _notify(self, snapshot: dict[str, Any]) -> None:
+        """Hand a copy of a job state to on_update."""
+        if self.on_update is not None:
             try:
-                id_response: str = await self.send_command(command="id", show_res=False)
-                logging.debug(f"ID command response: {id_response}")
-
-                if not id_response:  # Handle empty or invalid response
-                    logging.error(f"Empty response received on attempt {attempt}.")
-                    if attempt == retries:
-                        return None
-                    await asyncio.sleep(3)  # Wait before retrying
-                    continue
-
-                if "FID" in id_response:
-                    # Extract FID value
-                    for line in id_response.splitlines():
-                        logging.debug(f"Processing line: {line}")
-                        if "FID" in line:
-                            return line.split("=")[1].split(",")[0].strip('"')
-
-                logging.error("FID not found in the response.")
-                if attempt < retries:
-                    await asyncio.sleep(3)  # Wait before retrying
-
-            except (ConnectionError, asyncio.TimeoutError) as e:
-                logging.warning(f"Attempt {attempt} failed: {e}")
-                if attempt == retries:  # If max retries reached, raise the exception
-                    raise e
+                self.on_update(snapshot)
             except Exception as e:
-                logging.error(f"Unexpected error occurred: {e}")
-                raise e
-
-        return None
+                logging.error(f"Job update callback failed: {e}")
 
-    async def download_waveform(
-        self, event_id: str, cyles: str, samples: str, model: str = "other"
-    ) -> Coroutine[Any, Any, Tuple[str, str | None, str]]:
+    async def _run_job(self, job_id: int, job: dict[str, Any]) -> None:
         """
-        Download waveform data for the given event ID, event length (cyles), and samples per cycle.
+        Run one job on the pooled session of its relay.
 
         Args:
-            event_id (str): The event ID for which to download the waveform.
-            cyles (str): The length of the event in cycles.
-            samples (str): The number of samples per cycle (4 or all).
-
-        Returns:
-            str: The response from the device after successfully downloading the waveform.
-            str: The length of the event in cycles.
-            str: The cev command.
+            job_id (int): The job ID.
+            job (dict[str, Any]): The job, see submit().
         """
-        cev_response: str = None
-        cev_command: str = None
-        timeout: int = 60
+        with self._jobs_lock:
+            state: dict[str, Any] = dict(self.jobs[job_id])
+        relay_lock: asyncio.Lock = self._relay_locks.setdefault(
+            f"{state['ip']}:{state['port']}", asyncio.Lock()
+        )
         try:
-            match model:
-                case "311L_351":
-                    while True:
-                        # Construct the CEV command based on samples per cycle
-                        if samples == "4":
-                            cev_command: str = f"CEV L{cyles} {event_id}"
-                        elif samples.lower() == 'all':
-                            cev_command = f"CEV R L{cyles} {event_id}"
-                        else:
-                            print(
-                                "Samples/Cyles can only enter 4 or all. Now download 4 Samples/Cyles"
-                            )
-                            cev_command = f"CEV L{cyles} {event_id}"
-
-                        cev_response: str = await self.send_command(
-                            command=cev_command, timeout=timeout
-                        )
-
-                        if "No Data Available" in cev_response:
-                            print(
-                                "No Data Available. The entered Event Length is too long. "
-                                "Please re-enter."
-                            )
-                            cyles = input("Please enter Event Length(Cyles) to download: ")
-                        else:
-                            print("Download waveform completed")
-                            break
-
-                case "487E":
-                    while True:
-                        if samples == "4":
-                            cev_command: str = f"CEV {event_id}"
-                        elif samples == 'all':
-                            cev_command = f"CEV {event_id} S8"
-                        else:
-                            print(
-                                "Samples/Cyles can only enter 4 or all. Now download 4 Samples/Cyles"
-                            )
-                            cev_command = f"CEV {event_id}"
-                        cev_response: str = await self.send_command(
-                            command=cev_command, timeout=timeout
-                        )
-                        if "No Data Available" in cev_response:
-                            print_log(
-                                message=f"No Data can download. Command: {cev_command}",
-                                log_level=logging.ERROR,
-                            )
-                            break
-                        print("Download waveform completed")
-                        break
-
-                case "487B":
-                    while True:
-                        if samples == "4":
-                            cev_command: str = f"CEV {event_id}"
-                        elif samples == 'all':
-                            cev_command = f"CEV R {event_id}"
-                        else:
-                            print(
-                                "Samples/Cyles can only enter 4 or all. Now download 4 Samples/Cyles"
-                            )
-                            cev_command = f"CEV {event_id}"
-                        cev_response: str = await self.send_command(
-                            command=cev_command, timeout=timeout
-                        )
-                        if "No Data Available" in cev_response:
-                            print_log(
-                                message=f"No Data can download. Command: {cev_command}",
-                                log_level=logging.ERROR,
-                            )
-                            break
-                        print("Download waveform completed")
-                        break
-
-                case "other":
-                    print_log(
-                        message="This model of relay accident waveform download is not supported. "
-                        "Only download 4 samples/cyles accident waveforms.",
-                        log_level=logging.WARN,
-                    )
-                    cev_command: str = f"CEV {event_id}"
-                    cev_response: str = await self.send_command(
-                        command=cev_command, timeout=timeout
+            async with relay_lock, self._limit:
+                self._update(
+                    job_id, state="running", started=datetime.now().isoformat(timespec="seconds")
+                )
+                event_ids: List[str] = expand_event_ids(job.get("event_id") or "")
+                select_events = request_event_query(job, event_ids)
+                async with self.pool.session(state["ip"], state["port"]) as client:
+                    client.progress = CallbackProgress(
+                        lambda progress: self._update(job_id, **progress)
                     )
-                    if "No Data Available" in cev_response:
-                        print_log(
-                            message=f"No Data can download. Command: {cev_command}",
-                            log_level=logging.ERROR,
+                    try:
+                        result: dict[str, Any] = await download_session(
+                            client=client,
+                            save_path=job["dir"],
+                            samples=job.get("samples") or "4",
+                            cyles=job.get("cyles"),
+                            event_ids=event_ids,
+                            select_events=select_events,
+                            auto_cyles=bool(job.get("auto_cyles", not job.get("cyles"))),
+                            interactive=False,
+                            login=False,
+                            priority=job.get("priority", DEFAULT_PRIORITY),
+                            time_budget=job.get("time_budget"),
+                            progressive=job.get("progressive"),
+                            derive_4=bool(job.get("derive_4")),
+                            validate_derived=bool(job.get("validate_derived")),
                         )
-        except ConnectionError as e:
-            print_log(f"Connect Error occurred (CEV command: {cev_command}): {e}", logging.WARN)
+                    finally:
+                        client.progress = self.pool.progress
+            if not result["failed"]:
+                outcome: str = "done"
+            elif any(path.lower().endswith(".cev") for path in result["files"]):
+                outcome = "partial"  # Some events saved; the HIS/SER report alone is not
+            else:
+                outcome = "failed"
+            self._update(
+                job_id,
+                state=outcome,
+                phase=None,
+                files=result["files"],
+                failed=result["failed"],
+                skipped=result["skipped"],
+                error=None if result["events"] else "No event selected.",
+                finished=datetime.now().isoformat(timespec="seconds"),
+            )
+        except asyncio.CancelledError:
+            self._finish_cancelled(job_id)
+            raise
         except Exception as e:
-            print_log(f"An Error occured (CEV command: {cev_command}): {e}", logging.ERROR)
-
-        finally:
-            return cev_response, cyles, cev_command
-
-
-def is_positive_integer(input_str: Any) -> bool:
-    """
-    Checks if the input represents a positive integer.
-
-    Args:
-        input_str (any): The input to check. Can be of any type.
-
-    Returns:
-        bool: True if the input is a positive integer in string format,
-              False otherwise.
-    """
-    if not isinstance(input_str, str):
-        return False
-    return input_str.isdigit() and int(input_str) > 0
-
-
-def create_cancel_file(save_path: str, his_ser_responses: list) -> None:
-    """
-    Writes a cancellation message and historical responses to a file.
-
-    This function creates or overwrites a file named `his+ser_cancel.txt`
-    in the specified save path. The file will contain the list of historical
-    responses followed by a cancellation message. If an error occurs during
-    file writing, it logs the error.
-
-    Args:
-        save_path (str): The directory path where the cancellation file will
-                         be saved.
-        his_ser_responses (list): A list of strings containing historical
-                                  responses to be written into the file.
-
-    Returns:
-        None
+            logging.error(f"Job {job_id} to {state['ip']} failed: {e}")
+            self._update(
+                job_id,
+                state="failed",
+                phase=None,
+                error=str(e),
+                finished=datetime.now().isoformat(timespec="seconds"),
+            )
 
-    Raises:
-        This function does not raise exceptions directly but logs any
-        errors encountered during file writing.
-    """
-    try:
-        his_ser_path_file: str = os.path.join(save_path, f"his+ser_cancel.txt")
-        with open(his_ser_path_file, "w", encoding="utf-8") as file:
-            file.write("\n".join(his_ser_responses))
-            file.write("\n!!!User cancel download.!!!")
-    except Exception as e:
-        print_log(f"Failed to write to cancel file: {e}", logging.ERROR)
+    def _on_done(self, job_id: int, future: Future) -> None:
+        """Mark a cancelled job on the loop thread; cancel() runs this in its own thread."""
+        if future.cancelled():
+            try:
+                self.loop.call_soon_threadsafe(self._finish_cancelled, job_id)
+            except RuntimeError:  # The loop is closed
+                self._finish_cancelled(job_id)
+
+    def _finish_cancelled(self, job_id: int) -> None:
+        """Mark a job cancelled, also one cancelled before _run_job started."""
+        with self._jobs_lock:
+            state: dict[str, Any] = self.jobs[job_id]
+            if state["finished"] is not None:
+                return
+            state.update(
+                state="cancelled",
+                phase=None,
+                finished=datetime.now().isoformat(timespec="seconds"),
+            )
+            snapshot: dict[str, Any] = dict(state)
+        self._notify(snapshot)
 
 
 class ProhibitedCommandError(Exception):
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+File Description: Tests of the 4 samples/cyles CEV derivation on a synthetic raw CEV.
+Author          : CHEN, JIA-LONG
+Create Date     : 2026-10-19 19:10
+FilePath        : \\test_derive_cev.py
+Copyright © 2026 CHEN JIA-LONG.
+'''
+import math
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "01-src"))
+
+import module as mod  # noqa: E402
+
+SAMPLES_PER_CYCLE: int = 16
+CYCLES: int = 4
+AMPLITUDE: float = 100.0
+DC_OFFSET: float = 25.0
+
+
+def checksum_line(body: str) -> str:
+    """Append the checksum field of a relay CEV line (comma not counted)."""
+    return f'{body},"{mod.cev_checksum(body)}"'
+
+
+def synthetic_cev(command: str = "CEV R L4 1") -> str:
+    """
+    Build a raw-sample CEV with a sine on IA (plus a DC offset), a DC-only IN close to
+    zero, a VDC column, a trigger marker and one element pulse between two 4 samples/cyles
+    picks.
+    """
+    lines = [
+        command,
+        "\x02" + checksum_line('"FID","FID=SEL-351-5-R513-V0-Z103103-D20110429"'),
+        checksum_line('"MONTH","DAY","YEAR","HOUR","MIN","SEC","MSEC"'),
+        checksum_line("5,3,2024,10,11,12,345"),
+        checksum_line('"FREQ","SAM/CYC_A","SAM/CYC_D","NUM_OF_CYC","EVENT"'),
+        checksum_line(f'60.00,{SAMPLES_PER_CYCLE},4,{CYCLES},"AG T"'),
+        checksum_line('"IA","IN","VDC","TRIG","OUT101 OUT102"'),
+    ]
+    for k in range(CYCLES * SAMPLES_PER_CYCLE):
+        ia: float = DC_OFFSET + AMPLITUDE * math.cos(2 * math.pi * k / SAMPLES_PER_CYCLE)
+        trig: str = ">" if k == 21 else ""
+        element: str = "8" if k == 22 else "0"  # Between the picks 20 and 24
+        lines.append(checksum_line(f'{ia:.3f},-0.0001,125.0,"{trig}","{element}"'))
+    lines.append(checksum_line('"SETTINGS"'))
+    lines.append('"RID=FEEDER 1"')
+    return "\r\n".join(lines) + "\r\n\x03"
+
+
+class DeriveFourSampleCevTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.raw: str = synthetic_cev()
+        self.derived: str = mod.derive_4_sample_cev(self.raw, "CEV L4 1")
+        self.cev: dict = mod.parse_cev(self.derived)
+        self.columns: list = self.cev["columns"]
+
+    def column(self, name: str) -> list:
+        return [row[self.columns.index(name)] for row in self.cev["rows"]]
+
+    def test_decimates_to_four_samples_per_cycle(self) -> None:
+        self.assertEqual(self.cev["samples_per_cycle"], 4)
+        self.assertEqual(len(self.cev["rows"]), CYCLES * 4)
+        self.assertTrue(self.derived.startswith("CEV L4 1\r\n"))
+
+    def test_cosine_filter_keeps_the_fundamental_and_removes_dc(self) -> None:
+        for k, value in enumerate(self.column("IA")):
+            expected: float = AMPLITUDE * math.cos(2 * math.pi * k / 4)
+            self.assertAlmostEqual(float(value), expected, places=2)
+
+    def test_no_negative_zero(self) -> None:
+        self.assertEqual(set(self.column("IN")), {"0.0000"})
+        self.assertNotIn("-0.0", self.derived)
+
+    def test_other_columns_are_sampled_or_combined(self) -> None:
+        self.assertEqual(set(self.column("VDC")), {"125.0"})
+        self.assertEqual(self.column("TRIG")[6], '">"')  # Marker at 21, pick at 24
+        self.assertEqual(self.column("OUT101 OUT102")[6], '"8"')
+        self.assertEqual(self.column("OUT101 OUT102").count('"8"'), 1)
+
+    def test_checksums_are_rewritten(self) -> None:
+        metadata: dict = mod.cev_metadata(self.derived)
+        self.assertEqual(metadata["checksum_errors"], 0)
+        self.assertEqual(metadata["samples_per_cycle"], 4)
+        self.assertFalse(self.cev["with_comma"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# coding=utf-8
+'''
+File Description: Replay-driven tests of TelnetClient.send_command / send_commands.
+Author          : CHEN, JIA-LONG
+Create Date     : 2026-10-19 19:40
+FilePath        : \\test_replay.py
+Copyright © 2026 CHEN JIA-LONG.
+'''
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "01-src"))
+
+import module as mod  # noqa: E402
+
+ID_RESPONSE: str = (
+    'ID\r\n\x02"FID=SEL-351-5-R513-V0-Z103103-D20110429","0ABC"\r\n'
+    '"DEVID=FEEDER 1","0123"\r\n\x03'
+)
+HIS_RESPONSE: str = "HIS\r\nFEEDER 1  Date: 05/03/2024\r\n1 05/03/2024 10:11:12.345 AG T\r\n"
+
+
+def write_capture(path: str, records: list) -> None:
+    """Write a session capture of (direction, text) records, 10 ms apart."""
+    with open(path, "wb") as file:
+        file.write(mod.CAPTURE_MAGIC)
+        file.write(b'{"ip": "127.0.0.1", "port": 23}\n')
+        for index, (direction, text) in enumerate(records):
+            data: bytes = text.encode("utf-8")
+            file.write(mod.CAPTURE_RECORD.pack(direction, index * 0.01, len(data)))
+            file.write(data)
+
+
+class ReplayTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.folder = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.folder.name, "session.selcap")
+
+    def tearDown(self) -> None:
+        self.folder.cleanup()
+
+    async def replay(self, records: list) -> mod.TelnetClient:
+        write_capture(self.path, [(b"R", "\r\n=>"), *records])
+        client = mod.TelnetClient(
+            ip="127.0.0.1",
+            port=23,
+            progress=mod.ProgressReporter(enabled=False),
+            replay_path=self.path,
+            replay_speed=0,
+        )
+        await client.connect()
+        return client
+
+    async def test_send_command_with_split_etx(self) -> None:
+        client = await self.replay(
+            [(b"S", "ID\r\n"), (b"R", ID_RESPONSE[:-1]), (b"R", "\x03"), (b"R", "\r\n=")]
+        )
+        response: str = await client.send_command("ID", show_res=False)
+        self.assertTrue(response.endswith("\x03\n="))
+        self.assertEqual(mod.parse_id_response(response)["DEVID"], "FEEDER 1")
+
+    async def test_send_commands_splits_pipelined_responses(self) -> None:
+        client = await self.replay(
+            [
+                (b"S", "ID\r\nHIS\r\n"),
+                # The "=>" after the ETX is split, the HIS echo arrives with it.
+                (b"R", ID_RESPONSE + "\r\n="),
+                (b"R", ">" + HIS_RESPONSE[:10]),
+                (b"R", HIS_RESPONSE[10:] + "=>"),
+            ]
+        )
+        responses: list = await client.send_commands(["ID", "HIS"], show_res=False)
+        self.assertEqual(len(responses), 2)
+        self.assertTrue(responses[0].endswith("\x03\n="))  # The ">" is not carried over
+        self.assertTrue(responses[1].startswith("HIS\n"))
+        self.assertTrue(responses[1].endswith("AG T\n=>"))
+
+    async def test_read_returns_empty_at_end_of_capture(self) -> None:
+        client = await self.replay(
+            [(b"S", "HIS\r\n"), (b"R", HIS_RESPONSE + "=>"), (b"S", "QUI\r\n")]
+        )
+        await client.send_command("HIS", show_res=False)
+        self.assertEqual(await client.reader.read(1024), b"")
+        with self.assertRaises(ConnectionError):
+            await client.send_command("CHI", show_res=False)
+
+
+if __name__ == "__main__":
+    unittest.main()